@@ -0,0 +1,282 @@
+"""Cluster validity metrics that share one distance matrix per feature matrix (notebooks 2.x).
+
+Notebooks 2.1-2.4 call ``silhouette_score`` (O(n^2) distances each time) for
+every k, grid cell, linkage and method, always on the same scaled profile
+matrix. ``ClusterEvaluator`` computes the pairwise distances once and reuses
+them for every labelling:
+
+- the distance matrix is written in row chunks to ``<cache_dir>/<key>/``
+  (raw float64 file plus meta.json, like the other stores) and read back
+  through ``np.memmap``, so memory stays bounded by the chunk size. The key is
+  a hash of the matrix, so another notebook with the same scaled data reuses
+  the file;
+- the silhouette comes from the per-point distance sums to every cluster
+  (distance chunk @ one-hot labels) and matches ``silhouette_score`` /
+  ``silhouette_samples``;
+- Calinski-Harabasz and Davies-Bouldin come from cluster sizes, sums and the
+  distances to the centroids (no pairwise distances);
+- scores are remembered per labelling (and persisted next to the distances),
+  so evaluating a clustering that another notebook already scored is a lookup.
+
+One evaluator can be shared by the threads of a sweep: the lazy distance
+build and the score file updates are serialised by a lock, and files are
+written under a unique temporary name and moved into place with os.replace.
+
+For large n, ``approximate_silhouette`` estimates the mean silhouette from a
+sample stratified by cluster, with a normal confidence interval.
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+
+import numpy as np
+from scipy.stats import norm
+from sklearn.metrics import pairwise_distances, pairwise_distances_chunked
+
+CACHE_VERSION = 1
+DISTANCE_FILE = 'distances.bin'
+SCORES_FILE = 'scores.json'
+META_FILE = 'meta.json'
+
+
+def data_key(X, metric='euclidean'):
+    """Hash of a feature matrix (shape, dtype, values) and the metric."""
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    digest = hashlib.sha1(f'{X.shape}|{metric}|'.encode())
+    digest.update(X.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _silhouette_from_sums(sums, labels, sizes):
+    """Silhouette per point from its distance sums to every cluster (sklearn conventions).
+
+    Args:
+        sums: (m, k) summed distances of m points to the members of each cluster
+        labels: Cluster index of those points (0..k-1)
+        sizes: Points per cluster
+
+    Returns:
+        Silhouette per point (0 for points in singleton clusters)
+    """
+    idx = np.arange(len(labels))
+    own = sizes[labels]
+    a = sums[idx, labels] / np.maximum(own - 1, 1)
+    other = sums / sizes[None, :]
+    other[idx, labels] = np.inf
+    b = other.min(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (b - a) / np.maximum(a, b)
+    return np.nan_to_num(np.where(own > 1, s, 0.0))
+
+
+def _ch_db_scores(X, labels, k):
+    """Calinski-Harabasz and Davies-Bouldin from cluster sums (as in sklearn)."""
+    n = len(X)
+    sizes = np.bincount(labels, minlength=k).astype(float)
+    centroids = np.zeros((k, X.shape[1]))
+    np.add.at(centroids, labels, X)
+    centroids /= sizes[:, None]
+    residual = X - centroids[labels]
+    within = float(np.einsum('ij,ij->', residual, residual))
+    between = float((sizes * ((centroids - X.mean(axis=0)) ** 2).sum(axis=1)).sum())
+    ch = 1.0 if within == 0 else between * (n - k) / (within * (k - 1))
+
+    intra = np.bincount(labels, weights=np.sqrt((residual ** 2).sum(axis=1)), minlength=k) / sizes
+    gaps = np.sqrt(((centroids[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2))
+    if np.allclose(intra, 0) or np.allclose(gaps, 0):
+        return ch, 0.0
+    gaps[gaps == 0] = np.inf
+    return ch, float(((intra[:, None] + intra[None, :]) / gaps).max(axis=1).mean())
+
+
+def _encode(labels, mask):
+    """(selected point indices, labels as 0..k-1, k) for the points in mask."""
+    points = np.flatnonzero(mask)
+    _, codes = np.unique(labels[points], return_inverse=True)
+    return points, codes, int(codes.max() + 1) if len(codes) else 0
+
+
+def _labelling_key(labels, exclude_noise):
+    """Hash of a partition, independent of label values and dtype (noise kept apart)."""
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    codes = np.argsort(np.argsort(first))[inverse]  # numbered by first appearance
+    if exclude_noise:
+        codes = np.where(labels == -1, -1, codes)
+    digest = hashlib.sha1(codes.astype(np.int64).tobytes())
+    digest.update(b'noise' if exclude_noise else b'all')
+    return digest.hexdigest()
+
+
+class ClusterEvaluator:
+    """Silhouette, Davies-Bouldin and Calinski-Harabasz for many labellings of one matrix.
+
+    Args:
+        X: Feature matrix (n_samples, n_features), e.g. X_scaled
+        cache_dir: Directory for the distance matrix and scores (None = keep
+            the distances in memory and do not persist anything)
+        metric: Distance metric for the silhouette
+        chunk_rows: Rows of the distance matrix per block
+    """
+
+    def __init__(self, X, cache_dir=None, metric='euclidean', chunk_rows=1024):
+        self.X = np.ascontiguousarray(X, dtype=np.float64)
+        self.metric = metric
+        self.chunk_rows = chunk_rows
+        self.key = data_key(self.X, metric)
+        self.path = None if cache_dir is None else Path(cache_dir) / self.key
+        self._distances = None
+        self._scores = {}
+        self._lock = threading.Lock()
+        if self.path is not None and (self.path / SCORES_FILE).exists():
+            with open(self.path / SCORES_FILE) as f:
+                self._scores = json.load(f)
+
+    @property
+    def n(self):
+        return len(self.X)
+
+    def distances(self):
+        """(n, n) distance matrix, memory-mapped from the cache when there is one."""
+        if self._distances is not None:
+            return self._distances
+        with self._lock:
+            if self._distances is not None:  # built by another thread meanwhile
+                return self._distances
+            if self.path is None:
+                self._distances = pairwise_distances(self.X, metric=self.metric)
+                return self._distances
+            if not (self.path / META_FILE).exists():
+                self._write_distances()
+            self._distances = np.memmap(self.path / DISTANCE_FILE, dtype=np.float64, mode='r',
+                                        shape=(self.n, self.n))
+        return self._distances
+
+    def _tmp_path(self, name):
+        """Unique temporary file next to name (safe across threads and processes)."""
+        return self.path / f'{name}.{os.getpid()}.{uuid.uuid4().hex}.tmp'
+
+    def _write_json(self, name, payload):
+        tmp = self._tmp_path(name)
+        with open(tmp, 'w') as f:
+            json.dump(payload, f)
+        os.replace(tmp, self.path / name)
+
+    def _write_distances(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self._tmp_path(DISTANCE_FILE)
+        out = np.memmap(tmp, dtype=np.float64, mode='w+', shape=(self.n, self.n))
+        start = 0
+        for chunk in pairwise_distances_chunked(self.X, metric=self.metric,
+                                                working_memory=self.chunk_rows * self.n * 8 / 2 ** 20):
+            out[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        out.flush()
+        del out
+        os.replace(tmp, self.path / DISTANCE_FILE)
+        # written last: marks the matrix complete
+        self._write_json(META_FILE, {'version': CACHE_VERSION, 'n': self.n, 'metric': self.metric})
+
+    def cluster_sums(self, labels, mask=None):
+        """Summed distances of every selected point to the members of each cluster.
+
+        Args:
+            labels: Cluster label per point
+            mask: Points to use as rows and as cluster members (default: all)
+
+        Returns:
+            (points, codes 0..k-1, (len(points), k) sums)
+        """
+        labels = np.asarray(labels)
+        points, codes, k = _encode(labels, np.ones(self.n, bool) if mask is None else np.asarray(mask))
+        onehot = np.zeros((len(points), k))
+        onehot[np.arange(len(points)), codes] = 1
+        full = len(points) == self.n
+        D = self.distances()
+        sums = np.empty((len(points), k))
+        for start in range(0, len(points), self.chunk_rows):
+            rows = points[start:start + self.chunk_rows]
+            block = np.asarray(D[rows[0]:rows[-1] + 1]) if full else np.asarray(D[rows])[:, points]
+            sums[start:start + len(rows)] = block @ onehot
+        return points, codes, sums
+
+    def silhouette_samples(self, labels, mask=None):
+        """Silhouette of every point (NaN outside mask), as sklearn's silhouette_samples."""
+        points, codes, sums = self.cluster_sums(labels, mask)
+        result = np.full(self.n, np.nan)
+        result[points] = _silhouette_from_sums(sums, codes, np.bincount(codes).astype(float))
+        return result
+
+    def scores(self, labels, exclude_noise=False):
+        """Silhouette, Davies-Bouldin and Calinski-Harabasz of one labelling.
+
+        Args:
+            labels: Cluster label per point
+            exclude_noise: Score only the points with label != -1 (DBSCAN)
+
+        Returns:
+            dict with silhouette, davies_bouldin, calinski_harabasz (NaN when
+            fewer than 2 or more than n - 1 clusters)
+        """
+        labels = np.asarray(labels)
+        mask = labels != -1 if exclude_noise else np.ones(self.n, bool)
+        digest = _labelling_key(labels, exclude_noise)
+        if digest in self._scores:
+            return dict(self._scores[digest])
+
+        points, codes, k = _encode(labels, mask)
+        if not 2 <= k <= len(points) - 1:
+            result = {'silhouette': np.nan, 'davies_bouldin': np.nan, 'calinski_harabasz': np.nan}
+        else:
+            _, codes, sums = self.cluster_sums(labels, mask)
+            silhouette = _silhouette_from_sums(sums, codes, np.bincount(codes).astype(float)).mean()
+            ch, db = _ch_db_scores(self.X[points], codes, k)
+            result = {'silhouette': float(silhouette), 'davies_bouldin': db, 'calinski_harabasz': ch}
+        with self._lock:
+            self._scores[digest] = result
+            if self.path is not None:
+                self.path.mkdir(parents=True, exist_ok=True)
+                self._write_json(SCORES_FILE, self._scores)
+        return dict(result)
+
+    def approximate_silhouette(self, labels, sample_size=1000, confidence=0.95, exclude_noise=False,
+                               random_state=None):
+        """Mean silhouette estimated from a sample stratified by cluster.
+
+        Sampled points get their exact silhouette (distances to all points, no
+        cached matrix needed); the stratified mean and its standard error give
+        a normal confidence interval.
+
+        Returns:
+            dict with estimate, ci_low, ci_high, std_error and n_sampled
+        """
+        labels = np.asarray(labels)
+        mask = labels != -1 if exclude_noise else np.ones(self.n, bool)
+        points, codes, k = _encode(labels, mask)
+        sizes = np.bincount(codes, minlength=k)
+        rng = np.random.default_rng(random_state)
+        take = np.minimum(sizes, np.maximum(2, np.round(sample_size * sizes / len(points)).astype(int)))
+        members = np.split(np.argsort(codes, kind='stable'), np.cumsum(sizes)[:-1])
+        sampled = [rng.choice(m, size=t, replace=False) for m, t in zip(members, take)]
+        rows = np.concatenate(sampled)
+
+        onehot = np.zeros((len(points), k))
+        onehot[np.arange(len(points)), codes] = 1
+        sums = pairwise_distances(self.X[points[rows]], self.X[points], metric=self.metric) @ onehot
+        values = _silhouette_from_sums(sums, codes[rows], sizes.astype(float))
+
+        weights = sizes / len(points)
+        estimate, variance, offset = 0.0, 0.0, 0
+        for c, t in enumerate(take):
+            stratum = values[offset:offset + t]
+            offset += t
+            estimate += weights[c] * stratum.mean()
+            if t > 1:
+                variance += weights[c] ** 2 * (1 - t / sizes[c]) * stratum.var(ddof=1) / t
+        error = float(np.sqrt(variance))
+        z = norm.ppf(0.5 + confidence / 2)
+        return {'estimate': float(estimate), 'ci_low': float(estimate - z * error),
+                'ci_high': float(estimate + z * error), 'std_error': error, 'n_sampled': int(len(rows))}
+
@@ -0,0 +1,596 @@
+"""Parameter sweeps for the profile clustering notebooks (2.x) and notebook 5.
+
+DBSCAN: notebook 2.2 fits a new ``DBSCAN`` for every (eps, min_samples) pair,
+and every fit repeats the radius-neighbour search. ``radius_graph`` runs that
+search once at the largest eps and keeps the distances, sorted per row, as a
+sparse matrix. The grid is then derived from that graph, as in HDBSCAN:
+
+- for a given min_samples, a point is core at eps when its core distance
+  (distance to its (min_samples - 1)-th neighbour) is <= eps;
+- core points within eps of each other are linked exactly when their mutual
+  reachability max(d(i, j), core(i), core(j)) is <= eps, so the clusters at
+  every eps are the components of one minimum spanning forest of the mutual
+  reachability graph, cut at eps (one forest per min_samples, not per cell);
+- a border point joins the lowest-numbered cluster among its core neighbours
+  within eps (found in the first min_samples - 1 entries of its row), and
+  clusters are numbered by their first core point. This is the order in which
+  sklearn's DBSCAN expands clusters.
+
+Labels therefore agree with ``DBSCAN(eps, min_samples)`` except at exact ties:
+the graph keeps the distances returned at the largest eps, while sklearn's
+neighbour query at each eps tests ``<= eps`` on its own arithmetic (squared
+distances for the trees, a GEMM expansion for brute force). A pair whose
+distance equals eps up to rounding, which happens mostly on rounded or
+discrete features, can fall on different sides, and a few border or core
+points may be labelled differently.
+
+The k-distance plot reads its distances from the same graph.
+``dbscan_sweep`` scores the grid cells in parallel. Cells that end up with the
+same labelling are scored once.
+
+Hierarchical: notebook 2.3 refits ``AgglomerativeClustering`` for every
+(linkage, k) and builds separate linkage matrices on a 100-point sample for
+the dendrograms. ``hierarchical_sweep`` builds one tree per method on the full
+data from a single condensed distance matrix, replays its merges to cut it at
+every k, and updates the silhouette's per-cluster distance sums merge by merge
+(Calinski-Harabasz and Davies-Bouldin come from cluster sums). The same trees
+feed the dendrograms.
+
+k-means: notebooks 2.1 and 5 refit ``KMeans(n_init=10)`` for every k, one
+after the other. ``kmeans_sweep`` runs all (k, restart) fits in one parallel
+pool; optionally (warm_start) the restarts become chains over the ks that
+warm-start k + 1 from k by seeding a new center inside the cluster with the
+largest SSE. The same restarts give the stability of each k (mean
+pairwise adjusted Rand index). Large cohorts can use ``MiniBatchKMeans`` or a
+streaming mode over row chunks (memmap / chunk factory) in which inertia,
+Davies-Bouldin and Calinski-Harabasz come from passes over the chunks and the
+silhouette from a sample.
+"""
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
+from scipy.cluster.hierarchy import linkage
+from scipy.spatial.distance import pdist
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import (calinski_harabasz_score, davies_bouldin_score,
+                             pairwise_distances_chunked, silhouette_score)
+from sklearn.neighbors import NearestNeighbors
+
+from cluster_metrics import ClusterEvaluator, _ch_db_scores, _silhouette_from_sums
+
+LINKAGE_METHODS = ['ward', 'complete', 'average', 'single']
+SWEEP_COLUMNS = ['eps', 'min_samples', 'n_clusters', 'n_noise', 'noise_ratio',
+                 'silhouette', 'davies_bouldin', 'calinski_harabasz']
+
+
+def radius_graph(X, radius, n_jobs=None):
+    """Sparse graph of all pairs within radius (self excluded), rows sorted by distance.
+
+    Args:
+        X: Feature matrix (n_samples, n_features)
+        radius: Largest eps of the sweep
+        n_jobs: Workers for the neighbour search
+
+    Returns:
+        csr_matrix (n_samples, n_samples) of Euclidean distances
+    """
+    nn = NearestNeighbors(radius=radius, n_jobs=n_jobs).fit(X)
+    graph = nn.radius_neighbors_graph(mode='distance', sort_results=True)
+    graph.indices = graph.indices.astype(np.int32)
+    graph.indptr = graph.indptr.astype(np.int64)
+    return graph
+
+
+def _edges(graph):
+    """(rows, cols, distances) of the graph in CSR order."""
+    rows = np.repeat(np.arange(graph.shape[0]), np.diff(graph.indptr))
+    return rows, graph.indices, graph.data
+
+
+def k_distances(graph, k, X=None):
+    """Distance of every point to its k-th nearest neighbour, counting the point itself.
+
+    Matches ``NearestNeighbors(n_neighbors=k).fit(X).kneighbors(X)[0][:, k - 1]``.
+    Points with fewer than k - 1 neighbours inside the graph radius are
+    queried exactly if X is given, otherwise they get inf.
+    """
+    if k == 1:
+        return np.zeros(graph.shape[0])
+    counts = np.diff(graph.indptr)
+    inside = counts >= k - 1
+    result = np.full(graph.shape[0], np.inf)
+    result[inside] = graph.data[graph.indptr[:-1][inside] + k - 2]
+    if X is not None and not inside.all():
+        X = np.asarray(X)
+        nn = NearestNeighbors(n_neighbors=k).fit(X)
+        result[~inside] = nn.kneighbors(X[~inside])[0][:, k - 1]
+    return result
+
+
+def _reachability_tree(graph, core_distances, max_eps=np.inf, edges=None):
+    """Minimum spanning forest of the mutual reachability graph.
+
+    Edge weights are max(d(i, j), core(i), core(j)), so the edges with weight
+    <= eps connect exactly the core-to-core pairs within eps, and cutting the
+    forest at eps gives the same components.
+
+    Returns:
+        (u, v, weight) arrays of the forest edges
+    """
+    rows, cols, dist = _edges(graph) if edges is None else edges
+    weight = np.maximum(dist, np.maximum(core_distances[rows], core_distances[cols]))
+    keep = weight <= max_eps
+    # zero weights would be read as missing edges; the next float keeps the order
+    weight = np.where(weight[keep] == 0, np.nextafter(0, 1), weight[keep])
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows[keep], minlength=graph.shape[0]))])
+    reach = sparse.csr_matrix((weight, cols[keep], indptr), shape=graph.shape)
+    tree = minimum_spanning_tree(reach).tocoo()
+    return tree.row, tree.col, tree.data
+
+
+def _cut_tree(graph, core_distances, tree, eps, min_samples):
+    """DBSCAN labels at eps from a min_samples reachability forest."""
+    n = graph.shape[0]
+    core = core_distances <= eps
+    labels = np.full(n, -1, dtype=np.int64)
+    if not core.any():
+        return labels
+
+    u, v, weight = tree
+    cut = weight <= eps
+    adjacency = sparse.csr_matrix((np.ones(cut.sum(), dtype=np.int8), (u[cut], v[cut])), shape=(n, n))
+    _, component = connected_components(adjacency, directed=False)
+    core_idx = np.flatnonzero(core)
+    # number clusters by their first core point (sklearn's expansion order)
+    _, first = np.unique(component[core_idx], return_index=True)
+    rank = np.empty(component.max() + 1, dtype=np.int64)
+    rank[component[core_idx[np.sort(first)]]] = np.arange(len(first))
+    labels[core_idx] = rank[component[core_idx]]
+
+    # a non-core point has fewer than min_samples - 1 neighbours within eps,
+    # all of them among the first entries of its (distance sorted) row
+    noise_idx = np.flatnonzero(~core)
+    width = min(max(min_samples - 1, 0), np.diff(graph.indptr)[noise_idx].max(initial=0))
+    if width == 0:
+        return labels
+    start = graph.indptr[noise_idx]
+    count = np.minimum(np.diff(graph.indptr)[noise_idx], width)
+    offset = np.arange(width)
+    valid = offset[None, :] < count[:, None]
+    positions = (start[:, None] + offset[None, :])[valid]
+    point = np.broadcast_to(noise_idx[:, None], valid.shape)[valid]
+    neighbour = graph.indices[positions]
+    reach = (graph.data[positions] <= eps) & core[neighbour]
+    if reach.any():
+        best = np.full(n, np.iinfo(np.int64).max)
+        np.minimum.at(best, point[reach], labels[neighbour[reach]])
+        reached = best != np.iinfo(np.int64).max
+        labels[reached] = best[reached]
+    return labels
+
+
+def dbscan_labels(graph, eps, min_samples):
+    """DBSCAN labels (-1 = noise) from a radius graph built with radius >= eps.
+
+    Args:
+        graph: Output of radius_graph
+        eps: Neighbourhood radius
+        min_samples: Neighbours (including the point) needed for a core point
+
+    Returns:
+        Integer labels, as ``DBSCAN(eps, min_samples).fit_predict(X)`` up to
+        pairs whose distance ties eps within rounding (see the module docstring)
+    """
+    core_distances = k_distances(graph, min_samples)
+    tree = _reachability_tree(graph, core_distances, max_eps=eps)
+    return _cut_tree(graph, core_distances, tree, eps, min_samples)
+
+
+def _cluster_scores(X, labels):
+    """Silhouette, Davies-Bouldin and Calinski-Harabasz on the non-noise points."""
+    mask = labels != -1
+    if len(np.unique(labels[mask])) < 2:
+        return np.nan, np.nan, np.nan
+    X, labels = X[mask], labels[mask]
+    return (silhouette_score(X, labels), davies_bouldin_score(X, labels),
+            calinski_harabasz_score(X, labels))
+
+
+def dbscan_sweep(X, eps_values, min_samples_values, graph=None, scores=True, n_jobs=-1, evaluator=None):
+    """Evaluate DBSCAN on an eps x min_samples grid with one neighbour search.
+
+    Labels are those of dbscan_labels: the same as refitting DBSCAN per cell
+    except for distances that tie an eps value within floating-point rounding.
+
+    Args:
+        X: Feature matrix (n_samples, n_features)
+        eps_values: Radii to try
+        min_samples_values: min_samples values to try
+        graph: radius_graph(X, radius >= max(eps_values)) to reuse, built if None
+        scores: Compute silhouette / Davies-Bouldin / Calinski-Harabasz (NaN
+            when there are fewer than 2 clusters)
+        n_jobs: Parallel workers (threads) for the scores
+        evaluator: cluster_metrics.ClusterEvaluator of X to score with its
+            shared distance matrix (and score cache)
+
+    Returns:
+        (DataFrame with SWEEP_COLUMNS, one row per grid cell,
+        {(eps, min_samples): labels})
+    """
+    X = np.asarray(X, dtype=float)
+    eps_values = [float(eps) for eps in eps_values]
+    if graph is None:
+        graph = radius_graph(X, max(eps_values), n_jobs=n_jobs)
+    edges = _edges(graph)
+
+    labelings = {}
+    for min_samples in min_samples_values:
+        min_samples = int(min_samples)
+        core_distances = k_distances(graph, min_samples)
+        tree = _reachability_tree(graph, core_distances, max(eps_values), edges)
+        for eps in eps_values:
+            labelings[eps, min_samples] = _cut_tree(graph, core_distances, tree, eps, min_samples)
+    labelings = {(eps, int(m)): labelings[eps, int(m)] for eps in eps_values for m in min_samples_values}
+
+    distinct = {}  # labelling bytes -> representative labels
+    for labels in labelings.values():
+        distinct.setdefault(labels.tobytes(), labels)
+    if scores and evaluator is not None:
+        results = Parallel(n_jobs=n_jobs, prefer='threads')(
+            delayed(evaluator.scores)(labels, exclude_noise=True) for labels in distinct.values())
+        results = [(r['silhouette'], r['davies_bouldin'], r['calinski_harabasz']) for r in results]
+    elif scores:
+        results = Parallel(n_jobs=n_jobs, prefer='threads')(
+            delayed(_cluster_scores)(X, labels) for labels in distinct.values())
+    else:
+        results = [(np.nan, np.nan, np.nan)] * len(distinct)
+    score_of = dict(zip(distinct, results))
+
+    rows = []
+    for (eps, min_samples), labels in labelings.items():
+        n_noise = int((labels == -1).sum())
+        rows.append((eps, min_samples, int(labels.max() + 1), n_noise, n_noise / len(labels),
+                     *score_of[labels.tobytes()]))
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS), labelings
+
+
+def linkage_trees(X, methods=LINKAGE_METHODS, distances=None):
+    """Linkage matrix per method from one shared condensed distance matrix.
+
+    Ward is computed from the same Euclidean distances (scipy's Ward update is
+    exact for Euclidean input), so pdist runs once for all methods.
+
+    Args:
+        X: Feature matrix (n_samples, n_features)
+        methods: Linkage methods ('ward', 'complete', 'average', 'single', ...)
+        distances: Condensed Euclidean distances of X (pdist), computed if None
+
+    Returns:
+        {method: linkage matrix Z}
+    """
+    if distances is None:
+        distances = pdist(np.asarray(X, dtype=float))
+    return {method: linkage(distances, method=method) for method in methods}
+
+
+def _roots_after(Z, n_leaves, n_merges):
+    """Tree node that holds every leaf after the first n_merges merges (union-find)."""
+    parent = np.arange(2 * n_leaves - 1)
+    for step, (a, b) in enumerate(Z[:n_merges, :2].astype(np.int64)):
+        parent[a] = parent[b] = n_leaves + step
+    roots = np.arange(n_leaves)
+    while True:  # pointer jumping until every leaf points at its root
+        up = parent[roots]
+        if np.array_equal(up, roots):
+            return roots
+        roots = parent[up]
+
+
+def _compact(labels):
+    """Relabel to 0..k-1 in order of first appearance."""
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    return order[inverse]
+
+
+def _score_tree(X, Z, method, ks, scores, evaluator=None):
+    """Labels and metrics at every k of one linkage tree.
+
+    Clusters are cut by replaying the merges, like AgglomerativeClustering's
+    cut, so ties in merge heights never change k. For the silhouette, the
+    distance sums of every point to every cluster are computed once at the
+    largest scored k; each later merge only adds two columns (O(n)).
+    """
+    n = len(X)
+    ks = sorted({int(k) for k in ks if 1 <= k <= n}, reverse=True)
+    rows, labelings = [], {}
+    if not ks:
+        return rows, labelings
+    k_max = ks[0]
+    leaf_col = _compact(_roots_after(Z, n, n - k_max))
+    node_col = {node: col for node, col in zip(_roots_after(Z, n, n - k_max), leaf_col)}
+    sums = None
+
+    wanted = set(ks)
+    for step in range(n - k_max, n - 1):
+        k = n - step
+        if k in wanted:
+            labels = _compact(leaf_col)
+            labelings[method, k] = labels
+            if scores and 2 <= k <= n - 1:
+                if sums is None and evaluator is not None:
+                    sums = np.zeros((n, k_max))
+                    _, _, cluster_sums = evaluator.cluster_sums(leaf_col)
+                    sums[:, np.unique(leaf_col)] = cluster_sums
+                elif sums is None:
+                    onehot = np.zeros((n, k_max))
+                    onehot[np.arange(n), leaf_col] = 1
+                    sums = np.vstack(list(pairwise_distances_chunked(
+                        X, reduce_func=lambda chunk, start: chunk @ onehot)))
+                _, first = np.unique(labels, return_index=True)
+                cluster_sums = sums[:, leaf_col[first]]
+                sizes = np.bincount(labels, minlength=k).astype(float)
+                ch, db = _ch_db_scores(X, labels, k)
+                rows.append((method, k, _silhouette_from_sums(cluster_sums, labels, sizes).mean(), db, ch))
+            else:
+                rows.append((method, k, np.nan, np.nan, np.nan))
+        a, b = Z[step, :2].astype(np.int64)
+        col_a, col_b = node_col.pop(a), node_col.pop(b)
+        node_col[n + step] = col_a
+        leaf_col[leaf_col == col_b] = col_a
+        if sums is not None:
+            sums[:, col_a] += sums[:, col_b]
+    if 1 in wanted:
+        labelings[method, 1] = np.zeros(n, dtype=np.int64)
+        rows.append((method, 1, np.nan, np.nan, np.nan))
+    return rows, labelings
+
+
+def hierarchical_sweep(X, methods=LINKAGE_METHODS, n_clusters_range=range(2, 11), scores=True, n_jobs=-1,
+                       evaluator=None):
+    """Evaluate agglomerative clustering for every linkage method and k from one tree each.
+
+    Args:
+        X: Feature matrix (n_samples, n_features)
+        methods: Linkage methods
+        n_clusters_range: Numbers of clusters to cut at
+        scores: Compute silhouette / Davies-Bouldin / Calinski-Harabasz
+        n_jobs: Parallel workers (one task per method)
+        evaluator: cluster_metrics.ClusterEvaluator of X to take the
+            silhouette distance sums from its shared distance matrix
+
+    Returns:
+        (DataFrame with linkage, n_clusters, silhouette, davies_bouldin,
+        calinski_harabasz; {method: linkage matrix};
+        {(method, k): labels, same partition as AgglomerativeClustering})
+    """
+    X = np.asarray(X, dtype=float)
+    methods = list(methods)
+    trees = linkage_trees(X, methods)
+    results = Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(_score_tree)(X, trees[method], method, n_clusters_range, scores, evaluator) for method in methods)
+
+    rows, labelings = [], {}
+    for method_rows, method_labels in results:
+        rows.extend(sorted(method_rows, key=lambda row: row[1]))
+        labelings.update(method_labels)
+    columns = ['linkage', 'n_clusters', 'silhouette', 'davies_bouldin', 'calinski_harabasz']
+    return pd.DataFrame(rows, columns=columns), trees, labelings
+
+
+def _chunks(X, chunk_rows):
+    """Row blocks of an array / memmap, or the blocks of a chunk factory (callable)."""
+    if callable(X):
+        yield from (np.asarray(chunk, dtype=float) for chunk in X())
+        return
+    for start in range(0, len(X), chunk_rows):
+        yield np.asarray(X[start:start + chunk_rows], dtype=float)
+
+
+def _assignment_stats(X, model, chunk_rows, rng):
+    """One pass: labels, per-cluster SSE and one member per cluster sampled with probability ∝ d².
+
+    The members are drawn with a weighted reservoir (largest log(u) / d² per
+    cluster), so streaming mode needs no second pass.
+    """
+    centers = model.cluster_centers_
+    k = len(centers)
+    sse = np.zeros(k)
+    best_key, candidates = np.full(k, -np.inf), centers.copy()
+    known = None if callable(X) else getattr(model, 'labels_', None)
+    labels, start = [], 0
+    for chunk in _chunks(X, chunk_rows):
+        chunk_labels = model.predict(chunk) if known is None else known[start:start + len(chunk)]
+        start += len(chunk)
+        labels.append(chunk_labels)
+        d2 = ((chunk - centers[chunk_labels]) ** 2).sum(axis=1)
+        sse += np.bincount(chunk_labels, weights=d2, minlength=k)
+        with np.errstate(divide='ignore'):
+            keys = np.log(rng.random(len(chunk))) / d2
+        order = np.lexsort((keys, chunk_labels))  # per cluster, largest key last
+        last = np.r_[chunk_labels[order][1:] != chunk_labels[order][:-1], True]
+        top = order[last]
+        better = keys[top] > best_key[chunk_labels[top]]
+        best_key[chunk_labels[top][better]] = keys[top][better]
+        candidates[chunk_labels[top][better]] = chunk[top][better]
+    return np.concatenate(labels), {'sse': sse, 'candidates': candidates}
+
+
+def _split_worst(centers, stats, n_new):
+    """Initial centers for k + n_new: the old centers plus a d²-sampled member of each of the
+    n_new highest-SSE clusters."""
+    worst = np.argsort(stats['sse'])[::-1][:n_new]
+    return np.vstack([centers, stats['candidates'][worst]])
+
+
+def _fit_kmeans(X, k, init, seed, batch_size, max_iter, n_epochs, chunk_rows):
+    """One k-means run (KMeans, MiniBatchKMeans or streaming partial_fit) plus its assignment pass."""
+    if callable(X):
+        model = MiniBatchKMeans(n_clusters=k, init=init, n_init=1, random_state=seed,
+                                batch_size=batch_size or chunk_rows)
+        for _ in range(n_epochs):
+            for chunk in _chunks(X, chunk_rows):
+                model.partial_fit(chunk)
+    elif batch_size:
+        model = MiniBatchKMeans(n_clusters=k, init=init, n_init=1, random_state=seed,
+                                batch_size=batch_size, max_iter=max_iter).fit(X)
+    else:
+        model = KMeans(n_clusters=k, init=init, n_init=1, random_state=seed, max_iter=max_iter).fit(X)
+    labels, stats = _assignment_stats(X, model, chunk_rows, np.random.default_rng(seed))
+    if callable(X):  # partial_fit only labels the last chunk
+        model.labels_ = labels
+        model.inertia_ = float(stats['sse'].sum())
+    return model, stats
+
+
+def _kmeans_chain(X, ks, seeds, warm_start, batch_size, max_iter, n_epochs, chunk_rows):
+    """Fit every k of one restart; with warm_start each k starts from the split previous solution."""
+    models, previous = {}, None
+    for k, seed in zip(ks, seeds):
+        if warm_start and previous is not None and k <= 2 * previous[0].n_clusters:
+            init = _split_worst(previous[0].cluster_centers_, previous[1], k - previous[0].n_clusters)
+        else:
+            init = 'k-means++'
+        model, stats = _fit_kmeans(X, k, init, seed, batch_size, max_iter, n_epochs, chunk_rows)
+        models[k] = model
+        previous = (model, stats)
+    return models
+
+
+def _stream_scores(X, labels, k, sample_size, seed, chunk_rows):
+    """Silhouette on a random sample, Davies-Bouldin and Calinski-Harabasz from two passes over chunks."""
+    n = len(labels)
+    counts = np.bincount(labels, minlength=k).astype(float)
+    sums, within = None, 0.0
+    start = 0
+    for chunk in _chunks(X, chunk_rows):
+        chunk_labels = labels[start:start + len(chunk)]
+        start += len(chunk)
+        if sums is None:
+            sums = np.zeros((k, chunk.shape[1]))
+        np.add.at(sums, chunk_labels, chunk)
+    means = sums / np.maximum(counts, 1)[:, None]
+
+    rng = np.random.default_rng(seed)
+    keep = rng.random(n) < min(1.0, sample_size / n)
+    intra, sample, start = np.zeros(k), [], 0
+    for chunk in _chunks(X, chunk_rows):
+        chunk_labels = labels[start:start + len(chunk)]
+        residual = chunk - means[chunk_labels]
+        within += float(np.einsum('ij,ij->', residual, residual))
+        intra += np.bincount(chunk_labels, weights=np.sqrt((residual ** 2).sum(axis=1)), minlength=k)
+        sample.append(chunk[keep[start:start + len(chunk)]])
+        start += len(chunk)
+    grand = sums.sum(axis=0) / n
+    between = float((counts * ((means - grand) ** 2).sum(axis=1)).sum())
+    ch = 1.0 if within == 0 else between * (n - k) / (within * (k - 1))
+    intra /= np.maximum(counts, 1)
+    gaps = np.sqrt(((means[:, None, :] - means[None, :, :]) ** 2).sum(axis=2))
+    gaps[gaps == 0] = np.inf
+    db = float(((intra[:, None] + intra[None, :]) / gaps).max(axis=1).mean())
+    sample_labels = labels[keep]
+    silhouette = (silhouette_score(np.vstack(sample), sample_labels)
+                  if 2 <= len(np.unique(sample_labels)) < len(sample_labels) else np.nan)
+    return silhouette, db, ch
+
+
+def _pairwise_ari(labelings):
+    """Mean adjusted Rand index over all pairs of labellings (0..k-1 labels, one bincount per pair)."""
+    n = len(labelings[0])
+    pairs = lambda counts: float((counts * (counts - 1)).sum()) / 2
+    sizes = [pairs(np.bincount(labels).astype(float)) for labels in labelings]
+    total = n * (n - 1) / 2
+    values = []
+    for i, a in enumerate(labelings):
+        for j in range(i + 1, len(labelings)):
+            b = labelings[j]
+            joint = pairs(np.bincount(a.astype(np.int64) * (b.max() + 1) + b).astype(float))
+            expected = sizes[i] * sizes[j] / total
+            mean = (sizes[i] + sizes[j]) / 2
+            values.append(1.0 if mean == expected else (joint - expected) / (mean - expected))
+    return float(np.mean(values)) if values else np.nan
+
+
+def kmeans_sweep(X, ks, n_init=10, warm_start=False, batch_size=None, max_iter=300, n_epochs=3,
+                 chunk_rows=100_000, evaluator=None, silhouette_sample=10_000, n_jobs=-1,
+                 random_state=None):
+    """k-means for several k with restarts in parallel, warm starts and stability.
+
+    Every restart is a chain over the sorted ks. With warm_start the first k
+    is seeded with k-means++ and each next k starts from the previous centers
+    plus, for the highest-SSE cluster(s), a member drawn with probability
+    proportional to its squared distance to the center (k-means++ restricted
+    to the worst cluster). Few iterations are needed from there, and the draws
+    differ per chain, so the restarts still explore different solutions. The
+    first restart of every k stays a cold k-means++ fit, so the best result is
+    never worse than that restart; the remaining n_init - 1 are warm chains.
+    Warm chains can still settle in worse local optima than n_init cold
+    restarts (best inertia several percent higher at some k), so the default
+    is cold restarts, as ``KMeans(n_init)``. All chains (or, without
+    warm_start, all (k, restart) runs) run in one joblib pool.
+
+    Args:
+        X: Feature matrix (array or np.memmap), or a callable returning an
+            iterable of row chunks for data that does not fit in memory
+            (streaming mode: MiniBatchKMeans.partial_fit over n_epochs passes)
+        ks: Numbers of clusters
+        n_init: Restarts per k (chains)
+        warm_start: Split the previous solution instead of re-seeding every k
+            (for all restarts but the first; faster, not as good as cold restarts)
+        batch_size: Use MiniBatchKMeans with this batch size (arrays)
+        max_iter: Iterations per fit (KMeans / MiniBatchKMeans)
+        n_epochs: Passes over the chunks in streaming mode
+        chunk_rows: Rows per block for assignment passes and streaming batches
+        evaluator: cluster_metrics.ClusterEvaluator of X for exact, cached scores
+        silhouette_sample: Without an evaluator, larger data get a sampled
+            silhouette (stratified estimate for arrays, random rows when streaming)
+        n_jobs: Parallel workers (joblib semantics)
+        random_state: Seed
+
+    Returns:
+        (summary DataFrame with k, inertia, inertia_std, silhouette,
+        davies_bouldin, calinski_harabasz and stability (mean pairwise ARI
+        between restarts), dict k -> best fitted model with labels_)
+    """
+    ks = sorted({int(k) for k in ks})
+    seeds = np.random.SeedSequence(random_state).generate_state(len(ks) * n_init)
+    seeds = seeds.reshape(n_init, len(ks))
+    args = (batch_size, max_iter, n_epochs, chunk_rows)
+    if warm_start:
+        runs = Parallel(n_jobs=n_jobs)(
+            [delayed(_kmeans_chain)(X, [k], [seeds[0, i]], False, *args) for i, k in enumerate(ks)]
+            + [delayed(_kmeans_chain)(X, ks, chain_seeds, True, *args) for chain_seeds in seeds[1:]])
+        cold = {k: runs[i][k] for i, k in enumerate(ks)}
+        chains = [cold] + runs[len(ks):]
+    else:
+        runs = Parallel(n_jobs=n_jobs)(
+            delayed(_kmeans_chain)(X, [k], [seeds[r, i]], False, *args)
+            for r in range(n_init) for i, k in enumerate(ks))
+        chains = [{k: runs[r * len(ks) + i][k] for i, k in enumerate(ks)} for r in range(n_init)]
+
+    rows, models = [], {}
+    for i, k in enumerate(ks):
+        restarts = [chain[k] for chain in chains]
+        best = min(restarts, key=lambda model: model.inertia_)
+        models[k] = best
+        labels = best.labels_
+        if evaluator is not None:
+            scores = evaluator.scores(labels)
+            silhouette, db, ch = scores['silhouette'], scores['davies_bouldin'], scores['calinski_harabasz']
+        elif callable(X):
+            silhouette, db, ch = _stream_scores(X, labels, k, silhouette_sample, seeds[0, i], chunk_rows)
+        else:
+            Xa = np.asarray(X, dtype=float)
+            ch, db = _ch_db_scores(Xa, labels, k)
+            if len(Xa) <= silhouette_sample:
+                silhouette = silhouette_score(Xa, labels)
+            else:
+                silhouette = ClusterEvaluator(Xa).approximate_silhouette(
+                    labels, sample_size=silhouette_sample, random_state=int(seeds[0, i]))['estimate']
+        rows.append({'k': k, 'inertia': best.inertia_,
+                     'inertia_std': float(np.std([model.inertia_ for model in restarts])),
+                     'silhouette': silhouette, 'davies_bouldin': db, 'calinski_harabasz': ch,
+                     'stability': _pairwise_ari([model.labels_ for model in restarts])})
+    return pd.DataFrame(rows), models
@@ -0,0 +1,286 @@
+"""Beat-level ECG processing: batch R-peak detection, HRV and beat segmentation.
+
+Peaks and RR intervals use the same flat layout as the signals: one flat array
+of values plus an offsets array of length n_series + 1, so HRV statistics are
+segment reductions (np.bincount) instead of per-patient Python lists.
+
+R-peak rule (as in notebook 6): ``find_peaks`` with height 0.5 * std(signal)
+and a minimum distance of 0.5 s (<= 120 bpm). Detection runs one find_peaks
+call per chunk of signals instead of one per patient, with chunks spread over
+a thread pool.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.fft import rfft, rfftfreq
+from scipy.signal import find_peaks
+
+# Feature order used for X_hrv in notebook 6
+HRV_FEATURES = ['mean_rr', 'std_rr', 'rmssd', 'pnn50', 'hr_mean', 'lf_hf_ratio']
+HRV_DEFAULTS = {'mean_rr': 1000.0, 'std_rr': 0.0, 'rmssd': 0.0, 'pnn50': 0.0,
+                'hr_mean': 60.0, 'lf_hf_ratio': 1.0}
+
+PEAKS_FILE = 'r_peaks.i64'
+PEAK_OFFSETS_FILE = 'r_peak_offsets.i64'
+PEAKS_META_FILE = 'r_peaks.json'
+
+
+def _flat_to_groups(values, offsets):
+    """Yield (rows, matrix) blocks of equal-length series from a flat layout."""
+    lengths = np.diff(offsets)
+    for m in np.unique(lengths):
+        rows = np.flatnonzero(lengths == m)
+        yield rows, values[offsets[rows, np.newaxis] + np.arange(m)]
+
+
+def detect_block(X, fs=500, height_factor=0.5, min_distance_s=0.5, height=None):
+    """R-peaks of an equal-length (n_series, n_samples) block with a single find_peaks call.
+
+    Rows are scaled so that every row's height threshold becomes 1, then laid
+    end to end with NaN gaps of ``distance`` samples. NaN never compares as a
+    neighbour, so peaks of different rows cannot suppress each other and the
+    result equals running find_peaks row by row.
+
+    Args:
+        X: Equal-length series matrix
+        fs: Sampling frequency (Hz), default 500
+        height_factor: Minimum peak height in units of the row std
+        min_distance_s: Minimum distance between peaks in seconds
+        height: Optional per-row thresholds; default height_factor * row std
+            (e.g. a streaming window's std applied to its tail only)
+
+    Returns:
+        (row, position) arrays of the detected peaks
+    """
+    n, m = X.shape
+    if m < fs * 0.5 or n == 0:  # Need at least 0.5 seconds
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    distance = max(1, int(fs * min_distance_s))
+    if height is None:
+        height = X.std(axis=1) * height_factor
+    height = np.asarray(height, dtype=float).reshape(n, 1)
+    scaled = np.full((n, m + distance), np.nan)
+    # Constant rows (height 0) have no local maxima, so any scale works for them
+    scaled[:, :m] = X / np.where(height > 0, height, 1.0)
+    peaks, _ = find_peaks(scaled.ravel(), height=1.0, distance=distance)
+    rows, positions = np.divmod(peaks, m + distance)
+    return rows, positions
+
+
+def detect_r_peaks_batch(X, fs=500, offsets=None, height_factor=0.5, min_distance_s=0.5,
+                         chunk_size=256, n_workers=None):
+    """Detect R-peaks for a batch of signals.
+
+    Args:
+        X: (n_series, n_samples) matrix, or a flat values buffer with offsets
+        fs: Sampling frequency (Hz), default 500
+        offsets: Ragged offsets (length n_series + 1)
+        height_factor: Minimum peak height in units of the signal std
+        min_distance_s: Minimum distance between peaks in seconds
+        chunk_size: Series per chunk
+        n_workers: Threads (default: os.cpu_count())
+
+    Returns:
+        (peaks, peak_offsets): peak sample indices relative to each series start,
+        flat, with peak_offsets of length n_series + 1
+    """
+    if offsets is None:
+        X = np.asarray(X, dtype=float)
+        groups = [(np.arange(len(X)), X)]
+        n_series = len(X)
+    else:
+        offsets = np.asarray(offsets, dtype=np.int64)
+        groups = list(_flat_to_groups(np.asarray(X, dtype=float), offsets))
+        n_series = len(offsets) - 1
+
+    tasks = [(rows[i:i + chunk_size], block[i:i + chunk_size])
+             for rows, block in groups for i in range(0, len(rows), chunk_size)]
+
+    def run(task):
+        rows, block = task
+        series, positions = detect_block(block, fs, height_factor, min_distance_s)
+        return rows[series], positions
+
+    with ThreadPoolExecutor(max_workers=n_workers or os.cpu_count()) as pool:
+        results = list(pool.map(run, tasks))
+
+    series = np.concatenate([r[0] for r in results]) if results else np.empty(0, dtype=np.int64)
+    positions = np.concatenate([r[1] for r in results]) if results else np.empty(0, dtype=np.int64)
+    order = np.lexsort((positions, series))
+    counts = np.bincount(series, minlength=n_series)
+    peak_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return positions[order].astype(np.int64), peak_offsets
+
+
+def rr_intervals(peaks, peak_offsets, fs=500):
+    """RR intervals (ms) of every series as a flat array with offsets."""
+    peaks = np.asarray(peaks)
+    peak_offsets = np.asarray(peak_offsets, dtype=np.int64)
+    counts = np.diff(peak_offsets)
+    rr = np.diff(peaks) / fs * 1000
+    # Drop the differences that straddle two series
+    keep = np.ones(len(rr), dtype=bool)
+    boundaries = peak_offsets[1:-1] - 1
+    keep[boundaries[(boundaries >= 0) & (boundaries < len(rr))]] = False
+    rr_counts = np.maximum(counts - 1, 0)
+    rr_offsets = np.concatenate([[0], np.cumsum(rr_counts)]).astype(np.int64)
+    return rr[keep], rr_offsets
+
+
+def _segment_ids(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _lf_hf_ratio(rr, rr_offsets):
+    """LF/HF power ratio of the RR series (normalized frequencies, >= 10 intervals)."""
+    ratio = np.full(len(rr_offsets) - 1, HRV_DEFAULTS['lf_hf_ratio'])
+    lengths = np.diff(rr_offsets)
+    for m in np.unique(lengths[lengths >= 10]):
+        rows = np.flatnonzero(lengths == m)
+        block = rr[rr_offsets[rows, np.newaxis] + np.arange(m)]
+        power = np.abs(rfft(block - block.mean(axis=1, keepdims=True), axis=1)) ** 2
+        freqs = rfftfreq(m, 1.0)
+        lf = power[:, (freqs >= 0.04) & (freqs < 0.15)].sum(axis=1)
+        hf = power[:, (freqs >= 0.15) & (freqs < 0.4)].sum(axis=1)
+        ratio[rows] = lf / (hf + 1e-10)
+    return ratio
+
+
+def hrv_features_batch(peaks, peak_offsets, fs=500):
+    """HRV statistics for every series from flat R-peak indices.
+
+    Series with fewer than two peaks get the defaults used in notebook 6
+    (60 bpm, no variability). Statistics of successive RR differences are NaN
+    when there are too few differences: rmssd needs one (two RR intervals),
+    sdsd two. A single interval carries no beat-to-beat variability, and 0
+    would look like a measured value.
+
+    Returns:
+        DataFrame with HRV_FEATURES first, then n_beats, min_rr, max_rr, median_rr, sdsd
+    """
+    rr, rr_offsets = rr_intervals(peaks, peak_offsets, fs=fs)
+    n = len(rr_offsets) - 1
+    n_rr = np.diff(rr_offsets)
+    seg = _segment_ids(rr_offsets)
+    safe_n = np.maximum(n_rr, 1)
+
+    mean_rr = np.bincount(seg, weights=rr, minlength=n) / safe_n
+    std_rr = np.sqrt(np.maximum(np.bincount(seg, weights=rr ** 2, minlength=n) / safe_n - mean_rr ** 2, 0.0))
+
+    # Successive differences inside each series
+    d_rr = np.diff(rr)
+    d_keep = seg[1:] == seg[:-1] if len(rr) > 1 else np.zeros(0, dtype=bool)
+    d_rr, d_seg = d_rr[d_keep], seg[1:][d_keep]
+    n_d = np.bincount(d_seg, minlength=n)
+    safe_d = np.maximum(n_d, 1)
+    rmssd = np.sqrt(np.bincount(d_seg, weights=d_rr ** 2, minlength=n) / safe_d)
+    d_mean = np.bincount(d_seg, weights=d_rr, minlength=n) / safe_d
+    sdsd = np.sqrt(np.maximum(np.bincount(d_seg, weights=d_rr ** 2, minlength=n) / safe_d - d_mean ** 2, 0.0))
+    rmssd[n_d < 1] = np.nan
+    sdsd[n_d < 2] = np.nan
+    pnn50 = np.bincount(d_seg, weights=(np.abs(d_rr) > 50).astype(float), minlength=n) / safe_n
+
+    features = pd.DataFrame({
+        'mean_rr': mean_rr,
+        'std_rr': std_rr,
+        'rmssd': rmssd,
+        'pnn50': pnn50,
+        'hr_mean': np.where(mean_rr > 0, 60000 / np.where(mean_rr > 0, mean_rr, 1.0), 60.0),
+        'lf_hf_ratio': _lf_hf_ratio(rr, rr_offsets),
+        'n_beats': np.diff(np.asarray(peak_offsets)),
+        'min_rr': np.nan,
+        'max_rr': np.nan,
+        'median_rr': np.nan,
+        'sdsd': sdsd,
+    })
+    has_rr = n_rr > 0
+    if has_rr.any():
+        starts = rr_offsets[:-1][has_rr]
+        features.loc[has_rr, 'min_rr'] = np.minimum.reduceat(rr, starts)
+        features.loc[has_rr, 'max_rr'] = np.maximum.reduceat(rr, starts)
+        order = np.lexsort((rr, seg))
+        rr_sorted = rr[order]
+        lo = starts + (n_rr[has_rr] - 1) // 2
+        hi = starts + n_rr[has_rr] // 2
+        features.loc[has_rr, 'median_rr'] = (rr_sorted[lo] + rr_sorted[hi]) / 2
+
+    too_few = n_rr < 1
+    for name, default in HRV_DEFAULTS.items():
+        features.loc[too_few, name] = default
+    return features
+
+
+def segment_beats(X, peaks, peak_offsets, fs=500, offsets=None, before_s=0.25, after_s=0.45):
+    """Cut a fixed window around every R-peak into a (n_beats, window) matrix.
+
+    Beats whose window would cross the start or end of their series are dropped.
+
+    Args:
+        X: (n_series, n_samples) matrix, or a flat values buffer with offsets
+        peaks, peak_offsets: Output of detect_r_peaks_batch
+        fs: Sampling frequency (Hz), default 500
+        offsets: Ragged offsets for flat X
+        before_s, after_s: Window before/after the R-peak in seconds
+
+    Returns:
+        (beats, beat_series, beat_peaks): beat matrix, series index and R-peak
+        position of every kept beat
+    """
+    if offsets is None:
+        X = np.asarray(X)
+        offsets = np.arange(X.shape[0] + 1, dtype=np.int64) * X.shape[1]
+        values = X.reshape(-1)
+    else:
+        values = np.asarray(X)
+        offsets = np.asarray(offsets, dtype=np.int64)
+
+    before, after = int(round(before_s * fs)), int(round(after_s * fs))
+    peaks = np.asarray(peaks, dtype=np.int64)
+    beat_series = _segment_ids(np.asarray(peak_offsets, dtype=np.int64))
+    lengths = np.diff(offsets)
+    valid = (peaks - before >= 0) & (peaks + after <= lengths[beat_series])
+    beat_series, beat_peaks = beat_series[valid], peaks[valid]
+
+    starts = offsets[beat_series] + beat_peaks - before
+    beats = values[starts[:, np.newaxis] + np.arange(before + after)]
+    return beats, beat_series, beat_peaks
+
+
+def save_r_peaks(path, peaks, peak_offsets, params=None):
+    """Cache R-peaks next to the signals (e.g. in the preprocessed store directory)."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    (path / PEAKS_FILE).write_bytes(np.asarray(peaks, dtype=np.int64).tobytes())
+    (path / PEAK_OFFSETS_FILE).write_bytes(np.asarray(peak_offsets, dtype=np.int64).tobytes())
+    with open(path / PEAKS_META_FILE, 'w') as f:
+        json.dump({'n_series': len(peak_offsets) - 1, 'n_peaks': len(peaks),
+                   'params': params or {}}, f, indent=2)
+
+
+def load_r_peaks(path, n_series=None, params=None):
+    """Load cached R-peaks; returns None if missing or cached for a different series count or params."""
+    path = Path(path)
+    if not (path / PEAKS_META_FILE).exists():
+        return None
+    with open(path / PEAKS_META_FILE) as f:
+        meta = json.load(f)
+    if n_series is not None and meta['n_series'] != n_series:
+        return None
+    if params is not None and meta['params'] != json.loads(json.dumps(params)):
+        return None
+    peaks = np.fromfile(path / PEAKS_FILE, dtype=np.int64, count=meta['n_peaks'])
+    peak_offsets = np.fromfile(path / PEAK_OFFSETS_FILE, dtype=np.int64, count=meta['n_series'] + 1)
+    return peaks, peak_offsets
+
+
+def select_peaks(peaks, peak_offsets, rows):
+    """Peaks of a subset of series (flat + offsets), e.g. cohort rows of a cached store-wide detection."""
+    rows = np.asarray(rows, dtype=np.int64)
+    counts = peak_offsets[rows + 1] - peak_offsets[rows]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    idx = np.repeat(peak_offsets[rows] - offsets[:-1], counts) + np.arange(offsets[-1])
+    return peaks[idx], offsets
@@ -0,0 +1,344 @@
+"""Parallel WFDB ECG loader backed by a memory-mapped multi-lead signal store.
+
+The raw ``.dat`` files under ``Data/time-series-project2025`` are decoded once,
+all leads at a time, into a single float32 array of shape
+(n_leads, total_samples) on disk. Record i occupies the columns
+``offset[i]:offset[i] + length[i]``, so every lead of every record is a
+contiguous slice that notebooks can read zero-copy with ``np.memmap``.
+
+Store layout (one directory):
+    signals.f32   raw float32 buffer, lead-major
+    index.csv     subject_id, hadm_id, record, offset, length, fs, base_datetime
+    meta.json     format version, lead names, shape and source information
+    failed.csv    records whose header or signals could not be read (record, stage, error)
+
+As in the original per-record loop, a record that cannot be read is skipped
+rather than aborting the build.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+SIGNALS_FILE = 'signals.f32'
+INDEX_FILE = 'index.csv'
+META_FILE = 'meta.json'
+FAILED_FILE = 'failed.csv'
+
+LEAD_NAMES = ['I', 'II', 'III', 'aVR', 'aVF', 'aVL', 'V1', 'V2', 'V3', 'V4', 'V5', 'V6']
+
+
+def find_records(ecg_data_path):
+    """List WFDB records in ``<subject_id>_<hadm_id>`` patient directories.
+
+    Returns:
+        DataFrame with columns subject_id, hadm_id, record (path without suffix)
+    """
+    ecg_data_path = Path(ecg_data_path)
+    if not ecg_data_path.exists():
+        raise FileNotFoundError(f"ECG data path not found: {ecg_data_path}")
+
+    rows = []
+    for patient_dir in sorted(d for d in ecg_data_path.iterdir() if d.is_dir() and '_' in d.name):
+        parts = patient_dir.name.split('_')
+        try:
+            subject_id, hadm_id = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue
+
+        hea_file = patient_dir / f"{hadm_id}.hea"
+        if not hea_file.exists() or not hea_file.with_suffix('.dat').exists():
+            # Fall back to any header with a matching .dat file
+            hea_file = next((h for h in sorted(patient_dir.glob("*.hea"))
+                             if h.with_suffix('.dat').exists()), None)
+            if hea_file is None:
+                continue
+        rows.append((subject_id, hadm_id, str(hea_file.with_suffix(''))))
+
+    return pd.DataFrame(rows, columns=['subject_id', 'hadm_id', 'record'])
+
+
+def _read_header(record):
+    """Header fields of one record (error set instead when it cannot be read)."""
+    import wfdb
+
+    try:
+        header = wfdb.rdheader(record)
+        base_datetime = pd.NaT
+        if header.base_date is not None:
+            base_datetime = pd.Timestamp(datetime.combine(header.base_date, header.base_time or time(0)))
+        return {
+            'record': record,
+            'length': int(header.sig_len),
+            'fs': float(header.fs),
+            'sig_name': list(header.sig_name),
+            'base_datetime': base_datetime,
+            'error': None,
+        }
+    except Exception as e:
+        return {'record': record, 'length': 0, 'fs': np.nan, 'sig_name': [], 'base_datetime': pd.NaT,
+                'error': f'{type(e).__name__}: {e}'}
+
+
+_worker_signals = None
+
+
+def _init_worker(signals_path, shape):
+    global _worker_signals
+    _worker_signals = np.memmap(signals_path, dtype=np.float32, mode='r+', shape=shape)
+
+
+def _decode_record(task):
+    """Decode one record and write all leads into the shared memmap.
+
+    Returns:
+        (samples written, None) or (0, error message) when the record cannot be read
+    """
+    import wfdb
+
+    record, offset, length = task
+    try:
+        signals, _ = wfdb.rdsamp(record)
+        if signals.shape[1] != _worker_signals.shape[0]:
+            raise ValueError(f"expected {_worker_signals.shape[0]} leads, got {signals.shape[1]}")
+        n = min(length, signals.shape[0])
+        _worker_signals[:, offset:offset + n] = signals[:n].T
+        return n, None
+    except Exception as e:
+        return 0, f'{type(e).__name__}: {e}'
+
+
+def _compact(signals_path, shape, index):
+    """Close the gaps left by failed or short records so records stay back to back.
+
+    Records are moved left in offset order (never over data still to be
+    moved) and the file is truncated to the new total length.
+
+    Returns:
+        (new shape, index with updated offsets)
+    """
+    offsets = np.concatenate([[0], np.cumsum(index['length'].to_numpy())[:-1]]).astype(np.int64)
+    new_shape = (shape[0], int(index['length'].sum()))
+    if (offsets == index['offset'].to_numpy()).all() and new_shape == shape:
+        return shape, index
+    if shape[1]:
+        signals = np.memmap(signals_path, dtype=np.float32, mode='r+', shape=shape)
+        for old, new, length in zip(index['offset'], offsets, index['length']):
+            if old != new:
+                signals[:, new:new + length] = signals[:, old:old + length]
+        signals.flush()
+        del signals
+    # Lead-major layout: keep the first new_shape[1] columns of every lead
+    if new_shape[1] != shape[1] and shape[0] > 1 and shape[1]:
+        signals = np.memmap(signals_path, dtype=np.float32, mode='r+', shape=shape)
+        flat = signals.reshape(-1)
+        for lead in range(1, shape[0]):
+            flat[lead * new_shape[1]:(lead + 1) * new_shape[1]] = signals[lead, :new_shape[1]]
+        signals.flush()
+        del signals, flat
+    os.truncate(signals_path, new_shape[0] * new_shape[1] * np.dtype(np.float32).itemsize)
+    index = index.copy()
+    index['offset'] = offsets
+    return new_shape, index
+
+
+def build_signal_store(ecg_data_path, store_path, n_workers=None, min_samples=100, chunksize=16):
+    """Decode every WFDB record once into a memory-mapped multi-lead store.
+
+    Headers are read first to size the output, then records are decoded in a
+    process pool; each worker writes its leads straight into the memmap so no
+    signal data is pickled back to the parent. Records whose header or
+    signals cannot be read are dropped from the index, listed in failed.csv
+    (``ECGSignalStore.failed``) and reported; the build carries on.
+
+    Args:
+        ecg_data_path: Directory with ``<subject_id>_<hadm_id>`` record folders
+        store_path: Output directory for the store
+        n_workers: Worker processes (default: os.cpu_count())
+        min_samples: Records shorter than this are skipped
+        chunksize: Records per task sent to a worker
+
+    Returns:
+        ECGSignalStore opened read-only
+    """
+    store_path = Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+
+    records = find_records(ecg_data_path)
+    print(f"Found {len(records)} patient records")
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        headers = pd.DataFrame(list(pool.map(_read_header, records['record'], chunksize=chunksize)),
+                               columns=['record', 'length', 'fs', 'sig_name', 'base_datetime', 'error'])
+    failed = headers.loc[headers['error'].notna(), ['record', 'error']].assign(stage='header')
+    index = records.merge(headers[headers['error'].isna()].drop(columns='error'), on='record')
+
+    lead_names = list(index['sig_name'].iloc[0]) if len(index) else list(LEAD_NAMES)
+    keep = (index['length'] >= min_samples) & index['sig_name'].apply(lambda names: names == lead_names)
+    skipped = int((~keep).sum())
+    index = index[keep].drop(columns='sig_name').reset_index(drop=True)
+
+    index['offset'] = np.concatenate([[0], np.cumsum(index['length'].to_numpy())[:-1]]).astype(np.int64)
+    shape = (len(lead_names), int(index['length'].sum()))
+
+    signals_path = store_path / SIGNALS_FILE
+    # Pre-size the file; workers open it in r+ mode and fill their own columns
+    np.memmap(signals_path, dtype=np.float32, mode='w+', shape=shape).flush()
+
+    tasks = list(zip(index['record'], index['offset'], index['length']))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(str(signals_path), shape)) as pool:
+        decoded = list(pool.map(_decode_record, tasks, chunksize=chunksize))
+    index['length'] = [n for n, _ in decoded]
+    errors = pd.Series([error for _, error in decoded], index=index.index, dtype=object)
+    failed = pd.concat([failed, pd.DataFrame({'record': index.loc[errors.notna(), 'record'],
+                                              'error': errors[errors.notna()], 'stage': 'signals'})],
+                       ignore_index=True)
+    index = index[errors.isna().to_numpy()].reset_index(drop=True)
+    shape, index = _compact(signals_path, shape, index)
+
+    index = index[['subject_id', 'hadm_id', 'record', 'offset', 'length', 'fs', 'base_datetime']]
+    index.to_csv(store_path / INDEX_FILE, index=False)
+    failed[['record', 'stage', 'error']].to_csv(store_path / FAILED_FILE, index=False)
+    meta = {
+        'version': STORE_VERSION,
+        'dtype': 'float32',
+        'shape': list(shape),
+        'lead_names': lead_names,
+        'source': str(Path(ecg_data_path).resolve()),
+        'n_source_records': len(records),
+        'min_samples': min_samples,
+        'n_failed': len(failed),
+    }
+    with open(store_path / META_FILE, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"Stored {len(index)} records x {len(lead_names)} leads ({shape[1]:,} samples per lead)")
+    print(f"Skipped {skipped} records")
+    if len(failed):
+        print(f"Failed to read {len(failed)} records (see {store_path / FAILED_FILE}):")
+        for row in failed.head(5).itertuples():
+            print(f"  {row.record}: {row.error}")
+    return ECGSignalStore(store_path)
+
+
+def load_signal_store(ecg_data_path, store_path, rebuild=False, n_workers=None, min_samples=100):
+    """Open the cached signal store, building it first if missing or stale.
+
+    The store is considered stale when the number of source records or the
+    min_samples setting differs from the one it was built with.
+    """
+    store_path = Path(store_path)
+    meta_file = store_path / META_FILE
+    if not rebuild and meta_file.exists():
+        with open(meta_file) as f:
+            meta = json.load(f)
+        fresh = (meta.get('version') == STORE_VERSION
+                 and meta.get('min_samples') == min_samples
+                 and (not Path(ecg_data_path).exists()
+                      or meta.get('n_source_records') == len(find_records(ecg_data_path))))
+        if fresh:
+            return ECGSignalStore(store_path)
+    return build_signal_store(ecg_data_path, store_path, n_workers=n_workers, min_samples=min_samples)
+
+
+class ECGSignalStore:
+    """Read-only view over a signal store directory."""
+
+    def __init__(self, store_path):
+        self.path = Path(store_path)
+        with open(self.path / META_FILE) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported signal store version: {self.meta.get('version')}")
+        self.lead_names = self.meta['lead_names']
+        self.index = pd.read_csv(self.path / INDEX_FILE, parse_dates=['base_datetime'])
+        shape = tuple(self.meta['shape'])
+        if shape[1] == 0:
+            self.signals = np.zeros(shape, dtype=np.float32)
+        else:
+            self.signals = np.memmap(self.path / SIGNALS_FILE, dtype=np.float32, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def failed(self):
+        """Records left out of the store because they could not be read (record, stage, error)."""
+        path = self.path / FAILED_FILE
+        if not path.exists():
+            return pd.DataFrame(columns=['record', 'stage', 'error'])
+        return pd.read_csv(path)
+
+    def lead_index(self, lead):
+        """Lead position from a name ('II') or an integer index."""
+        return self.lead_names.index(lead) if isinstance(lead, str) else int(lead)
+
+    def offsets(self):
+        """Offsets array (n_records + 1) into each lead's flat buffer."""
+        offsets = self.index['offset'].to_numpy(dtype=np.int64)
+        end = offsets[-1] + self.index['length'].iloc[-1] if len(offsets) else 0
+        return np.append(offsets, end)
+
+    def lead(self, lead='II'):
+        """Flat values buffer and offsets of one lead for all records (zero-copy).
+
+        Records are stored back to back, so the result can be passed directly to
+        the ``offsets`` argument of the ts_features functions.
+        """
+        return self.signals[self.lead_index(lead)], self.offsets()
+
+    def record(self, i, leads=None):
+        """Signals of record i as an (n_leads, length) view."""
+        row = self.index.iloc[i]
+        rows = slice(None) if leads is None else [self.lead_index(lead) for lead in leads]
+        return self.signals[rows, row['offset']:row['offset'] + row['length']]
+
+    def lead_matrix(self, lead='II', length=None):
+        """Equal-length (n_records, length) matrix of one lead.
+
+        Records shorter than ``length`` (default: the shortest record) are
+        excluded; longer records are truncated. A zero-copy strided view is
+        returned when all records have the same length.
+
+        Returns:
+            (matrix, row positions into self.index)
+        """
+        values, offsets = self.lead(lead)
+        lengths = np.diff(offsets)
+        if length is None:
+            length = int(lengths.min()) if len(lengths) else 0
+        rows = np.flatnonzero(lengths >= length)
+        if len(rows) == len(lengths) and (lengths == length).all():
+            return values[:offsets[-1]].reshape(len(rows), length), rows
+        return values[offsets[rows, np.newaxis] + np.arange(length)], rows
+
+
+def to_time_series_dict(store, lead='II', min_samples=100):
+    """Per-subject DataFrames with charttime/valuenum columns (notebook 3.1 format).
+
+    Args:
+        store: ECGSignalStore
+        lead: Lead name or index, default Lead II
+        min_samples: Records shorter than this are skipped
+
+    Returns:
+        Dict subject_id -> DataFrame
+    """
+    values, offsets = store.lead(lead)
+    time_series_dict = {}
+    for row in store.index.itertuples():
+        if row.length < min_samples:
+            continue
+        start = row.base_datetime if pd.notna(row.base_datetime) else pd.Timestamp(2000, 1, 1)
+        timestamps = pd.date_range(start, periods=row.length, freq=pd.Timedelta(seconds=1 / row.fs))
+        time_series_dict[row.subject_id] = pd.DataFrame({
+            'charttime': timestamps,
+            'valuenum': np.asarray(values[row.offset:row.offset + row.length], dtype=float),
+        })
+    return time_series_dict
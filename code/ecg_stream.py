@@ -0,0 +1,331 @@
+"""Streaming ECG ingestion: incremental filtering, R-peaks, HRV and PAA/SAX/DFT.
+
+The batch chain (notebook 3.1 -> 6) needs a complete recording before
+``sosfiltfilt`` and ``find_peaks`` run. ``ECGStream`` consumes sample chunks of
+any size for a fixed set of channels and keeps only constant state per channel:
+
+- a running mean/std (exponentially weighted, time constant ``norm_tau_s``)
+  that replaces the per-record offset removal and z-normalization;
+- the ``zi`` state of the same bandpass + notch sections used offline
+  (``ecg_preprocessing.design_filters``), applied causally with ``sosfilt``.
+  Causal filtering adds the phase delay that ``sosfiltfilt`` cancels, and the
+  0.5 Hz high-pass takes over from the per-record linear trend removal;
+- a sliding buffer of the last ``window_s`` seconds of filtered signal;
+- the R-peaks inside that window.
+
+R-peaks use the notebook 6 rule (height 0.5 * std of the window, minimum distance
+0.5 s) evaluated on the tail of the buffer. A peak is confirmed once it is
+``min_distance_s`` old, because no later sample can suppress it after that, so
+the peak latency is bounded by min_distance_s plus the chunk length (plus the
+processing time; ``benchmark_throughput`` measures it). Chunks longer than the
+window allows to scan in one step are processed in consecutive pieces, so no
+peak is dropped from the buffer before it has been scanned.
+
+Features are the ones the notebook 6 models are trained on: PAA, SAX and DFT of
+the window (``ts_features.approximation_features``) followed by the HRV vector
+(``ecg_beats.hrv_features_batch``) of the peaks in the window.
+"""
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from scipy.signal import sosfilt, sosfilt_zi
+
+from ecg_beats import HRV_FEATURES, detect_block, hrv_features_batch
+from ecg_preprocessing import design_filters
+from ts_features import approximation_features
+
+
+class ECGStream:
+    """Incremental preprocessing and feature extraction for a fixed set of channels.
+
+    Args:
+        n_channels: Number of channels (leads or patients) fed together
+        fs: Sampling frequency (Hz), default 500
+        window_s: Length of the feature window in seconds (10 s as in the training data)
+        height_factor: Minimum peak height in units of the window std
+        min_distance_s: Minimum distance between peaks in seconds
+        norm_tau_s: Time constant of the running mean/std normalization
+        warmup_s: Signal needed before the first R-peaks are confirmed
+        n_paa_segments, n_sax_segments, sax_alphabet_size, n_dft_coefficients:
+            Feature parameters, defaults as in notebook 6
+        **filter_params: Forwarded to design_filters (lowcut, highcut, notch_freq, ...)
+    """
+
+    def __init__(self, n_channels=1, fs=500, window_s=10.0, height_factor=0.5,
+                 min_distance_s=0.5, norm_tau_s=10.0, warmup_s=2.0, n_paa_segments=30,
+                 n_sax_segments=30, sax_alphabet_size=4, n_dft_coefficients=30, **filter_params):
+        self.n_channels = n_channels
+        self.fs = fs
+        self.window = int(round(window_s * fs))
+        self.height_factor = height_factor
+        self.min_distance_s = min_distance_s
+        self.distance = max(1, int(fs * min_distance_s))
+        self.norm_tau = norm_tau_s * fs
+        self.warmup = min(self.window, int(round(warmup_s * fs)))
+        # Longest piece whose unscanned tail (piece + 2 * distance) still fits in the window
+        self.max_piece = max(1, self.window - 2 * self.distance - 1)
+        self.feature_params = {
+            'n_paa_segments': n_paa_segments,
+            'n_sax_segments': n_sax_segments,
+            'alphabet_size': sax_alphabet_size,
+            'n_dft_coefficients': n_dft_coefficients,
+        }
+
+        # Bandpass and notch as one cascade of second-order sections
+        bandpass_sos, notch_sos = design_filters(fs, **filter_params)
+        self.sos = bandpass_sos if notch_sos is None else np.vstack([bandpass_sos, notch_sos])
+        self._zi_unit = sosfilt_zi(self.sos)
+        self._zi = None
+        self._mean = None
+        self._var = None
+
+        self.buffer = np.zeros((n_channels, self.window))
+        self.n_samples = 0  # total samples consumed per channel
+        self._scanned = 0  # peaks before this sample are final
+        max_beats = int(np.ceil(window_s / min_distance_s)) + 1
+        self.peaks = [deque(maxlen=max_beats) for _ in range(n_channels)]
+        self._last_peak = np.full(n_channels, -np.inf)
+
+    @property
+    def time_s(self):
+        """Stream time (seconds) of the newest sample."""
+        return self.n_samples / self.fs
+
+    @property
+    def n_filled(self):
+        return min(self.n_samples, self.window)
+
+    def _normalize(self, chunk):
+        k = chunk.shape[1]
+        mean, var = chunk.mean(axis=1), chunk.var(axis=1)
+        if self._mean is None:
+            self._mean, self._var = mean, var
+        else:
+            # Exponentially weighted update with the chunk as one step of k samples
+            alpha = 1.0 - np.exp(-k / self.norm_tau)
+            delta = mean - self._mean
+            self._mean = self._mean + alpha * delta
+            self._var = (1 - alpha) * (self._var + alpha * delta ** 2) + alpha * var
+        std = np.sqrt(self._var)
+        return (chunk - self._mean[:, np.newaxis]) / np.where(std > 0, std, 1.0)[:, np.newaxis]
+
+    def _filter(self, chunk):
+        if self._zi is None:
+            # Start in steady state for the first sample to avoid a step transient
+            self._zi = self._zi_unit[:, np.newaxis, :] * chunk[:, :1][np.newaxis, :, :]
+        filtered, self._zi = sosfilt(self.sos, chunk, axis=1, zi=self._zi)
+        return filtered
+
+    def _push(self, filtered):
+        k = filtered.shape[1]
+        if k >= self.window:
+            self.buffer[:] = filtered[:, -self.window:]
+        else:
+            self.buffer[:, :-k] = self.buffer[:, k:]
+            self.buffer[:, -k:] = filtered
+        self.n_samples += k
+
+    def _detect(self):
+        """Confirm the R-peaks that can no longer be suppressed by future samples."""
+        n_filled = self.n_filled
+        if n_filled < max(self.warmup, self.fs * 0.5):
+            return [np.empty(0, dtype=np.int64) for _ in range(self.n_channels)]
+        window = self.buffer[:, self.window - n_filled:]
+        height = window.std(axis=1) * self.height_factor
+        # Only the unscanned tail can hold new peaks or the peaks that would suppress them
+        tail = min(n_filled, max(self.n_samples - self._scanned + self.distance + 1,
+                                 int(np.ceil(self.fs * 0.5))))
+        rows, positions = detect_block(window[:, n_filled - tail:], self.fs, self.height_factor,
+                                       self.min_distance_s, height=height)
+        peaks = self.n_samples - tail + positions
+        confirmed = peaks < self.n_samples - self.distance
+        self._scanned = self.n_samples - self.distance
+
+        new = [np.empty(0, dtype=np.int64) for _ in range(self.n_channels)]
+        for ch in np.unique(rows[confirmed]):
+            candidates = peaks[confirmed & (rows == ch)]
+            kept = []
+            for p in candidates:
+                if p - self._last_peak[ch] >= self.distance:
+                    kept.append(p)
+                    self._last_peak[ch] = p
+            self.peaks[ch].extend(kept)
+            new[ch] = np.asarray(kept, dtype=np.int64)
+        return new
+
+    def update(self, chunk):
+        """Consume a chunk of samples.
+
+        Chunks longer than ``max_piece`` samples are consumed in pieces of at
+        most that length.
+
+        Args:
+            chunk: (n_channels, n_new) samples (1-D for a single channel)
+
+        Returns:
+            List with the newly confirmed R-peaks (absolute sample index) per channel
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.ndim == 1:
+            chunk = chunk[np.newaxis, :]
+        if chunk.shape[0] != self.n_channels:
+            raise ValueError(f"Expected {self.n_channels} channels, got {chunk.shape[0]}")
+        new = [[] for _ in range(self.n_channels)]
+        for start in range(0, chunk.shape[1], self.max_piece):
+            self._push(self._filter(self._normalize(chunk[:, start:start + self.max_piece])))
+            for ch, peaks in enumerate(self._detect()):
+                new[ch].append(peaks)
+        return [np.concatenate(peaks) if peaks else np.empty(0, dtype=np.int64) for peaks in new]
+
+    def window_peaks(self):
+        """R-peaks inside the current window, relative to the window start (flat + offsets)."""
+        start = self.n_samples - self.n_filled
+        per_channel = [np.asarray([p for p in q if p >= start], dtype=np.int64) - start
+                       for q in self.peaks]
+        offsets = np.concatenate([[0], np.cumsum([len(p) for p in per_channel])]).astype(np.int64)
+        return np.concatenate(per_channel), offsets
+
+    def feature_names(self):
+        p = self.feature_params
+        return ([f'paa_{i}' for i in range(p['n_paa_segments'])]
+                + [f'sax_{i}' for i in range(p['n_sax_segments'])]
+                + [f'dft_{i}' for i in range(p['n_dft_coefficients'])]
+                + HRV_FEATURES)
+
+    def features(self):
+        """Feature vector of the current window for every channel.
+
+        Returns:
+            DataFrame indexed by channel with time_s, n_beats and the notebook 6
+            feature columns (PAA, SAX, DFT, HRV, in X_features order)
+        """
+        n_filled = self.n_filled
+        columns = self.feature_names()
+        if n_filled < max(self.feature_params['n_paa_segments'], self.feature_params['n_sax_segments']):
+            X = np.full((self.n_channels, len(columns)), np.nan)
+            n_beats = np.zeros(self.n_channels, dtype=int)
+        else:
+            window = self.buffer[:, self.window - n_filled:]
+            peaks, peak_offsets = self.window_peaks()
+            hrv = hrv_features_batch(peaks, peak_offsets, fs=self.fs)
+            X = np.hstack([approximation_features(window, **self.feature_params),
+                           hrv[HRV_FEATURES].to_numpy()])
+            n_beats = hrv['n_beats'].to_numpy()
+        features = pd.DataFrame(X, columns=columns)
+        features.insert(0, 'n_beats', n_beats)
+        features.insert(0, 'time_s', self.time_s)
+        features.index.name = 'channel'
+        return features
+
+
+def iter_chunks(X, chunk_size):
+    """Replay a (n_channels, n_samples) recording as consecutive chunks."""
+    X = np.asarray(X)
+    for start in range(0, X.shape[-1], chunk_size):
+        yield X[..., start:start + chunk_size]
+
+
+def stream_features(chunks, n_channels=1, fs=500, hop_s=1.0, **stream_params):
+    """Run an ECGStream over an iterable of chunks.
+
+    Args:
+        chunks: Iterable of (n_channels, n_new) sample chunks
+        n_channels: Number of channels
+        fs: Sampling frequency (Hz)
+        hop_s: Emit features every hop_s seconds of signal
+        **stream_params: Forwarded to ECGStream
+
+    Yields:
+        (time_s, features DataFrame) every hop_s seconds
+    """
+    stream = ECGStream(n_channels=n_channels, fs=fs, **stream_params)
+    hop = max(1, int(round(hop_s * fs)))
+    next_emit = hop
+    for chunk in chunks:
+        stream.update(chunk)
+        if stream.n_samples >= next_emit:
+            next_emit = (stream.n_samples // hop + 1) * hop
+            yield stream.time_s, stream.features()
+
+
+async def astream_features(chunks, n_channels=1, fs=500, hop_s=1.0, **stream_params):
+    """Asyncio variant of stream_features for an async iterable of chunks."""
+    stream = ECGStream(n_channels=n_channels, fs=fs, **stream_params)
+    hop = max(1, int(round(hop_s * fs)))
+    next_emit = hop
+    async for chunk in chunks:
+        stream.update(chunk)
+        if stream.n_samples >= next_emit:
+            next_emit = (stream.n_samples // hop + 1) * hop
+            yield stream.time_s, stream.features()
+
+
+def synthetic_ecg(n_channels, duration_s, fs=500, seed=0):
+    """Noisy synthetic ECG-like signals (Gaussian R waves at 55-100 bpm) for benchmarks."""
+    rng = np.random.default_rng(seed)
+    n = int(duration_s * fs)
+    t = np.arange(n) / fs
+    X = 0.05 * rng.standard_normal((n_channels, n)) + 0.1 * np.sin(2 * np.pi * 0.3 * t)
+    for ch in range(n_channels):
+        rr = 60.0 / rng.uniform(55, 100)
+        beats = np.cumsum(rr * (1 + 0.05 * rng.standard_normal(int(duration_s / rr) + 2)))
+        for b in beats[beats < duration_s]:
+            i = int(b * fs)
+            lo, hi = max(0, i - 25), min(n, i + 25)
+            X[ch, lo:hi] += np.exp(-0.5 * ((np.arange(lo, hi) - i) / 5.0) ** 2)
+    return X
+
+
+def benchmark_throughput(n_channels=32, duration_s=60.0, fs=500, chunk_s=0.2, hop_s=1.0):
+    """Measure single-core streaming throughput on synthetic signals.
+
+    The peak latency is measured per confirmed R-peak as the signal time from
+    the peak sample to the end of the chunk that confirmed it, plus the time
+    spent processing that chunk.
+
+    Returns:
+        dict with the real-time factor, channels per core (channels that one core
+        keeps up with in real time) and the mean and worst measured peak latency
+    """
+    X = synthetic_ecg(n_channels, duration_s, fs=fs)
+    chunk_size = max(1, int(round(chunk_s * fs)))
+    stream = ECGStream(n_channels=n_channels, fs=fs)
+    hop = max(1, int(round(hop_s * fs)))
+    next_emit, n_emitted, latencies = hop, 0, []
+    start = time.perf_counter()
+    for chunk in iter_chunks(X, chunk_size):
+        chunk_start = time.perf_counter()
+        new = stream.update(chunk)
+        processing = time.perf_counter() - chunk_start
+        confirmed = np.concatenate(new)
+        latencies.append((stream.n_samples - confirmed) / fs + processing)
+        if stream.n_samples >= next_emit:
+            next_emit = (stream.n_samples // hop + 1) * hop
+            stream.features()
+            n_emitted += 1
+    elapsed = time.perf_counter() - start
+    realtime_factor = duration_s / elapsed
+    latencies = np.concatenate(latencies)
+    return {
+        'n_channels': n_channels,
+        'duration_s': duration_s,
+        'chunk_s': chunk_s,
+        'hop_s': hop_s,
+        'elapsed_s': elapsed,
+        'n_feature_updates': n_emitted,
+        'realtime_factor': realtime_factor,
+        'channels_per_core': n_channels * realtime_factor,
+        'n_peaks': len(latencies),
+        'mean_peak_latency_s': float(latencies.mean()) if len(latencies) else np.nan,
+        'max_peak_latency_s': float(latencies.max()) if len(latencies) else np.nan,
+    }
+
+
+if __name__ == '__main__':
+    for n_channels in (1, 16, 64):
+        result = benchmark_throughput(n_channels=n_channels)
+        print(f"{n_channels:>3} channels: {result['realtime_factor']:8.1f}x real time, "
+              f"{result['channels_per_core']:8.0f} channels per core, "
+              f"peak latency <= {result['max_peak_latency_s']:.2f} s")
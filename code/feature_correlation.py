@@ -0,0 +1,283 @@
+"""Correlation analysis for wide feature tables (notebooks 1.1, 1.2 and 4).
+
+The notebooks call ``DataFrame.corr()`` and then walk the upper triangle with
+nested ``for i ... for j in range(i + 1, ...)`` loops, once per threshold and
+per feature subset. Here:
+
+- ``CorrelationSketch`` keeps additive pairwise moments of the data (for
+  every pair of columns: rows where both are present, their sums, sums of
+  squares and cross products, after a fixed per-column shift for numerical
+  stability). The Pearson correlations follow from them exactly as pandas
+  computes them (pairwise complete observations). The moments of row chunks
+  add up, so the data can be streamed (``correlate`` on a CSV path), sketches
+  of different row sets can be merged, new rows only cost their own update,
+  and new columns only need their cross moments with the existing ones
+  (``add_columns``);
+- Spearman is the Pearson correlation of the column ranks (``rank_transform``);
+- ``correlation_pairs`` / ``high_pairs`` extract the upper triangle with an
+  array mask, and ``prune_correlated`` turns the high pairs into one
+  deduplicated list of features to drop (with the pair responsible for each).
+
+Any feature subset is a sub-matrix of the full result (pairwise complete, so
+no recomputation is needed).
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def _numeric(chunk, columns):
+    """Float matrix of the requested columns (bool -> 0/1, missing / non-numeric -> NaN)."""
+    frame = chunk.reindex(columns=columns)
+    if not columns:
+        return np.empty((len(chunk), 0))
+    return np.column_stack([pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype=float) for col in columns])
+
+
+def rank_transform(df):
+    """Average ranks per column (missing values stay missing), for Spearman correlation.
+
+    Ranks are computed over each column's present values; with missing values
+    this differs slightly from pandas, which ranks every pair separately.
+    """
+    return df.rank(method='average')
+
+
+class CorrelationSketch:
+    """Mergeable pairwise moments for Pearson correlation with missing values.
+
+    Args:
+        columns: Column names; default: the numeric (and bool) columns of the
+            first chunk passed to update
+    """
+
+    def __init__(self, columns=None):
+        self.columns = None if columns is None else list(columns)
+        self.shift = None
+        self.n_rows = 0
+        self.N = self.S = self.Q = self.P = None  # counts, sums, sums of squares, cross products
+
+    def _init(self, chunk):
+        if self.columns is None:
+            self.columns = chunk.select_dtypes(include=['number', 'bool']).columns.tolist()
+        p = len(self.columns)
+        X = _numeric(chunk, self.columns)
+        with np.errstate(invalid='ignore'):
+            counts = np.sum(~np.isnan(X), axis=0)
+            self.shift = np.where(counts > 0, np.nansum(X, axis=0) / np.maximum(counts, 1), 0.0)
+        self.N, self.S, self.Q, self.P = (np.zeros((p, p)) for _ in range(4))
+
+    @staticmethod
+    def _moments(X_a, shift_a, X_b, shift_b):
+        """(N, S_ab, S_ba, Q_ab, Q_ba, P) blocks between the columns of X_a and X_b."""
+        M_a, M_b = ~np.isnan(X_a), ~np.isnan(X_b)
+        Z_a, Z_b = np.where(M_a, X_a - shift_a, 0.0), np.where(M_b, X_b - shift_b, 0.0)
+        P = Z_a.T @ Z_b
+        if M_a.all() and M_b.all():  # no missing values: counts and sums do not depend on the pair
+            n = len(X_a)
+            ones = np.ones((1, Z_b.shape[1]))
+            return (np.full(P.shape, float(n)), Z_a.sum(axis=0)[:, None] * ones,
+                    (Z_b.sum(axis=0)[:, None] * np.ones((1, Z_a.shape[1]))).T,
+                    (Z_a ** 2).sum(axis=0)[:, None] * ones,
+                    ((Z_b ** 2).sum(axis=0)[:, None] * np.ones((1, Z_a.shape[1]))).T, P)
+        M_a, M_b = M_a.astype(float), M_b.astype(float)
+        return (M_a.T @ M_b, Z_a.T @ M_b, (Z_b.T @ M_a).T, (Z_a ** 2).T @ M_b, ((Z_b ** 2).T @ M_a).T, P)
+
+    def update(self, chunk):
+        """Add the rows of a DataFrame chunk."""
+        if self.shift is None:
+            self._init(chunk)
+        X = _numeric(chunk, self.columns)
+        N, S, S_t, Q, Q_t, P = self._moments(X, self.shift, X, self.shift)
+        self.N += N
+        self.S += S
+        self.Q += Q
+        self.P += P
+        self.n_rows += len(chunk)
+        return self
+
+    def merge(self, other):
+        """Add the moments of a sketch of other rows (same columns); returns self."""
+        if other.shift is None:
+            return self
+        if self.shift is None:
+            self.columns, self.shift = list(other.columns), other.shift.copy()
+            self.N, self.S, self.Q, self.P = (m.copy() for m in (other.N, other.S, other.Q, other.P))
+            self.n_rows = other.n_rows
+            return self
+        if list(other.columns) != self.columns:
+            raise ValueError("Sketches cover different columns")
+        # Re-center the other sketch's sums on this sketch's shift
+        d = (other.shift - self.shift)[:, None]  # per row column i
+        S = other.S + d * other.N
+        Q = other.Q + 2 * d * other.S + d ** 2 * other.N
+        P = other.P + d * other.S.T + other.S * d.T + d * d.T * other.N
+        self.N += other.N
+        self.S += S
+        self.Q += Q
+        self.P += P
+        self.n_rows += other.n_rows
+        return self
+
+    def add_columns(self, data, columns, chunksize=100_000):
+        """Add columns without recomputing the existing pairs.
+
+        Args:
+            data: The rows already in the sketch (same rows, any order), with
+                the existing and the new columns: DataFrame, CSV path or
+                iterable of chunks
+            columns: New column names
+            chunksize: Rows per chunk when data is a CSV path
+
+        Returns:
+            self
+        """
+        new = [col for col in columns if col not in self.columns]
+        if not new:
+            return self
+        old_p, k = len(self.columns), len(new)
+        everything = self.columns + new
+        N, S, Q, P = (np.zeros((old_p + k, old_p + k)) for _ in range(4))
+        for name, block in zip('NSQP', (N, S, Q, P)):
+            block[:old_p, :old_p] = getattr(self, name)
+        shift_new = None
+        for chunk in _chunks(data, everything, chunksize):
+            X = _numeric(chunk, everything)
+            if shift_new is None:
+                with np.errstate(invalid='ignore'):
+                    counts = np.sum(~np.isnan(X[:, old_p:]), axis=0)
+                    shift_new = np.where(counts > 0, np.nansum(X[:, old_p:], axis=0) / np.maximum(counts, 1), 0.0)
+                shift = np.concatenate([self.shift, shift_new])
+            # Moments of every column with the new columns only: O(n * p * k)
+            n_b, s_ab, s_ba, q_ab, q_ba, p_ab = self._moments(X, shift, X[:, old_p:], shift_new)
+            for block, values, values_t in ((N, n_b, n_b.T), (S, s_ab, s_ba.T), (Q, q_ab, q_ba.T), (P, p_ab, p_ab.T)):
+                block[:, old_p:] += values
+                block[old_p:, :old_p] += values_t[:, :old_p]
+        self.columns, self.shift = everything, shift
+        self.N, self.S, self.Q, self.P = N, S, Q, P
+        return self
+
+    def corr(self, columns=None):
+        """Pearson correlation matrix (pairwise complete observations, as DataFrame.corr())."""
+        idx = np.arange(len(self.columns)) if columns is None else np.array([self.columns.index(c) for c in columns])
+        N, S, Q, P = (m[np.ix_(idx, idx)] for m in (self.N, self.S, self.Q, self.P))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = N * P - S * S.T
+            var_a = N * Q - S ** 2
+            var_b = var_a.T
+            r = cov / np.sqrt(var_a * var_b)
+        # Constant over the pair's rows (up to cancellation in N * Q - S ** 2): undefined, as in pandas
+        constant = var_a <= 1e-12 * N * Q
+        r[constant | constant.T | (N < 2)] = np.nan
+        r = np.clip(r, -1.0, 1.0)
+        diagonal = np.diag_indices_from(r)
+        r[diagonal] = np.where(np.isnan(r[diagonal]), np.nan, 1.0)
+        names = [self.columns[i] for i in idx]
+        return pd.DataFrame(r, index=names, columns=names)
+
+
+def _chunks(data, columns, chunksize, **read_csv_kwargs):
+    """Row chunks of a DataFrame, a CSV path or an iterable of DataFrames."""
+    if isinstance(data, pd.DataFrame):
+        yield from (data.iloc[start:start + chunksize] for start in range(0, max(len(data), 1), chunksize))
+    elif isinstance(data, (str, Path)):
+        yield from pd.read_csv(data, usecols=columns, chunksize=chunksize, **read_csv_kwargs)
+    else:
+        yield from data
+
+
+def correlate(data, columns=None, method='pearson', chunksize=100_000, **read_csv_kwargs):
+    """Correlation matrix of a DataFrame, a CSV file (read in chunks) or an iterable of chunks.
+
+    Args:
+        data: DataFrame, CSV path or iterable of DataFrame chunks
+        columns: Columns to correlate (default: numeric and bool columns)
+        method: 'pearson' or 'spearman' (spearman needs each column in full
+            to rank it, so chunked input is concatenated first)
+        chunksize: Rows per chunk
+        **read_csv_kwargs: Forwarded to pd.read_csv for CSV paths
+
+    Returns:
+        (correlation DataFrame, CorrelationSketch of the data)
+    """
+    if method not in ('pearson', 'spearman'):
+        raise ValueError(f"Unknown method: {method!r}")
+    if method == 'spearman':
+        frame = data if isinstance(data, pd.DataFrame) else pd.concat(_chunks(data, columns, chunksize,
+                                                                               **read_csv_kwargs))
+        columns = columns or frame.select_dtypes(include=['number', 'bool']).columns.tolist()
+        data = rank_transform(frame[columns].astype(float))
+    sketch = CorrelationSketch(columns)
+    for chunk in _chunks(data, columns, chunksize, **read_csv_kwargs):
+        sketch.update(chunk)
+    return sketch.corr(), sketch
+
+
+def correlation_pairs(corr):
+    """All column pairs i < j of a correlation matrix, in row-major upper-triangle order.
+
+    Returns:
+        DataFrame with feature_a, feature_b, corr and abs_corr
+    """
+    values = corr.to_numpy()
+    i, j = np.triu_indices(len(values), k=1)
+    names = np.asarray(corr.columns, dtype=object)
+    return pd.DataFrame({'feature_a': names[i], 'feature_b': names[j], 'corr': values[i, j],
+                         'abs_corr': np.abs(values[i, j])})
+
+
+def high_pairs(corr, threshold, inclusive=True):
+    """Pairs with |r| >= threshold (> with inclusive=False), strongest first."""
+    values = corr.to_numpy()
+    upper = np.triu(np.ones(values.shape, dtype=bool), k=1)
+    with np.errstate(invalid='ignore'):
+        mask = upper & ((np.abs(values) >= threshold) if inclusive else (np.abs(values) > threshold))
+    i, j = np.nonzero(mask)
+    names = np.asarray(corr.columns, dtype=object)
+    pairs = pd.DataFrame({'feature_a': names[i], 'feature_b': names[j], 'corr': values[i, j],
+                          'abs_corr': np.abs(values[i, j])})
+    return pairs.sort_values('abs_corr', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def prune_correlated(corr, threshold, inclusive=False, rule='greedy', keep=()):
+    """Features to drop so that no remaining pair exceeds the threshold.
+
+    Args:
+        corr: Correlation matrix
+        threshold: |r| limit
+        inclusive: Count |r| == threshold as too high
+        rule: 'greedy' - go through the pairs strongest first, skip pairs with a
+            feature already dropped, and drop the member with more high
+            correlations (ties: the later column); 'second' - drop the second
+            member of every high pair (the rule of notebook 4)
+        keep: Features that are never dropped (their partner is dropped instead)
+
+    Returns:
+        DataFrame with feature, correlated_with and corr, one row per dropped
+        feature (in column order)
+    """
+    pairs = high_pairs(corr, threshold, inclusive)
+    order = {name: i for i, name in enumerate(corr.columns)}
+    keep = set(keep)
+    dropped = {}
+    if rule == 'second':
+        for row in pairs.itertuples(index=False):
+            if row.feature_b not in dropped:
+                dropped[row.feature_b] = (row.feature_a, row.corr)
+    elif rule == 'greedy':
+        degree = pd.concat([pairs['feature_a'], pairs['feature_b']]).value_counts()
+        for row in pairs.itertuples(index=False):
+            a, b = row.feature_a, row.feature_b
+            if a in dropped or b in dropped:
+                continue
+            if b in keep and a in keep:
+                continue
+            if b in keep or (a not in keep and (degree[a], order[a]) > (degree[b], order[b])):
+                a, b = b, a
+            dropped[b] = (a, row.corr)
+    else:
+        raise ValueError(f"Unknown rule: {rule!r}")
+    names = sorted(dropped, key=order.get)
+    return pd.DataFrame({'feature': names, 'correlated_with': [dropped[n][0] for n in names],
+                         'corr': [dropped[n][1] for n in names]})
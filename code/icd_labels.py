@@ -0,0 +1,118 @@
+"""Vectorized ICD-based cohort labels (notebooks 4 and 6).
+
+Both classification notebooks normalize ``icd_code`` row by row with chained
+``.str`` calls, collect a Python set of codes per subject and intersect every
+set with the ischemic codes. Here the codes are factorized once (categorical
+integer codes), and everything else works on the categories:
+
+- normalization (strip, upper case, empty / "NAN" -> missing, optional dot
+  removal) runs on the distinct codes only;
+- every label group (a set of codes such as the ischemic ``ISCHEMIC``) becomes
+  a boolean membership vector over the categories. With ``prefix=True`` a code
+  also matches the group entries that are a prefix of it, so "I21" covers
+  "I214" / "I21.4" (ICD hierarchy);
+- the row flags are a lookup of the membership vectors by code, and the label
+  of a subject is ``groupby(key).max()`` of its rows.
+
+``stream_labels`` reads a diagnosis CSV in chunks (only the key and code
+columns), labels every chunk the same way and merges the per-chunk maxima, so
+the diagnosis table never has to fit in memory.
+"""
+import numpy as np
+import pandas as pd
+
+ISCHEMIC = frozenset({'I20', 'I21', 'I22', 'I24', 'I25'})
+CARDIOVASCULAR = frozenset({
+    'I20', 'I21', 'I22', 'I24', 'I25',
+    'I30', 'I31', 'I33',
+    'I34', 'I35', 'I36',
+    'I40', 'I42',
+    'I44', 'I45', 'I46', 'I47', 'I48', 'I49',
+    'I50',
+})
+ISCHEMIC_GROUPS = {'label_ischemic': ISCHEMIC}
+
+
+def normalize_codes(codes, strip_dots=False):
+    """ICD codes as a Categorical of normalized codes (missing for empty / 'NAN').
+
+    Args:
+        codes: Series or array of raw codes
+        strip_dots: Remove dots ('I21.4' -> 'I214')
+
+    Returns:
+        pd.Categorical aligned with codes
+    """
+    values, uniques = pd.factorize(pd.Series(codes).astype(object), use_na_sentinel=True)
+    cleaned = pd.Series(uniques, dtype=object).astype(str).str.strip().str.upper()
+    if strip_dots:
+        cleaned = cleaned.str.replace('.', '', regex=False)
+    cleaned = cleaned.where(~cleaned.isin(['', 'NAN']))
+    categories = pd.Index(cleaned.dropna().unique())
+    remap = np.append(categories.get_indexer(cleaned), -1)  # -1: missing (also the factorize sentinel)
+    return pd.Categorical.from_codes(remap[values], categories=categories)
+
+
+def membership(categories, codes, prefix=False):
+    """Boolean vector: which categories belong to a code group.
+
+    Args:
+        categories: Normalized distinct codes
+        codes: Group definition (iterable of codes, normalized like the categories)
+        prefix: Also match categories that start with a group code (hierarchy)
+    """
+    categories = pd.Index(categories, dtype=object)
+    codes = {str(code).strip().upper() for code in codes}
+    if not prefix:
+        return categories.isin(codes)
+    result = np.zeros(len(categories), dtype=bool)
+    for length in sorted({len(code) for code in codes}):
+        result |= categories.str[:length].isin([code for code in codes if len(code) == length])
+    return result
+
+
+def label_table(diagnoses, groups=ISCHEMIC_GROUPS, key='subject_id', code_col='icd_code', valid=CARDIOVASCULAR,
+                prefix=False, strip_dots=False):
+    """One 0/1 label per group and key from a diagnosis table.
+
+    Args:
+        diagnoses: DataFrame with the key and code columns (one row per diagnosis)
+        groups: dict label name -> code set; a key gets 1 when any of its valid
+            codes is in the set (e.g. {'label_ischemic': ISCHEMIC})
+        key: Column(s) identifying the unit to label (subject, or [subject, hadm])
+        code_col: ICD code column
+        valid: Only diagnoses in this code set count, and only keys with at
+            least one of them are returned (None = all non-missing codes)
+        prefix: Match group / valid codes as prefixes (ICD hierarchy)
+        strip_dots: Remove dots from the codes before matching
+
+    Returns:
+        DataFrame with the key column(s) and one int8 column per group
+    """
+    keys = [key] if isinstance(key, str) else list(key)
+    codes = normalize_codes(diagnoses[code_col], strip_dots=strip_dots)
+    categories = codes.categories
+    lookup = np.append(np.ones(len(categories), dtype=bool) if valid is None
+                       else membership(categories, valid, prefix), False)  # last entry: missing code
+    row_codes = np.asarray(codes.codes)
+    rows = lookup[row_codes]
+
+    frame = diagnoses.loc[rows, keys].reset_index(drop=True)
+    frame['_code'] = row_codes[rows]
+    for name, group in groups.items():
+        in_group = np.append(membership(categories, group, prefix), False)
+        frame[name] = in_group[frame['_code'].to_numpy()].astype(np.int8)
+    return frame.groupby(keys, sort=True)[list(groups)].max().reset_index()
+
+
+def stream_labels(path, groups=ISCHEMIC_GROUPS, key='subject_id', code_col='icd_code', valid=CARDIOVASCULAR,
+                  prefix=False, strip_dots=False, chunksize=1_000_000, **read_csv_kwargs):
+    """label_table over a diagnosis CSV read in chunks (key and code columns only).
+
+    Returns:
+        DataFrame as label_table
+    """
+    keys = [key] if isinstance(key, str) else list(key)
+    partials = [label_table(chunk, groups, keys, code_col, valid, prefix, strip_dots)
+                for chunk in pd.read_csv(path, usecols=keys + [code_col], chunksize=chunksize, **read_csv_kwargs)]
+    return pd.concat(partials, ignore_index=True).groupby(keys, sort=True)[list(groups)].max().reset_index()
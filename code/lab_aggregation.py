@@ -0,0 +1,287 @@
+"""Out-of-core per-admission lab features (notebook 1.1 df2 laboratory, task 1.2).
+
+The notebook loads the whole lab table and groups it by (subject_id, hadm_id).
+Here the cleaned events are read in chunks and every chunk is reduced to a
+``LabPartial``: one row of mergeable statistics per admission (counts, sums,
+min/max) plus distinct-value state for the ``nunique`` features. Partials are
+merged with sum/min/max (and set union for distinct values), so chunks can be
+reduced in any order and on any number of worker processes, and memory is
+bounded by the number of admissions rather than the number of events.
+
+Distinct counts are exact by default: the partial keeps the deduplicated
+(admission, value hash) pairs, which grows with the number of distinct values
+per admission. For high-cardinality columns (e.g. ``analysis_batch_id`` on a
+full hospital feed) a HyperLogLog sketch with 2**precision one-byte registers
+per admission can be used instead (about 1.04 / sqrt(2**precision) relative
+error, exact-ish linear counting for small counts).
+
+The features are the ones of the notebook (``feat``): num_labs,
+abnormal_ratio, qc_fail_ratio, lab_time_span_hours, the unique_* counts, the
+fluid-specific min/max analytes of ``extract_refined_features`` and the
+examination-group counts.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+KEYS = ['subject_id', 'hadm_id']
+
+BLOOD_LABELS = [
+    "glucose", "lactate", "anion gap", "bicarbonate", "creatinine",
+    "urea nitrogen", "phosphate", "potassium", "sodium",
+    "c-reactive protein", "ast", "alt", "ld",
+    "hemoglobin", "hematocrit", "rbc", "rdw",
+]
+URINE_LABELS = ["glucose", "creatinine", "urea nitrogen", "sodium", "protein"]
+GAS_LABELS = ["pO2", "pCO2", "pH", "base excess"]
+
+# name -> (label substring, fluid substring, 'min' | 'max'), as in extract_refined_features
+ANALYTE_FEATURES = {
+    **{f"{'min' if v in ('hemoglobin', 'hematocrit') else 'max'}_blood_{v}":
+       (v, 'Blood', 'min' if v in ('hemoglobin', 'hematocrit') else 'max') for v in BLOOD_LABELS},
+    **{f"max_urine_{v}": (v, 'Urine', 'max') for v in URINE_LABELS},
+    **{f"max_gas_{v}": (v, 'Blood', 'max') for v in GAS_LABELS},
+}
+GROUP_COUNTS = {
+    'count_cbc': 'Complete Blood Count (CBC)',
+    'count_blood_gas': 'Blood Gas',
+    'count_liver': 'Liver Function Tests',
+    'count_cardiac': 'Cardiac Markers',
+}
+# output name -> source column
+DISTINCT_FEATURES = {
+    'unique_lab_tests': 'label',
+    'unique_examination_groups': 'examination_group',
+    'fluid_diversity': 'fluid',
+    'unique_analysis_batches': 'analysis_batch_id',
+}
+USECOLS = KEYS + ['charttime', 'label', 'fluid', 'examination_group', 'analysis_batch_id',
+                  'valuenum_merged', 'flag_corrected', 'is_qc_fail']
+
+
+def _contains(codes, uniques, pattern):
+    """Case-insensitive substring mask from factorized values (one test per distinct value)."""
+    hit = np.asarray(uniques.str.contains(pattern, case=False, regex=True))
+    return np.where(codes >= 0, hit[np.maximum(codes, 0)], False)
+
+
+def _factorize(values):
+    codes, uniques = pd.factorize(values)
+    return codes, pd.Index(uniques).astype(str)
+
+
+def _hash(values):
+    """uint64 hash per value; numbers hash by value so int and float chunks agree."""
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.util.hash_array(values.to_numpy(dtype=float))
+    return pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+
+
+def _hll_registers(codes, hashes, n_keys, precision):
+    """HyperLogLog registers (n_keys, 2**precision) from per-row key codes and hashes."""
+    n_bits = 64 - precision
+    bucket = (hashes >> np.uint64(n_bits)).astype(np.int64)
+    rest = hashes & np.uint64((1 << n_bits) - 1)
+    # Rank = position of the leftmost 1-bit in the remaining n_bits bits
+    bit_length = np.zeros(len(rest), dtype=np.int64)
+    nonzero = rest > 0
+    bit_length[nonzero] = np.floor(np.log2(rest[nonzero].astype(float))).astype(np.int64) + 1
+    rank = np.minimum(n_bits - bit_length + 1, 255).astype(np.uint8)
+    registers = np.zeros((n_keys, 1 << precision), dtype=np.uint8)
+    np.maximum.at(registers, (codes, bucket), rank)
+    return registers
+
+
+def _hll_estimate(registers):
+    """Cardinality estimate per row of registers (with small-range correction)."""
+    m = registers.shape[1]
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    raw = alpha * m * m / np.power(2.0, -registers.astype(float)).sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+class LabPartial:
+    """Mergeable per-admission aggregates of a set of lab events.
+
+    Args:
+        stats: DataFrame indexed by (subject_id, hadm_id) with the additive and
+            min/max statistics
+        distinct: Dict source column -> exact (subject_id, hadm_id, hash)
+            pairs or HLL registers indexed by (subject_id, hadm_id)
+    """
+
+    def __init__(self, stats, distinct):
+        self.stats = stats
+        self.distinct = distinct
+
+    @staticmethod
+    def _rules(columns):
+        rules = {}
+        for col in columns:
+            if col == 't_min' or col.startswith('min_'):
+                rules[col] = 'min'
+            elif col == 't_max' or col.startswith('max_'):
+                rules[col] = 'max'
+            else:
+                rules[col] = 'sum'
+        return rules
+
+    @classmethod
+    def from_events(cls, chunk, distinct='exact', hll_precision=8):
+        """Reduce one chunk of cleaned lab events.
+
+        Args:
+            chunk: DataFrame with the USECOLS columns (subject_id may be float)
+            distinct: 'exact' or 'hll' distinct counting
+            hll_precision: log2 of the HLL registers per admission
+
+        Returns:
+            LabPartial
+        """
+        chunk = chunk.dropna(subset=KEYS)
+        keys = chunk[KEYS].astype(np.int64)
+        values = pd.to_numeric(chunk['valuenum_merged'], errors='coerce')
+
+        columns = {
+            'n': np.ones(len(chunk), dtype=np.int64),
+            'n_abnormal': (chunk['flag_corrected'] == 'abnormal').to_numpy(dtype=np.int64),
+            'qc_sum': pd.to_numeric(chunk['is_qc_fail'], errors='coerce').fillna(0).to_numpy(),
+            'qc_n': chunk['is_qc_fail'].notna().to_numpy(dtype=np.int64),
+            't_min': pd.to_datetime(chunk['charttime'], errors='coerce').to_numpy(),
+        }
+        columns['t_max'] = columns['t_min']
+        labels, fluids = _factorize(chunk['label']), _factorize(chunk['fluid'])
+        fluid_masks = {}
+        for name, (label, fluid, _) in ANALYTE_FEATURES.items():
+            if fluid not in fluid_masks:
+                fluid_masks[fluid] = _contains(*fluids, fluid)
+            mask = _contains(*labels, label) & fluid_masks[fluid]
+            columns[name] = values.where(mask).to_numpy()
+        group = chunk['examination_group'].to_numpy()
+        for name, value in GROUP_COUNTS.items():
+            columns[name] = (group == value).astype(np.int64)
+
+        frame = pd.DataFrame(columns, index=pd.MultiIndex.from_frame(keys))
+        stats = frame.groupby(level=KEYS, sort=False).agg(cls._rules(frame.columns))
+
+        distinct_state = {}
+        for col in DISTINCT_FEATURES.values():
+            present = chunk[col].notna().to_numpy()
+            pairs = keys[present].assign(hash=_hash(chunk.loc[present, col]))
+            if distinct == 'exact':
+                distinct_state[col] = pairs.drop_duplicates(ignore_index=True)
+            else:
+                codes = stats.index.get_indexer(pd.MultiIndex.from_frame(pairs[KEYS]))
+                registers = _hll_registers(codes, pairs['hash'].to_numpy(), len(stats), hll_precision)
+                distinct_state[col] = pd.DataFrame(registers, index=stats.index)
+        return cls(stats, distinct_state)
+
+    @classmethod
+    def merge(cls, partials):
+        """Combine partials of disjoint or overlapping event sets."""
+        partials = list(partials)
+        if len(partials) == 1:
+            return partials[0]
+        stats = pd.concat([p.stats for p in partials])
+        stats = stats.groupby(level=KEYS, sort=False).agg(cls._rules(stats.columns))
+        distinct_state = {}
+        for col in partials[0].distinct:
+            parts = pd.concat([p.distinct[col] for p in partials])
+            if isinstance(parts.index, pd.MultiIndex):  # HLL registers
+                distinct_state[col] = parts.groupby(level=KEYS, sort=False).max()
+            else:
+                distinct_state[col] = parts.drop_duplicates(ignore_index=True)
+        return cls(stats, distinct_state)
+
+    def features(self):
+        """Per-admission feature table in the column order of the notebook's ``feat``."""
+        stats = self.stats.sort_index()
+        out = pd.DataFrame(index=stats.index)
+        out['num_labs'] = stats['n']
+        out['abnormal_ratio'] = stats['n_abnormal'] / stats['n']
+        out['qc_fail_ratio'] = stats['qc_sum'] / stats['qc_n'].where(stats['qc_n'] > 0)
+        out['lab_time_span_hours'] = (stats['t_max'] - stats['t_min']).dt.total_seconds() / 3600
+        for name, col in DISTINCT_FEATURES.items():
+            state = self.distinct[col]
+            if isinstance(state.index, pd.MultiIndex):
+                counts = pd.Series(np.round(_hll_estimate(state.to_numpy())), index=state.index)
+            else:
+                counts = state.groupby(KEYS).size()
+            out[name] = counts.reindex(stats.index, fill_value=0).astype(np.int64)
+        for name in ANALYTE_FEATURES:
+            out[name] = stats[name]
+        for name in GROUP_COUNTS:
+            out[name] = stats[name]
+        out['has_labs'] = 1
+        return out.reset_index()
+
+
+def _reduce_chunk(args):
+    chunk, transform, distinct, hll_precision = args
+    if transform is not None:
+        chunk = transform(chunk)
+    return LabPartial.from_events(chunk, distinct=distinct, hll_precision=hll_precision)
+
+
+def iter_lab_chunks(paths, chunksize=1_000_000, usecols=USECOLS, **read_csv_kwargs):
+    """Yield DataFrame chunks of one or several lab event CSV files."""
+    paths = [paths] if isinstance(paths, (str, os.PathLike)) else paths
+    for path in paths:
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=usecols, index_col=False,
+                               **read_csv_kwargs)
+
+
+def aggregate_lab_events(paths, chunksize=1_000_000, n_workers=1, transform=None,
+                         distinct='exact', hll_precision=8, merge_every=16, **read_csv_kwargs):
+    """Per-admission lab features from CSV files too large to load at once.
+
+    Args:
+        paths: Cleaned lab event CSV path or list of paths (shards)
+        chunksize: Rows per chunk
+        n_workers: Worker processes reducing chunks (1 = in process); chunks are
+            read by the main process, at most 2 * n_workers are in flight
+        transform: Optional picklable function applied to every chunk first
+            (e.g. cleaning steps from lab_cleaning)
+        distinct: 'exact' or 'hll' distinct counting (see module docstring)
+        hll_precision: log2 of the HLL registers per admission
+        merge_every: Pending partials merged at once (bounds memory)
+        **read_csv_kwargs: Forwarded to pd.read_csv (e.g. usecols=None, dtype=...)
+
+    Returns:
+        (features DataFrame, LabPartial) - the partial can be merged with the
+        partial of new events later
+    """
+    chunks = iter_lab_chunks(paths, chunksize=chunksize, **read_csv_kwargs)
+    tasks = ((chunk, transform, distinct, hll_precision) for chunk in chunks)
+    merged, pending = None, []
+
+    def collect(partial):
+        nonlocal merged, pending
+        pending.append(partial)
+        if len(pending) >= merge_every:
+            merged = LabPartial.merge(([merged] if merged is not None else []) + pending)
+            pending = []
+
+    if n_workers == 1:
+        for task in tasks:
+            collect(_reduce_chunk(task))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count()) as pool:
+            in_flight = []
+            for task in tasks:
+                in_flight.append(pool.submit(_reduce_chunk, task))
+                if len(in_flight) >= 2 * (n_workers or os.cpu_count()):
+                    collect(in_flight.pop(0).result())
+            for future in in_flight:
+                collect(future.result())
+
+    partials = ([merged] if merged is not None else []) + pending
+    if not partials:
+        raise ValueError("No lab events found")
+    partial = LabPartial.merge(partials)
+    return partial.features(), partial
@@ -0,0 +1,207 @@
+"""Vectorized cleaning of the laboratory table (notebook 1.1 df2 laboratory).
+
+The lab table has ~1M rows but only a few thousand distinct raw strings in
+``value``, ``label`` and ``valueuom``. Every parser here factorizes the column
+once, parses the distinct strings with column-wise ``str`` operations, and
+broadcasts the result back through the integer codes, so the cost grows with
+the number of distinct strings rather than the number of rows. Flags and unit
+conversions are plain array comparisons and lookups.
+
+The parsing rules are the ones of the notebook's ``extract_numeric_from_value``:
+plain numbers, ``a/b`` (b != 0), ``a-b`` ranges (midpoint) and ``<x``/``>x``
+comparators (x -+ 0.1, ``<=``/``>=`` keep x), in this order of precedence.
+"""
+import numpy as np
+import pandas as pd
+
+PLACEHOLDERS = ('___', 'NONE', 'ERROR')
+
+
+def _distinct(series):
+    """(codes, distinct values as a string Index); code -1 marks missing values."""
+    codes, uniques = pd.factorize(series)
+    return codes, pd.Index(uniques).astype(str)
+
+
+def _broadcast(codes, values, fill=np.nan):
+    """Map per-distinct values back to rows."""
+    values = np.asarray(values)
+    out = values[np.maximum(codes, 0)]
+    if (codes < 0).any():
+        out = out.astype(float) if out.dtype.kind in 'iub' else out.copy()
+        out[codes < 0] = fill
+    return out
+
+
+def _to_float(strings):
+    """float() semantics on a string Index/Series (NaN where float() would fail)."""
+    strings = pd.Series(strings, dtype=object).str.strip()
+    # float() accepts underscores between digits ('1_000'), to_numeric does not
+    strings = strings.str.replace(r'(?<=\d)_(?=\d)', '', regex=True)
+    # ... and rejects inner whitespace ('5e 3'), which to_numeric tolerates
+    strings = strings.mask(strings.str.contains(r'\s', na=False))
+    return pd.to_numeric(strings, errors='coerce').to_numpy(dtype=float)
+
+
+def _is_nan_literal(strings):
+    """Strings that float() parses as NaN."""
+    return pd.Series(strings, dtype=object).str.strip().str.lower().isin(['nan', '+nan', '-nan']).to_numpy()
+
+
+def parse_numeric_strings(strings):
+    """Parse distinct raw value strings (see module docstring for the rules).
+
+    Args:
+        strings: Index/Series of strings
+
+    Returns:
+        float array aligned with strings
+    """
+    s = pd.Series(strings, dtype=object).str.strip()
+    result = _to_float(s)
+
+    # Divisions 'a/b': exactly two non-empty parts and b != 0
+    parts = s.str.extract(r'^([^/]*)/([^/]*)$')
+    num, den = _to_float(parts[0]), _to_float(parts[1])
+    division_ok = ~np.isnan(num) & ~np.isnan(den) & (den != 0)
+    with np.errstate(invalid='ignore', over='ignore'):
+        division = num / np.where(division_ok, den, 1.0)
+
+    # Ranges 'a-b' (not starting with '-'): midpoint
+    parts = s.str.extract(r'^([^-]+)-([^-]*)$')
+    low, high = _to_float(parts[0]), _to_float(parts[1])
+    midpoint = (low + high) / 2
+    range_ok = ~np.isnan(low) & ~np.isnan(high)
+
+    # Comparators '<x', '>x', '<=x', '>=x'
+    parts = s.str.extract(r'^([<>]=?)(\d*\.?\d+)$')
+    bound = _to_float(parts[1])
+    shift = parts[0].map({'>': 0.1, '<': -0.1, '>=': 0.0, '<=': 0.0}).to_numpy(dtype=float)
+    comparison = bound + shift
+
+    direct_ok = ~np.isnan(result) | _is_nan_literal(s)
+    return np.select(
+        [direct_ok, division_ok, range_ok],
+        [result, division, midpoint],
+        default=comparison,
+    )
+
+
+def extract_numeric(values):
+    """Vectorized replacement for ``df['value'].apply(extract_numeric_from_value)``."""
+    codes, uniques = _distinct(values)
+    parsed = parse_numeric_strings(uniques)
+    return pd.Series(_broadcast(codes, parsed), index=getattr(values, 'index', None), dtype=float)
+
+
+def replace_placeholders(values, placeholders=PLACEHOLDERS):
+    """Set case-insensitive placeholder strings to NaN.
+
+    Returns:
+        (cleaned Series, dict placeholder -> number of replaced rows)
+    """
+    codes, uniques = _distinct(values)
+    lowered = uniques.str.lower()
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    hits, replaced = {}, np.zeros(len(uniques), dtype=bool)
+    for placeholder in placeholders:
+        match = np.asarray(lowered == placeholder.lower())
+        hits[placeholder] = int(counts[match].sum())
+        replaced |= match
+    cleaned = values.mask(_broadcast(codes, replaced, fill=False).astype(bool))
+    return cleaned, hits
+
+
+def non_numeric_summary(df, columns=None):
+    """Non-numerical entries of object columns, counted per distinct value.
+
+    Args:
+        df: DataFrame
+        columns: Columns to scan (default: all object columns)
+
+    Returns:
+        DataFrame with column, value, count and first_index, sorted by column and count
+    """
+    columns = df.select_dtypes(include=['object']).columns if columns is None else columns
+    frames = []
+    for col in columns:
+        codes, uniques = _distinct(df[col])
+        bad = np.isnan(_to_float(uniques)) & ~_is_nan_literal(uniques)
+        if not bad.any():
+            continue
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        first = pd.Series(df.index[codes >= 0]).groupby(codes[codes >= 0]).first()
+        bad_codes = np.flatnonzero(bad)
+        frames.append(pd.DataFrame({
+            'column': col,
+            'value': uniques[bad_codes],
+            'count': counts[bad_codes],
+            'first_index': first.reindex(bad_codes).to_numpy(),
+        }))
+    if not frames:
+        return pd.DataFrame(columns=['column', 'value', 'count', 'first_index'])
+    return (pd.concat(frames, ignore_index=True)
+            .sort_values(['column', 'count'], ascending=[True, False], ignore_index=True))
+
+
+def expected_flag(values, ref_low, ref_high):
+    """Vectorized replacement for ``df.apply(compute_expected_flag, axis=1)``.
+
+    'abnormal' if the value lies below the lower or above the upper reference
+    bound (either bound may be missing), 'normal' otherwise, NaN without a value
+    or without any bound.
+    """
+    val = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    low = pd.to_numeric(ref_low, errors='coerce').to_numpy(dtype=float)
+    high = pd.to_numeric(ref_high, errors='coerce').to_numpy(dtype=float)
+    with np.errstate(invalid='ignore'):
+        abnormal = (val < low) | (val > high)
+    undetermined = np.isnan(val) | (np.isnan(low) & np.isnan(high))
+    flags = np.where(abnormal, 'abnormal', 'normal').astype(object)
+    flags[undetermined] = np.nan
+    return pd.Series(flags, index=getattr(values, 'index', None), dtype=object)
+
+
+def convert_units(df, conversion_map, label_col='label', unit_col='valueuom',
+                  value_col='valuenum_merged'):
+    """Apply a {(label_lowercase, from_unit): (factor, to_unit)} table in one pass.
+
+    Every row is matched on its original (label, unit) pair, so a row is
+    converted at most once. df is modified in place.
+
+    Returns:
+        Summary DataFrame with one row per rule (same columns as the notebook's loop)
+    """
+    rules = pd.MultiIndex.from_tuples(list(conversion_map.keys()), names=['analyte', 'from_unit'])
+    factors = np.array([f for f, _ in conversion_map.values()], dtype=float)
+    to_units = np.array([u for _, u in conversion_map.values()], dtype=object)
+
+    # Match the distinct (label, unit) pairs once, then broadcast the rule index
+    pairs = pd.MultiIndex.from_arrays([df[label_col], df[unit_col]])
+    codes, uniques = pairs.factorize()
+    lowered = pd.Index(uniques.get_level_values(0)).str.lower()
+    rule_of_pair = rules.get_indexer(pd.MultiIndex.from_arrays([lowered, uniques.get_level_values(1)]))
+    rule = np.where(codes >= 0, rule_of_pair[np.maximum(codes, 0)], -1)
+
+    matched = rule >= 0
+    before = pd.to_numeric(df[value_col], errors='coerce').to_numpy(dtype=float)
+    after = before.copy()
+    after[matched] = before[matched] * factors[rule[matched]]
+    df[value_col] = after
+    if matched.any():
+        df.loc[matched, unit_col] = to_units[rule[matched]]
+
+    rows_matched = np.bincount(rule[matched], minlength=len(rules))
+    non_null_before = np.bincount(rule[matched], weights=~np.isnan(before[matched]), minlength=len(rules))
+    non_null_after = np.bincount(rule[matched], weights=~np.isnan(after[matched]), minlength=len(rules))
+    summary = pd.DataFrame({
+        'analyte': rules.get_level_values(0),
+        'from_unit': rules.get_level_values(1),
+        'to_unit': to_units,
+        'rows_matched': rows_matched,
+        'rows_converted': non_null_after.astype(int),
+        'rows_failed': (non_null_before - non_null_after).astype(int),
+    })
+    summary['status'] = np.where(summary['rows_matched'] == 0, 'NO MATCH',
+                                 np.where(summary['rows_failed'] == 0, 'OK', 'PARTIAL'))
+    return summary
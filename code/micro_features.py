@@ -0,0 +1,112 @@
+"""Per-admission microbiology features (notebook 1.1 df3 microbiology).
+
+The notebook computes every feature with its own pass over
+``groupby(['subject_id', 'hadm_id'])`` (three of them ``apply`` lambdas for the
+S/R/I counts). Here the interpretation and QC flags are one-hot encoded once
+and all features come out of a single named aggregation on one grouping; the
+ratios and ``micro_resistance_score`` (as defined in 1.2 create patient
+profile) are derived from the aggregated columns.
+
+``parse_dilution_text`` replaces the row-wise parser with a single
+``str.extract``, and ``organism_antibiotic_matrix`` gives an optional sparse
+admission x (organism, antibiotic) matrix of test or resistance counts.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+KEYS = ['subject_id', 'hadm_id']
+INTERPRETATIONS = {'S': 'num_susceptible', 'R': 'num_resistant', 'I': 'num_intermediate'}
+QC_FLAGS = {'QC_FAIL': 'micro_qc_fail', 'QC_WARN': 'micro_qc_warn'}
+MICRO_FEATURES = [
+    'total_microbio_events', 'unique_specimen_types', 'unique_test_names', 'unique_organisms',
+    'unique_antibiotics', 'unique_technicians', 'num_susceptible', 'num_resistant',
+    'num_intermediate', 'resistant_ratio', 'micro_qc_fail', 'micro_qc_warn', 'micro_qc_ok',
+    'micro_time_span_hours', 'has_micro', 'micro_resistance_score',
+]
+
+
+def parse_dilution_text(values):
+    """Split dilution strings like '<=0.5', '=>16' or '4' into comparator and value.
+
+    Args:
+        values: Series of dilution_text
+
+    Returns:
+        DataFrame with 'comparison' (default '=' when a number has no comparator)
+        and float 'value'; NaN for missing or unparseable text
+    """
+    parts = values.astype('string').str.strip().str.extract(r'^([<>=]+)?\s*(\d+\.?\d*)$')
+    value = pd.to_numeric(parts[1], errors='coerce').astype(float)
+    comparison = parts[0].where(parts[0].notna() | value.isna(), '=').astype(object)
+    comparison = comparison.where(value.notna(), np.nan)
+    return pd.DataFrame({'comparison': comparison, 'value': value}, index=values.index)
+
+
+def micro_admission_features(df, keys=KEYS):
+    """All per-admission microbiology features in one grouped aggregation.
+
+    Args:
+        df: Microbiology events with interpretation, qc_flag, charttime and the
+            descriptive columns
+        keys: Admission key columns
+
+    Returns:
+        DataFrame with the key columns and MICRO_FEATURES
+    """
+    interp = df['interpretation'].to_numpy()
+    qc = df['qc_flag'].to_numpy()
+    onehot = {f'_{code}': (interp == code).astype(np.int64) for code in INTERPRETATIONS}
+    onehot.update({f'_{flag}': (qc == flag).astype(np.int64) for flag in QC_FLAGS})
+    charttime = df['charttime']
+    if not pd.api.types.is_datetime64_any_dtype(charttime):
+        charttime = pd.to_datetime(charttime, errors='coerce')
+    frame = df[keys + ['spec_type_desc', 'test_name', 'org_name', 'ab_name', 'technician_id']] \
+        .assign(charttime=charttime, **onehot)
+
+    feats = frame.groupby(keys).agg(
+        total_microbio_events=('charttime', 'size'),
+        unique_specimen_types=('spec_type_desc', 'nunique'),
+        unique_test_names=('test_name', 'nunique'),
+        unique_organisms=('org_name', 'nunique'),
+        unique_antibiotics=('ab_name', 'nunique'),
+        unique_technicians=('technician_id', 'nunique'),
+        **{name: (f'_{code}', 'sum') for code, name in INTERPRETATIONS.items()},
+        **{name: (f'_{flag}', 'sum') for flag, name in QC_FLAGS.items()},
+        _t_min=('charttime', 'min'),
+        _t_max=('charttime', 'max'),
+    )
+    total = feats['total_microbio_events']
+    feats.insert(feats.columns.get_loc('num_intermediate') + 1, 'resistant_ratio',
+                 feats['num_resistant'] / total)
+    feats['micro_qc_ok'] = total - feats['micro_qc_fail'] - feats['micro_qc_warn']
+    feats['micro_time_span_hours'] = (feats['_t_max'] - feats['_t_min']).dt.total_seconds() / 3600
+    feats['has_micro'] = 1
+    feats['micro_resistance_score'] = feats['resistant_ratio'].fillna(0) * np.log1p(
+        feats['unique_organisms'] + feats['unique_specimen_types'])
+    return feats[MICRO_FEATURES].reset_index()
+
+
+def organism_antibiotic_matrix(df, keys=KEYS, value='count'):
+    """Sparse admission x (organism, antibiotic) matrix.
+
+    Args:
+        df: Microbiology events
+        keys: Admission key columns
+        value: 'count' (tests) or 'resistant' (R interpretations)
+
+    Returns:
+        (csr_matrix, admissions MultiIndex, (org_name, ab_name) MultiIndex)
+    """
+    tested = df.dropna(subset=['org_name', 'ab_name'] + keys)
+    rows, admissions = pd.MultiIndex.from_frame(tested[keys]).factorize()
+    cols, pairs = pd.MultiIndex.from_frame(tested[['org_name', 'ab_name']]).factorize()
+    if value == 'count':
+        data = np.ones(len(tested))
+    elif value == 'resistant':
+        data = (tested['interpretation'] == 'R').to_numpy(dtype=float)
+    else:
+        raise ValueError("value must be 'count' or 'resistant'")
+    matrix = sparse.coo_matrix((data, (rows, cols)), shape=(len(admissions), len(pairs))).tocsr()
+    matrix.eliminate_zeros()
+    return matrix, admissions, pairs
@@ -0,0 +1,224 @@
+"""Cross-validated model zoo with shared folds and successive-halving tuning (notebooks 4 and 6).
+
+Notebook 4 fits six classifiers one after the other, then calls
+``cross_val_score`` four times per model (one call per metric, so every fold
+is fitted four times), on a training set that was standardized before the
+split into folds. Here:
+
+- ``FoldCache`` materializes the stratified folds once, together with the
+  per-fold standardized matrices (scaler fitted on the fold's training part
+  only), and optionally the train/test holdout as one more "fold";
+- every (model, configuration, fold) fit is an independent job in one joblib
+  process pool, and each job records train and test metrics in one go
+  (ROC-AUC, balanced accuracy, F1, accuracy, precision, recall);
+- ``halving_search`` tunes a model by successive halving: all configurations
+  start on a small budget (training rows per fold, or e.g. ``n_estimators``),
+  and only the best 1/factor of them move on to the next rung with factor
+  times the budget. Poor configurations are pruned after a few cheap fits
+  instead of being fitted on the full grid.
+
+Everything is recorded in long results tables (one row per fit), from which
+``summarize`` builds the mean / std per model.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import (accuracy_score, balanced_accuracy_score, f1_score, precision_score,
+                             recall_score, roc_auc_score)
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import StandardScaler
+
+METRICS = ['roc_auc', 'balanced_accuracy', 'f1', 'accuracy', 'precision', 'recall']
+
+
+def classification_metrics(y_true, y_pred, y_score):
+    """Metrics of notebook 4 for one set of predictions (y_score: probability of class 1)."""
+    return {
+        'roc_auc': roc_auc_score(y_true, y_score) if len(np.unique(y_true)) > 1 else np.nan,
+        'balanced_accuracy': balanced_accuracy_score(y_true, y_pred),
+        'f1': f1_score(y_true, y_pred, zero_division=0),
+        'accuracy': accuracy_score(y_true, y_pred),
+        'precision': precision_score(y_true, y_pred, zero_division=0),
+        'recall': recall_score(y_true, y_pred, zero_division=0),
+    }
+
+
+class FoldCache:
+    """Stratified folds of one training set, with raw and standardized matrices per fold.
+
+    Args:
+        X: Training features (DataFrame or array)
+        y: Training labels (0/1)
+        n_splits: Number of folds
+        random_state: Seed of the fold shuffle
+        holdout: Optional (X_test, y_test); added as fold 'holdout', trained
+            on all of X (scaler fitted on X)
+        scaler: Transformer cloned and fitted per fold for the scaled matrices
+    """
+
+    def __init__(self, X, y, n_splits=5, random_state=42, holdout=None, scaler=StandardScaler()):
+        self.columns = list(X.columns) if hasattr(X, 'columns') else None
+        self.X = np.ascontiguousarray(X, dtype=np.float64)
+        self.y = np.asarray(y).astype(int)
+        cv = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+        self.splits = [(train, test) for train, test in cv.split(self.X, self.y)]
+        self.folds = {}
+        for i, (train, test) in enumerate(self.splits):
+            self.folds[i] = self._materialize(self.X[train], self.y[train], self.X[test], self.y[test], scaler)
+        if holdout is not None:
+            X_test, y_test = holdout
+            self.folds['holdout'] = self._materialize(self.X, self.y, np.ascontiguousarray(X_test, dtype=np.float64),
+                                                      np.asarray(y_test).astype(int), scaler)
+
+    @staticmethod
+    def _materialize(X_train, y_train, X_test, y_test, scaler):
+        scaler = clone(scaler).fit(X_train)
+        return {'X_train': X_train, 'y_train': y_train, 'X_test': X_test, 'y_test': y_test,
+                'X_train_scaled': scaler.transform(X_train), 'X_test_scaled': scaler.transform(X_test)}
+
+    @property
+    def cv_folds(self):
+        """Fold ids of the cross-validation folds (without the holdout)."""
+        return [fold for fold in self.folds if fold != 'holdout']
+
+    def data(self, fold, scaled):
+        """(X_train, y_train, X_test, y_test) of one fold, standardized or raw."""
+        f = self.folds[fold]
+        suffix = '_scaled' if scaled else ''
+        return f['X_train' + suffix], f['y_train'], f['X_test' + suffix], f['y_test']
+
+
+def _fit_and_score(estimator, params, X_train, y_train, X_test, y_test, n_samples=None, seed=0,
+                   keep_model=False):
+    """Fit a clone on one fold (optionally on a stratified subsample of n_samples rows) and score it."""
+    model = clone(estimator).set_params(**params)
+    if n_samples is not None and n_samples < len(y_train):
+        rng = np.random.default_rng(seed)
+        rows = np.concatenate([
+            rng.choice(np.flatnonzero(y_train == c), size=max(1, round(n_samples * np.mean(y_train == c))),
+                       replace=False) for c in np.unique(y_train)])
+        X_train, y_train = X_train[rows], y_train[rows]
+    model.fit(X_train, y_train)
+    result = {}
+    for split, X_split, y_split in (('train', X_train, y_train), ('test', X_test, y_test)):
+        score = model.predict_proba(X_split)[:, 1]
+        pred = model.predict(X_split)
+        for metric, value in classification_metrics(y_split, pred, score).items():
+            result[f'{split}_{metric}'] = value
+        if split == 'test' and keep_model:
+            result['y_pred'], result['y_proba'] = pred, score
+    if keep_model:
+        result['model'] = model
+    return result
+
+
+def evaluate_models(models, folds, scaled=(), fold_ids=None, keep_models=False, n_jobs=-1):
+    """Fit every model on every fold in one process pool.
+
+    Args:
+        models: dict name -> unfitted estimator
+        folds: FoldCache
+        scaled: Names of the models that use the standardized matrices
+        fold_ids: Folds to use (default: the cross-validation folds)
+        keep_models: Also return the fitted models and their test predictions
+        n_jobs: Parallel workers (joblib semantics)
+
+    Returns:
+        (DataFrame with one row per (model, fold) and train_/test_ metrics,
+        dict (name, fold) -> fitted model with y_pred / y_proba, empty unless keep_models)
+    """
+    fold_ids = folds.cv_folds if fold_ids is None else list(fold_ids)
+    jobs = [(name, fold) for name in models for fold in fold_ids]
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_and_score)(models[name], {}, *folds.data(fold, name in scaled), keep_model=keep_models)
+        for name, fold in jobs)
+    fitted = {}
+    rows = []
+    for (name, fold), result in zip(jobs, results):
+        if keep_models:
+            fitted[(name, fold)] = {key: result.pop(key) for key in ('model', 'y_pred', 'y_proba')}
+        rows.append({'model': name, 'fold': fold, **result})
+    return pd.DataFrame(rows), fitted
+
+
+def summarize(results, by='model'):
+    """Mean and std of every metric per model (or per config), over folds."""
+    metrics = [col for col in results.columns if col.startswith(('train_', 'test_'))]
+    summary = results.groupby(by, sort=False)[metrics].agg(['mean', 'std'])
+    summary.columns = [f'{metric}_{stat}' for metric, stat in summary.columns]
+    return summary.reset_index()
+
+
+def halving_search(estimator, param_grid, folds, scaled=False, resource='n_samples', min_resource=None,
+                   max_resource=None, factor=3, scoring='roc_auc', n_jobs=-1, random_state=0):
+    """Successive halving over a parameter grid, with every rung's fits in one process pool.
+
+    Rung r evaluates the surviving configurations on all cross-validation
+    folds with budget min_resource * factor**r and keeps the best
+    ceil(n / factor) by mean test score, until one configuration is left or
+    the budget reaches max_resource (the last rung always uses max_resource).
+
+    Args:
+        estimator: Unfitted estimator
+        param_grid: dict name -> values (full grid) or list of such dicts
+        folds: FoldCache
+        scaled: Use the standardized matrices
+        resource: 'n_samples' (training rows per fold, stratified subsample)
+            or an integer estimator parameter such as 'n_estimators'
+        min_resource: Budget of the first rung (default: max_resource / factor**(rungs - 1)
+            so that the grid is reduced to about one configuration)
+        max_resource: Budget of the last rung (default: the fold's training
+            size for 'n_samples', required otherwise)
+        factor: Fraction of configurations kept (1/factor) and budget growth per rung
+        scoring: Test metric used to rank configurations
+        n_jobs: Parallel workers (joblib semantics)
+        random_state: Seed of the subsamples
+
+    Returns:
+        (DataFrame with one row per (config, rung, fold): config, params,
+        rung, resource, fold and train_/test_ metrics; best params dict)
+    """
+    grids = param_grid if isinstance(param_grid, list) else [param_grid]
+    configs = [dict(zip(grid, values)) for grid in grids for values in itertools.product(*grid.values())]
+    fold_ids = folds.cv_folds
+    if max_resource is None:
+        if resource != 'n_samples':
+            raise ValueError(f"max_resource is required for resource={resource!r}")
+        max_resource = min(len(folds.folds[fold]['y_train']) for fold in fold_ids)
+    n_rungs = 1 + int(np.ceil(np.log(max(len(configs), 1)) / np.log(factor)))
+    if min_resource is None:
+        min_resource = max(1, int(max_resource / factor ** (n_rungs - 1)))
+        if resource == 'n_samples':  # enough rows of every class to fit anything
+            min_resource = max(min_resource, 10 * len(np.unique(folds.y)))
+
+    alive = list(range(len(configs)))
+    rows = []
+    rung = 0
+    while True:
+        budget = int(min(max_resource, min_resource * factor ** rung))
+        last = len(alive) == 1 or budget >= max_resource
+        if last:
+            budget = int(max_resource)
+        jobs = [(c, fold) for c in alive for fold in fold_ids]
+        results = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_and_score)(
+                estimator, configs[c] if resource == 'n_samples' else {**configs[c], resource: budget},
+                *folds.data(fold, scaled), n_samples=budget if resource == 'n_samples' else None,
+                seed=random_state + rung)
+            for c, fold in jobs)
+        for (c, fold), result in zip(jobs, results):
+            rows.append({'config': c, 'params': configs[c], 'rung': rung, 'resource': budget, 'fold': fold,
+                         **result})
+        if last:
+            break
+        scores = pd.DataFrame(rows[-len(jobs):]).groupby('config')[f'test_{scoring}'].mean()
+        keep = int(np.ceil(len(alive) / factor))
+        alive = list(scores.sort_values(ascending=False, kind='stable').index[:keep])
+        rung += 1
+
+    results = pd.DataFrame(rows)
+    final = results[results['rung'] == rung].groupby('config')[f'test_{scoring}'].mean()
+    return results, dict(configs[int(final.idxmax())])
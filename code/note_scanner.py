@@ -0,0 +1,248 @@
+"""Multi-pattern keyword scanning of the clinical text columns (notebook 1.1 df1 heart).
+
+The notebook searches the notes pattern by pattern and row by row (``iterrows``
+plus one ``re.findall`` per keyword, one ``str.contains`` per suspicious entry
+and column). ``NoteScanner`` compiles a list of patterns once and scans every
+text once, returning a sparse documents x patterns matrix of match counts:
+
+- patterns of the form ``\\bword\\b`` (the common keyword case) are combined
+  into a single ``\\b(?:w1|w2|...)\\b`` alternation. Whole words never overlap,
+  so counting the alternation's matches per word is exact;
+- all other patterns (literals, prefixes, multi-word or lookahead patterns) go
+  into one lookahead alternation that finds every position where any of them
+  matches. The remaining patterns are only tried at those positions, which
+  reproduces ``len(re.findall(pattern, text))`` for every pattern, including
+  overlapping matches of different patterns.
+
+Texts are lowercased first (as in the notebook) and patterns are used as
+written. Large columns are split into chunks scanned on a process pool. The
+matrix feeds gender imputation, sentinel detection and keyword features.
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+TEXT_COLS = ['HPI', 'physical_exam', 'reports']
+_WORD = re.compile(r'\\b(\w+)\\b')
+
+
+class NoteScanner:
+    """Count matches of many regex patterns in many texts with one scan per text.
+
+    Args:
+        patterns: Regex patterns (or literal strings with literal=True)
+        literal: Escape the patterns (substring search, like str.contains(regex=False))
+        lowercase: Lowercase the texts before matching
+    """
+
+    def __init__(self, patterns, literal=False, lowercase=True):
+        self.patterns = list(patterns)
+        self.literal = literal
+        self.lowercase = lowercase
+        regexes = [re.escape(p) for p in self.patterns] if literal else self.patterns
+
+        self._words = {}  # word -> pattern columns
+        self._other = []
+        for j, pattern in enumerate(regexes):
+            word = _WORD.fullmatch(pattern)
+            if word:
+                self._words.setdefault(word.group(1), []).append(j)
+            else:
+                self._other.append(j)
+
+        self._word_re = None
+        if self._words:
+            words = sorted(self._words, key=len, reverse=True)
+            self._word_re = re.compile(r'\b(?:' + '|'.join(words) + r')\b')
+        self._other_re = None
+        if self._other:
+            self._compiled = {j: re.compile(regexes[j]) for j in self._other}
+            self._other_re = re.compile(
+                '(?=' + '|'.join(f'(?P<_p{j}>{regexes[j]})' for j in self._other) + ')')
+
+    def _count(self, text):
+        """{pattern column: count} for one text."""
+        counts = {}
+        if self._word_re is not None:
+            for word in self._word_re.findall(text):
+                for j in self._words[word]:
+                    counts[j] = counts.get(j, 0) + 1
+        if self._other_re is not None:
+            # Every start position where some pattern matches; emulate findall
+            # (non-overlapping, left to right) per pattern from those positions
+            ends = {}
+            for hit in self._other_re.finditer(text):
+                pos = hit.start()
+                first = True  # alternatives before the one that matched failed here
+                for j in self._other:
+                    if hit.group(f'_p{j}') is not None:
+                        end, first = hit.end(f'_p{j}'), False
+                    elif first:
+                        continue
+                    else:
+                        match = self._compiled[j].match(text, pos)
+                        if match is None:
+                            continue
+                        end = match.end()
+                    if pos >= ends.get(j, -1):
+                        counts[j] = counts.get(j, 0) + 1
+                        ends[j] = max(end, pos + 1)
+        return counts
+
+    def _scan_chunk(self, texts):
+        rows, cols, data = [], [], []
+        for i, text in enumerate(texts):
+            if not isinstance(text, str):
+                continue
+            for j, n in self._count(text.lower() if self.lowercase else text).items():
+                rows.append(i)
+                cols.append(j)
+                data.append(n)
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), np.array(data, dtype=np.int32)
+
+    def scan(self, texts, n_workers=1, chunk_size=2000):
+        """Match counts of every pattern in every text.
+
+        Args:
+            texts: Sequence of texts; non-strings (NaN) have no matches
+            n_workers: Worker processes (1 = in process)
+            chunk_size: Texts per worker task
+
+        Returns:
+            csr_matrix (n_texts, n_patterns) of int32 counts
+        """
+        texts = list(texts)
+        starts = list(range(0, len(texts), chunk_size))
+        chunks = [texts[s:s + chunk_size] for s in starts]
+        if n_workers == 1 or len(chunks) <= 1:
+            results = [self._scan_chunk(chunk) for chunk in chunks]
+        else:
+            tasks = ((self.patterns, self.literal, self.lowercase, chunk) for chunk in chunks)
+            with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count()) as pool:
+                results = list(pool.map(_scan_task, tasks))
+
+        rows = [r + s for (r, _, _), s in zip(results, starts)]
+        cols = [c for _, c, _ in results]
+        data = [d for _, _, d in results]
+        if not results:
+            rows = cols = data = [np.empty(0, dtype=np.int64)]
+        return sparse.csr_matrix(
+            (np.concatenate(data).astype(np.int32), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(texts), len(self.patterns)))
+
+    def scan_columns(self, df, columns=TEXT_COLS, n_workers=1, chunk_size=2000):
+        """Scan every column once and add the counts per row (df row order)."""
+        columns = [col for col in columns if col in df.columns]
+        total = sparse.csr_matrix((len(df), len(self.patterns)), dtype=np.int32)
+        for col in columns:
+            total = total + self.scan(df[col].to_numpy(dtype=object), n_workers, chunk_size)
+        return total
+
+
+@lru_cache(maxsize=8)
+def _cached_scanner(patterns, literal, lowercase):
+    return NoteScanner(patterns, literal=literal, lowercase=lowercase)
+
+
+def _scan_task(args):
+    patterns, literal, lowercase, texts = args
+    return _cached_scanner(tuple(patterns), literal, lowercase)._scan_chunk(texts)
+
+
+def impute_gender_from_keywords(df, female_keywords, male_keywords, rows=None,
+                                text_cols=TEXT_COLS, resolve_conflicting=False, n_workers=1):
+    """Gender from female/male keyword counts in the text columns.
+
+    Args:
+        df: Heart diagnoses table
+        female_keywords, male_keywords: Regex patterns (matched on lowercased text)
+        rows: Boolean mask or index of the rows to impute (default: missing gender)
+        text_cols: Text columns to scan
+        resolve_conflicting: If both sexes match, take the one with more matches
+        n_workers: Worker processes for the scan
+
+    Returns:
+        (DataFrame indexed like the selected rows with female_count, male_count,
+        match ('female', 'male', 'both', 'none') and gender ('F', 'M' or NaN),
+        csr_matrix of counts per row and keyword, female keywords first)
+    """
+    subset = df.loc[df['gender'].isna() if rows is None else rows]
+    scanner = NoteScanner(list(female_keywords) + list(male_keywords))
+    counts = scanner.scan_columns(subset, text_cols, n_workers=n_workers)
+    n_female = len(female_keywords)
+    female = np.asarray(counts[:, :n_female].sum(axis=1)).ravel()
+    male = np.asarray(counts[:, n_female:].sum(axis=1)).ravel()
+
+    match = np.select([(female > 0) & (male > 0), female > 0, male > 0],
+                      ['both', 'female', 'male'], default='none')
+    gender = np.select([match == 'female', match == 'male'], ['F', 'M'], default='')
+    if resolve_conflicting:
+        gender = np.where((match == 'both') & (female > male), 'F', gender)
+        gender = np.where((match == 'both') & (male > female), 'M', gender)
+    result = pd.DataFrame({'female_count': female, 'male_count': male, 'match': match,
+                           'gender': pd.Series(gender).replace('', np.nan).to_numpy()},
+                          index=subset.index)
+    return result, counts
+
+
+def infer_gender_from_icd(icd_codes, sex_specific_codes):
+    """'M'/'F' where the ICD code contains a sex-specific code (male checked first).
+
+    Args:
+        icd_codes: Series of ICD codes
+        sex_specific_codes: {'M': [substrings], 'F': [substrings]}
+
+    Returns:
+        Series of 'M', 'F' or NaN aligned with icd_codes
+    """
+    male, female = list(sex_specific_codes['M']), list(sex_specific_codes['F'])
+    scanner = NoteScanner(male + female, literal=True, lowercase=False)
+    counts = scanner.scan(icd_codes.astype(str).to_numpy(dtype=object))
+    has_male = np.asarray(counts[:, :len(male)].sum(axis=1)).ravel() > 0
+    has_female = np.asarray(counts[:, len(male):].sum(axis=1)).ravel() > 0
+    return pd.Series(np.select([has_male, has_female], ['M', 'F'], default=None),
+                     index=icd_codes.index).replace({None: np.nan})
+
+
+def count_sentinels(df, entries, columns=None, n_workers=1):
+    """Rows per column whose lowercased text contains a suspicious entry.
+
+    The empty entry counts blank cells. Every column is scanned once for all
+    entries.
+
+    Returns:
+        DataFrame with column, entry and count (only non-zero counts)
+    """
+    columns = df.columns if columns is None else columns
+    literals = [e for e in entries if e.strip()]
+    scanner = NoteScanner(list(dict.fromkeys(e.lower() for e in literals)), literal=True)
+    position = {p: j for j, p in enumerate(scanner.patterns)}
+    rows = []
+    for col in columns:
+        text = df[col].astype(str)
+        hits = np.asarray((scanner.scan(text.to_numpy(dtype=object), n_workers) > 0).sum(axis=0)).ravel()
+        blank = int((text.str.strip() == '').sum())
+        for entry in entries:
+            count = hits[position[entry.lower()]] if entry.strip() else blank
+            if count > 0:
+                rows.append({'column': col, 'entry': entry, 'count': int(count)})
+    return pd.DataFrame(rows, columns=['column', 'entry', 'count'])
+
+
+def keyword_features(df, keyword_groups, text_cols=TEXT_COLS, n_workers=1):
+    """Match counts per keyword group (e.g. {'cardiac_test': [r'\\becho\\b', r'\\bcath']}).
+
+    Returns:
+        DataFrame indexed like df with one count column per group
+    """
+    names = list(keyword_groups)
+    patterns = [p for name in names for p in keyword_groups[name]]
+    counts = NoteScanner(patterns).scan_columns(df, text_cols, n_workers=n_workers)
+    bounds = np.cumsum([0] + [len(keyword_groups[name]) for name in names])
+    return pd.DataFrame({name: np.asarray(counts[:, a:b].sum(axis=1)).ravel()
+                         for name, a, b in zip(names, bounds[:-1], bounds[1:])}, index=df.index)
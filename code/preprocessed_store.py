@@ -0,0 +1,209 @@
+"""On-disk store for preprocessed ECG series shared by notebooks 3.1, 5 and 6.
+
+Replaces the ``preprocessed_time_series.pkl`` hand-off. Every array lives in an
+append-only raw binary file that is opened with ``np.memmap``, so opening the
+store does not read any signal data and notebooks only touch the rows they use.
+
+Store layout (one directory):
+    meta.json           format version, counts, preprocessing steps and parameters
+    subject_ids.i64     subject id per series
+    offsets.i64         n_series + 1 offsets into values.f32
+    values.f32          flat buffer of the original-length preprocessed series
+    equal_length.f32    optional (n_series, width) resampled matrix (notebook 5)
+
+Appending writes the binary files first and ``meta.json`` last; the counts in
+``meta.json`` are authoritative, so an interrupted append leaves the store at
+its previous state.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+SUBJECTS_FILE = 'subject_ids.i64'
+OFFSETS_FILE = 'offsets.i64'
+VALUES_FILE = 'values.f32'
+EQUAL_FILE = 'equal_length.f32'
+
+
+def _memmap(path, dtype, count, shape=None):
+    if count == 0:
+        return np.zeros(shape or (0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape or (count,))
+
+
+def _append(path, array, dtype, committed):
+    """Append array to a raw file, dropping any uncommitted tail first."""
+    itemsize = np.dtype(dtype).itemsize
+    with open(path, 'ab') as f:
+        f.truncate(committed * itemsize)
+        f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+
+class PreprocessedStore:
+    """Memory-mapped, appendable store of variable-length preprocessed series."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._open()
+
+    def _open(self):
+        """(Re)map the files from the counts in meta.json."""
+        with open(self.path / META_FILE) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported preprocessed store version: {self.meta.get('version')}")
+
+        n, n_values = self.meta['n_subjects'], self.meta['n_values']
+        self.subject_ids = _memmap(self.path / SUBJECTS_FILE, np.int64, n)
+        self.offsets = _memmap(self.path / OFFSETS_FILE, np.int64, n + 1)
+        if n == 0:
+            self.offsets = np.zeros(1, dtype=np.int64)
+        self.values = _memmap(self.path / VALUES_FILE, np.float32, n_values)
+
+        width = self.meta.get('equal_length_n_timepoints')
+        self.equal_length = None
+        if width:
+            self.equal_length = _memmap(self.path / EQUAL_FILE, np.float32, n * width, shape=(n, width))
+        self._positions = None
+
+    @classmethod
+    def create(cls, path, preprocessing_steps=(), preprocessing_params=None,
+               equal_length_n_timepoints=None, overwrite=False):
+        """Create an empty store.
+
+        Args:
+            path: Store directory
+            preprocessing_steps: Names of the applied steps, kept in meta.json
+            preprocessing_params: Parameters of the preprocessing (fs, flags, ...)
+            equal_length_n_timepoints: Width of the optional equal-length matrix
+            overwrite: Replace an existing store at path
+        """
+        path = Path(path)
+        if (path / META_FILE).exists() and not overwrite:
+            raise FileExistsError(f"Preprocessed store already exists: {path}")
+        path.mkdir(parents=True, exist_ok=True)
+        for name in (SUBJECTS_FILE, VALUES_FILE, EQUAL_FILE):
+            (path / name).write_bytes(b'')
+        (path / OFFSETS_FILE).write_bytes(np.zeros(1, dtype=np.int64).tobytes())
+
+        now = pd.Timestamp.now().isoformat()
+        meta = {
+            'version': STORE_VERSION,
+            'n_subjects': 0,
+            'n_values': 0,
+            'equal_length_n_timepoints': equal_length_n_timepoints,
+            'preprocessing_steps': list(preprocessing_steps),
+            'preprocessing_params': preprocessing_params or {},
+            'created': now,
+            'updated': now,
+        }
+        with open(path / META_FILE, 'w') as f:
+            json.dump(meta, f, indent=2)
+        return cls(path)
+
+    def __len__(self):
+        return self.meta['n_subjects']
+
+    @property
+    def metadata(self):
+        return self.meta
+
+    def append(self, subject_ids, series, equal_length=None):
+        """Append new subjects without rewriting existing data.
+
+        Args:
+            subject_ids: Subject id per new series
+            series: List of 1-D arrays, or a (values, offsets) tuple
+            equal_length: (n_new, width) matrix, required if the store has one
+
+        Returns:
+            This store, refreshed to include the new rows
+
+        Raises:
+            ValueError: If a subject id repeats or is already in the store
+            RuntimeError: If the store was changed on disk by another instance
+        """
+        with open(self.path / META_FILE) as f:
+            if json.load(f) != self.meta:
+                raise RuntimeError(f"Preprocessed store {self.path} changed since it was opened; reopen it")
+        subject_ids = np.asarray(subject_ids, dtype=np.int64)
+        repeated = pd.Index(subject_ids)
+        repeated = repeated[repeated.duplicated() | repeated.isin(np.asarray(self.subject_ids))].unique()
+        if len(repeated):
+            raise ValueError(f"Subjects already in store or repeated: {repeated[:5].tolist()}")
+        if isinstance(series, tuple):
+            values, offsets = np.asarray(series[0]), np.asarray(series[1], dtype=np.int64)
+            values, offsets = values[offsets[0]:offsets[-1]], offsets - offsets[0]
+        else:
+            values = np.concatenate([np.asarray(ts, dtype=np.float32) for ts in series]) \
+                if len(series) else np.empty(0, dtype=np.float32)
+            offsets = np.concatenate([[0], np.cumsum([len(ts) for ts in series])]).astype(np.int64)
+        if len(offsets) != len(subject_ids) + 1:
+            raise ValueError("Need exactly one series per subject id")
+
+        n, n_values = self.meta['n_subjects'], self.meta['n_values']
+        width = self.meta.get('equal_length_n_timepoints')
+        if width:
+            if equal_length is None:
+                raise ValueError("This store keeps an equal-length matrix; pass equal_length")
+            equal_length = np.asarray(equal_length, dtype=np.float32)
+            if equal_length.shape != (len(subject_ids), width):
+                raise ValueError(f"equal_length must have shape ({len(subject_ids)}, {width})")
+            _append(self.path / EQUAL_FILE, equal_length, np.float32, n * width)
+
+        _append(self.path / VALUES_FILE, values, np.float32, n_values)
+        _append(self.path / SUBJECTS_FILE, subject_ids, np.int64, n)
+        _append(self.path / OFFSETS_FILE, offsets[1:] + n_values, np.int64, n + 1)
+
+        meta = dict(self.meta, n_subjects=n + len(subject_ids), n_values=n_values + int(offsets[-1]),
+                    updated=pd.Timestamp.now().isoformat())
+        with open(self.path / META_FILE, 'w') as f:
+            json.dump(meta, f, indent=2)
+        self._open()
+        return self
+
+    def positions(self, subject_ids):
+        """Row positions of the given subject ids (KeyError if any is missing)."""
+        if self._positions is None:
+            self._positions = pd.Index(np.asarray(self.subject_ids))
+        positions = self._positions.get_indexer(np.asarray(subject_ids, dtype=np.int64))
+        if (positions < 0).any():
+            missing = np.asarray(subject_ids)[positions < 0]
+            raise KeyError(f"Subjects not in store: {missing[:5].tolist()}")
+        return positions
+
+    def series(self, subject_id):
+        """Zero-copy view of one subject's preprocessed series."""
+        i = self.positions([subject_id])[0]
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def select(self, subject_ids=None):
+        """Flat values and offsets for a subject subset (all subjects by default).
+
+        The full store is returned as memmap views; a subset is gathered into a
+        new compact buffer.
+        """
+        if subject_ids is None:
+            return self.values, np.asarray(self.offsets)
+        rows = self.positions(subject_ids)
+        lengths = self.offsets[rows + 1] - self.offsets[rows]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        idx = np.repeat(self.offsets[rows] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return self.values[idx], offsets
+
+    def original_length(self, subject_ids=None):
+        """List of per-subject series views (replacement for preprocessed_original_length)."""
+        rows = np.arange(len(self)) if subject_ids is None else self.positions(subject_ids)
+        return [self.values[self.offsets[i]:self.offsets[i + 1]] for i in rows]
+
+    def equal_length_matrix(self, subject_ids=None):
+        """Equal-length matrix (replacement for preprocessed_equal_length)."""
+        if self.equal_length is None:
+            raise ValueError("This store has no equal-length matrix")
+        if subject_ids is None:
+            return self.equal_length
+        return self.equal_length[self.positions(subject_ids)]
@@ -0,0 +1,389 @@
+"""Persisted ischemic / non-ischemic scoring pipelines and batch inference (notebooks 4 and 6).
+
+The classifiers of notebooks 4 and 6 only exist inside the notebooks, and so
+does their feature preparation. A scoring pipeline is one sklearn ``Pipeline``
+(feature derivation -> scaler -> model) stored as a single artifact:
+
+- ``ProfileFeatures`` repeats the notebook 4 preprocessing on raw profile rows
+  (identifiers and age dropped, gender encoded, median imputation, removal of
+  the features with |correlation| > 0.9), with everything learned at fit time;
+- ``ECGFeatures`` computes the notebook 6 features (PAA, SAX, DFT and HRV) for
+  a whole batch of variable-length ECGs at once, through the flat values +
+  offsets layout of ts_features / ecg_beats;
+- ``save_pipeline`` writes the pipeline uncompressed with joblib plus a
+  meta.json, so ``load_pipeline`` can memory-map the large arrays (tree
+  ensembles, shapelets) instead of unpickling copies.
+
+``BatchScorer`` scores DataFrames or record lists in micro-batches and keeps
+per-batch latency and throughput. Its ``submit`` queue merges concurrent
+requests into shared batches (up to batch_size records or max_wait_s), which
+is what ``serve`` uses as a local HTTP stand-in for a scoring service.
+
+Nightly rescoring of the cohort, without the notebooks:
+    python scoring_pipeline.py score ../Data/models/ischemic_profile_gb \\
+        ../Data/patient_profile_broad_clean_classification.csv scores.csv
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from ecg_beats import HRV_DEFAULTS, HRV_FEATURES, detect_r_peaks_batch, hrv_features_batch
+from feature_correlation import correlate, prune_correlated
+from ts_features import approximation_features, to_flat
+
+PIPELINE_VERSION = 2
+PIPELINE_FILE = 'pipeline.joblib'
+META_FILE = 'meta.json'
+ID_COLUMNS = ['subject_id', 'hadm_id']
+PROFILE_DROP = ['subject_id', 'hadm_id', 'alex_dom_id', 'label_ischemic', 'age']
+
+
+class ProfileFeatures(TransformerMixin, BaseEstimator):
+    """Notebook 4 preprocessing of patient profile rows.
+
+    Args:
+        drop: Columns never used as features (identifiers, label, age)
+        corr_threshold: Of every pair with |correlation| above this, the second
+            feature is dropped (None = keep all)
+    """
+
+    def __init__(self, drop=tuple(PROFILE_DROP), corr_threshold=0.9):
+        self.drop = drop
+        self.corr_threshold = corr_threshold
+
+    def _encode(self, X):
+        X = X.drop(columns=[col for col in self.drop if col in X.columns])
+        if 'gender' in X.columns:
+            codes = {value: i for i, value in enumerate(self.gender_classes_)}
+            gender = X['gender'].astype(object).where(X['gender'].notna(), 'Unknown')
+            X = X.drop(columns=['gender'])
+            X['gender_encoded'] = gender.map(codes).fillna(-1).astype(float)
+        return X
+
+    def fit(self, X, y=None):
+        X = pd.DataFrame(X)
+        self.gender_classes_ = (sorted(X['gender'].astype(object).where(X['gender'].notna(), 'Unknown').unique())
+                                if 'gender' in X.columns else [])
+        encoded = self._encode(X)
+        numeric = encoded.select_dtypes(include=[np.number]).columns.tolist()
+        self.medians_ = encoded[numeric].median()
+        encoded = encoded[numeric].fillna(self.medians_)
+        removed = set()
+        if self.corr_threshold is not None:
+            removed = set(prune_correlated(correlate(encoded)[0], self.corr_threshold, rule='second')['feature'])
+        self.feature_names_in_ = np.array(numeric, dtype=object)
+        self.features_ = [col for col in numeric if col not in removed]
+        return self
+
+    def transform(self, X):
+        X = self._encode(pd.DataFrame(X))
+        X = X.reindex(columns=self.features_)  # absent columns become NaN -> median
+        return X.astype(float).fillna(self.medians_[self.features_]).to_numpy()
+
+    def get_feature_names_out(self, input_features=None):
+        return np.array(self.features_, dtype=object)
+
+
+class ECGFeatures(TransformerMixin, BaseEstimator):
+    """Notebook 6 features (PAA, SAX, DFT, HRV) for a batch of ECGs of any lengths.
+
+    Input is a list / object array of 1-D series or a (n_series, n_samples)
+    matrix; the batch is flattened once and every feature runs vectorized over it.
+
+    Args:
+        fs: Sampling frequency (Hz)
+        n_paa_segments, n_sax_segments, alphabet_size, n_dft_coefficients:
+            Feature parameters, defaults as in notebook 6
+        hrv: Append the HRV features of the detected R-peaks; missing HRV values
+            (e.g. rmssd of a series with a single RR interval) are filled with
+            the training medians learned in fit
+    """
+
+    def __init__(self, fs=500, n_paa_segments=30, n_sax_segments=30, alphabet_size=4, n_dft_coefficients=30,
+                 hrv=True):
+        self.fs = fs
+        self.n_paa_segments = n_paa_segments
+        self.n_sax_segments = n_sax_segments
+        self.alphabet_size = alphabet_size
+        self.n_dft_coefficients = n_dft_coefficients
+        self.hrv = hrv
+
+    def fit(self, X, y=None):
+        self.fit_transform(X, y)
+        return self
+
+    def fit_transform(self, X, y=None):
+        features = self._features(X)
+        if self.hrv:
+            medians = np.nanmedian(features[:, -len(HRV_FEATURES):], axis=0)
+            self.hrv_fill_ = np.where(np.isnan(medians), [HRV_DEFAULTS[name] for name in HRV_FEATURES], medians)
+        return self._fill(features)
+
+    def transform(self, X):
+        return self._fill(self._features(X))
+
+    def _fill(self, features):
+        if self.hrv:
+            hrv = features[:, -len(HRV_FEATURES):]
+            missing = np.isnan(hrv)
+            hrv[missing] = np.broadcast_to(self.hrv_fill_, hrv.shape)[missing]
+        return features
+
+    def _features(self, X):
+        if isinstance(X, np.ndarray) and X.dtype != object and X.ndim == 2:
+            values, offsets = X.astype(float).ravel(), np.arange(len(X) + 1) * X.shape[1]
+        else:
+            values, offsets = to_flat([np.asarray(x, dtype=float) for x in X])
+        features = approximation_features(values, self.n_paa_segments, self.n_sax_segments, self.alphabet_size,
+                                          self.n_dft_coefficients, offsets=offsets)
+        if self.hrv:
+            peaks, peak_offsets = detect_r_peaks_batch(values, fs=self.fs, offsets=offsets)
+            features = np.hstack([features, hrv_features_batch(peaks, peak_offsets, fs=self.fs)[HRV_FEATURES]])
+        return features
+
+    def get_feature_names_out(self, input_features=None):
+        names = ([f'PAA_{i}' for i in range(self.n_paa_segments)] + [f'SAX_{i}' for i in range(self.n_sax_segments)]
+                 + [f'DFT_{i}' for i in range(self.n_dft_coefficients)])
+        return np.array(names + ([f'HRV_{name}' for name in HRV_FEATURES] if self.hrv else []), dtype=object)
+
+
+def build_pipeline(features, model, scaler=StandardScaler()):
+    """Pipeline features -> scaler -> model (scaler=None for tree models on raw features)."""
+    steps = [('features', features)]
+    if scaler is not None:
+        steps.append(('scaler', scaler))
+    return Pipeline(steps + [('model', model)])
+
+
+def save_pipeline(pipeline, path, metadata=None):
+    """Write a fitted pipeline as one artifact directory (replaced atomically).
+
+    Args:
+        pipeline: Fitted pipeline
+        path: Artifact directory
+        metadata: Extra JSON-serializable information (training data, metrics, ...)
+
+    Returns:
+        Path of the artifact
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    joblib.dump(pipeline, tmp / PIPELINE_FILE)  # uncompressed, so arrays can be memory-mapped
+    with open(tmp / META_FILE, 'w') as f:
+        json.dump({'version': PIPELINE_VERSION, 'created': datetime.now().isoformat(timespec='seconds'),
+                   'sklearn_version': sklearn.__version__, 'steps': [name for name, _ in pipeline.steps],
+                   'model': type(pipeline[-1]).__name__, **(metadata or {})}, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+def load_pipeline(path, mmap=True):
+    """Load a pipeline artifact; returns (pipeline, metadata)."""
+    path = Path(path)
+    with open(path / META_FILE) as f:
+        meta = json.load(f)
+    if meta.get('version') != PIPELINE_VERSION:
+        raise ValueError(f"Unsupported pipeline version: {meta.get('version')}")
+    return joblib.load(path / PIPELINE_FILE, mmap_mode='r' if mmap else None), meta
+
+
+def _take(records, start, stop):
+    return records.iloc[start:stop] if isinstance(records, pd.DataFrame) else records[start:stop]
+
+
+def _as_input(records):
+    """DataFrame for profile rows (DataFrame or list of dicts), list of series for ECGs."""
+    if isinstance(records, pd.DataFrame):
+        return records
+    if len(records) and isinstance(records[0], dict):
+        return pd.DataFrame.from_records(records)
+    return records
+
+
+class BatchScorer:
+    """Micro-batched scoring with a loaded pipeline.
+
+    Args:
+        pipeline: Fitted pipeline, or the path of an artifact
+        batch_size: Records per batch
+        threshold: Probability threshold for label 1
+        max_wait_s: How long ``submit`` waits for more records before scoring
+            a partial batch
+    """
+
+    def __init__(self, pipeline, batch_size=1024, threshold=0.5, max_wait_s=0.01):
+        self.metadata = {}
+        if isinstance(pipeline, (str, Path)):
+            pipeline, self.metadata = load_pipeline(pipeline)
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.threshold = threshold
+        self.max_wait_s = max_wait_s
+        self.batch_stats = []
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _score_batch(self, batch):
+        start = time.perf_counter()
+        proba = self.pipeline.predict_proba(batch)[:, 1]
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.batch_stats.append({'n_records': len(proba), 'latency_s': latency,
+                                     'records_per_s': len(proba) / latency if latency > 0 else np.inf})
+        return proba
+
+    def score(self, records):
+        """Probability and label of every record, computed batch by batch.
+
+        Args:
+            records: Profile rows (DataFrame or list of dicts) or ECGs (list of series)
+
+        Returns:
+            DataFrame with the id columns present in the records, probability and label
+        """
+        records = _as_input(records)
+        proba = np.concatenate([self._score_batch(_take(records, start, start + self.batch_size))
+                                for start in range(0, len(records), self.batch_size)] or [np.empty(0)])
+        result = pd.DataFrame({'probability': proba, 'label': (proba >= self.threshold).astype(int)})
+        if isinstance(records, pd.DataFrame):
+            ids = [col for col in ID_COLUMNS if col in records.columns]
+            result = pd.concat([records[ids].reset_index(drop=True), result], axis=1)
+        return result
+
+    def stats(self):
+        """Latency / throughput per batch (DataFrame) since the scorer was created."""
+        with self._lock:
+            return pd.DataFrame(self.batch_stats, columns=['n_records', 'latency_s', 'records_per_s'])
+
+    def submit(self, records):
+        """Queue records for scoring together with other submissions; returns a Future of the probabilities."""
+        if self._queue is None:
+            with self._lock:
+                if self._queue is None:
+                    self._queue = queue.Queue()
+                    threading.Thread(target=self._worker, daemon=True).start()
+        future = Future()
+        self._queue.put((_as_input(records), future))
+        return future
+
+    def _worker(self):
+        while True:
+            pending = [self._queue.get()]
+            size = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait_s
+            while size < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            try:
+                parts = [records for records, _ in pending]
+                batch = (pd.concat(parts, ignore_index=True) if isinstance(parts[0], pd.DataFrame)
+                         else [x for part in parts for x in part])
+                proba = self._score_batch(batch)
+                start = 0
+                for records, future in pending:
+                    future.set_result(proba[start:start + len(records)])
+                    start += len(records)
+            except Exception as error:  # report to every waiting request
+                for _, future in pending:
+                    future.set_exception(error)
+
+
+def serve(scorer, host='127.0.0.1', port=8000):
+    """Local HTTP stand-in for a scoring service (blocks until interrupted).
+
+    POST /score with {"records": [...]} (profile dicts or ECG sample lists)
+    returns {"probability": [...], "label": [...]}; GET /stats returns the
+    batch statistics, GET /health the artifact metadata.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._reply(200, {'status': 'ok', **scorer.metadata})
+            elif self.path == '/stats':
+                stats = scorer.stats()
+                self._reply(200, {'n_batches': len(stats), 'n_records': int(stats['n_records'].sum()),
+                                  'mean_latency_s': float(stats['latency_s'].mean()) if len(stats) else None,
+                                  'records_per_s': float(stats['n_records'].sum() / stats['latency_s'].sum())
+                                  if len(stats) else None})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                return self._reply(404, {'error': 'not found'})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                proba = scorer.submit(body['records']).result()
+            except (KeyError, ValueError, TypeError) as error:
+                return self._reply(400, {'error': str(error)})
+            self._reply(200, {'probability': proba.tolist(),
+                              'label': (proba >= scorer.threshold).astype(int).tolist()})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"Serving {scorer.metadata.get('model', 'pipeline')} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    score_cmd = commands.add_parser('score', help='Score a profile CSV')
+    score_cmd.add_argument('artifact')
+    score_cmd.add_argument('input')
+    score_cmd.add_argument('output')
+    score_cmd.add_argument('--batch-size', type=int, default=1024)
+    serve_cmd = commands.add_parser('serve', help='Serve an artifact over HTTP')
+    serve_cmd.add_argument('artifact')
+    serve_cmd.add_argument('--host', default='127.0.0.1')
+    serve_cmd.add_argument('--port', type=int, default=8000)
+    serve_cmd.add_argument('--batch-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    scorer = BatchScorer(args.artifact, batch_size=args.batch_size)
+    if args.command == 'score':
+        scorer.score(pd.read_csv(args.input)).to_csv(args.output, index=False)
+        stats = scorer.stats()
+        print(f"{stats['n_records'].sum()} records in {len(stats)} batches, "
+              f"{stats['n_records'].sum() / stats['latency_s'].sum():.0f} records/s")
+    else:
+        serve(scorer, args.host, args.port)
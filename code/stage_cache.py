@@ -0,0 +1,411 @@
+"""Incremental stage runner for the patient-profile build (notebooks 1.1 -> 1.2 -> 2.x / 4).
+
+Every step of the build is declared as a ``Stage`` with its input files,
+output files, parameters and code (a Python function or a notebook). A stage's
+cache key is the SHA-256 of its code, the local helper modules that code
+imports (e.g. ``lab_cleaning.py``, followed transitively), its parameters and
+the content of its inputs, so:
+
+- a stage whose key has not changed and whose outputs are still on disk is
+  skipped;
+- a key seen before (e.g. a parameter switched back) restores the outputs from
+  the object store instead of recomputing them;
+- only stages downstream of a changed file rerun.
+
+Outputs are kept in a content-addressed object store (``objects/<sha256>``), so
+byte-identical snapshots such as ``1.2.1_prepared_patient_profile.csv`` and
+``1.2.2_prepared_patient_profile.csv`` are stored once. File digests are
+memoized by (path, size, mtime), so unchanged inputs are not re-read.
+
+Stages depend on each other through their files (an input that is another
+stage's output). Independent stages, e.g. the df1, df3 and df4 cleaners, run in
+parallel on a thread pool; notebooks are executed with nbclient (part of the
+jupyter requirement) in their own kernels.
+"""
+import hashlib
+import inspect
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import reduce
+from pathlib import Path
+from threading import Lock
+
+import pandas as pd
+
+CACHE_VERSION = 2
+IMPORT_PATTERN = re.compile(r'^\s*(?:from\s+(\w+)\S*\s+import\b|import\s+([\w\s.,]+?)\s*(?:#.*)?$)',
+                            re.MULTILINE)
+KEYS = ['subject_id', 'hadm_id']
+
+
+def file_digest(path, block_size=1 << 20):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def notebook_code_digest(path):
+    """SHA-256 of a notebook's code cells only (outputs and markdown are ignored)."""
+    with open(path, encoding='utf-8') as f:
+        nb = json.load(f)
+    code = [''.join(cell['source']) for cell in nb['cells'] if cell['cell_type'] == 'code']
+    return hashlib.sha256(json.dumps(code).encode()).hexdigest()
+
+
+def notebook_source(path):
+    """Code cells of a notebook as one string."""
+    with open(path, encoding='utf-8') as f:
+        nb = json.load(f)
+    return '\n'.join(''.join(cell['source']) for cell in nb['cells'] if cell['cell_type'] == 'code')
+
+
+def local_modules(source, search_dir):
+    """Modules of search_dir imported by source, followed through their own imports.
+
+    Imports are found with a regular expression rather than ast, so notebook
+    code with magics still parses. Only top-level names that resolve to a
+    ``<name>.py`` in search_dir count (numpy, pandas, ... are ignored).
+
+    Returns:
+        Sorted list of module paths
+    """
+    search_dir = Path(search_dir)
+    found, pending = set(), [source]
+    while pending:
+        for match in IMPORT_PATTERN.finditer(pending.pop()):
+            names = [match.group(1)] if match.group(1) else \
+                [part.split()[0].split('.')[0] for part in match.group(2).split(',') if part.strip()]
+            for name in names:
+                path = search_dir / f'{name}.py'
+                if path.exists() and path not in found:
+                    found.add(path)
+                    pending.append(path.read_text(encoding='utf-8'))
+    return sorted(found)
+
+
+class Stage:
+    """One step of the build.
+
+    Args:
+        name: Unique stage name
+        func: Callable ``func(inputs, outputs, **params)`` taking lists of Paths
+        inputs: Input file paths
+        outputs: Output file paths written by func
+        params: JSON-serializable parameters (part of the cache key)
+        code_digest: Override for the code hash (default: source of func)
+        code_files: Extra source files the code depends on (part of the cache
+            key); by default the local modules imported by func's module
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, code_digest=None, code_files=None):
+        self.name = name
+        self.func = func
+        self.inputs = [Path(p) for p in inputs]
+        self.outputs = [Path(p) for p in outputs]
+        self.params = dict(params or {})
+        self._code_digest = code_digest
+        self.code_files = code_files
+
+    def _func_digest(self):
+        try:
+            source = inspect.getsource(self.func).encode()
+        except (OSError, TypeError):
+            # No source (e.g. defined interactively): fall back to the bytecode
+            source = getattr(getattr(self.func, '__code__', None), 'co_code', repr(self.func).encode())
+        return hashlib.sha256(source).hexdigest()
+
+    def dependency_files(self):
+        """Source files whose content is part of the cache key."""
+        if self.code_files is not None:
+            return [Path(p) for p in self.code_files]
+        try:
+            module = Path(inspect.getsourcefile(self.func))
+        except (OSError, TypeError):
+            return []
+        return local_modules(module.read_text(encoding='utf-8'), module.parent)
+
+    def code_digest(self):
+        """Hash of the stage's code and of every dependency file (re-read on each call)."""
+        digest = hashlib.sha256((self._code_digest or self._func_digest()).encode())
+        for path in self.dependency_files():
+            value = notebook_code_digest(path) if path.suffix == '.ipynb' else file_digest(path)
+            digest.update(f'{path.name}:{value}'.encode())
+        return digest.hexdigest()
+
+
+class NotebookFiles:
+    """Lazy code_files of a notebook stage: the notebook and its local modules.
+
+    Resolved on every iteration, so imports added to the notebook after the
+    stage was declared are picked up.
+    """
+
+    def __init__(self, notebook):
+        self.notebook = Path(notebook)
+
+    def __iter__(self):
+        yield self.notebook
+        yield from local_modules(notebook_source(self.notebook), self.notebook.parent)
+
+
+def notebook_stage(name, notebook, inputs=(), outputs=(), params=None, timeout=None):
+    """Stage that executes a notebook (cwd = the notebook's directory).
+
+    Parameters are injected as a code cell right after the first cell that
+    assigns one of them (e.g. the ``DATA_DIR = ...`` cell), or at the top.
+    The executed notebook is not written back. The notebook's code cells and
+    the local modules it imports are hashed when the key is computed, so
+    editing either invalidates the stage.
+    """
+    notebook = Path(notebook)
+
+    def run_notebook(inputs, outputs, **params):
+        import nbformat
+        from nbclient import NotebookClient
+
+        nb = nbformat.read(notebook, as_version=4)
+        if params:
+            lines = [f'{key} = {value!r}' for key, value in params.items()]
+            position = 0
+            for i, cell in enumerate(nb.cells):
+                if cell.cell_type == 'code' and any(
+                        line.split('=')[0].strip() in params
+                        for line in cell.source.splitlines() if '=' in line):
+                    position = i + 1
+                    break
+            nb.cells.insert(position, nbformat.v4.new_code_cell('# Injected parameters\n' + '\n'.join(lines)))
+        NotebookClient(nb, timeout=timeout, kernel_name='python3',
+                       resources={'metadata': {'path': str(notebook.parent)}}).execute()
+
+    return Stage(name, run_notebook, inputs=inputs, outputs=outputs, params=params,
+                 code_digest=f'notebook:{notebook.name}', code_files=NotebookFiles(notebook))
+
+
+class StageCache:
+    """Declares stages and runs them incrementally.
+
+    Args:
+        cache_dir: Directory for the object store, stage manifests and digests
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.stages = {}
+        self._digests = {}
+        self._lock = Lock()
+        digests_file = self.cache_dir / 'digests.json'
+        if digests_file.exists():
+            with open(digests_file) as f:
+                self._digests = json.load(f)
+
+    def add(self, stage):
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage name: {stage.name}")
+        self.stages[stage.name] = stage
+        return stage
+
+    def stage(self, inputs=(), outputs=(), params=None, name=None):
+        """Decorator form of ``add`` for Python stage functions."""
+        def register(func):
+            self.add(Stage(name or func.__name__, func, inputs, outputs, params))
+            return func
+        return register
+
+    # ---- hashing and storage ------------------------------------------------------
+
+    def digest(self, path):
+        """File digest, memoized by (path, size, mtime)."""
+        path = Path(path)
+        stat = path.stat()
+        token = f'{stat.st_size}:{stat.st_mtime_ns}'
+        key = str(path.resolve())
+        with self._lock:
+            cached = self._digests.get(key)
+        if cached and cached[0] == token:
+            return cached[1]
+        value = file_digest(path)
+        with self._lock:
+            self._digests[key] = [token, value]
+        return value
+
+    def _key(self, stage):
+        missing = [str(p) for p in stage.inputs if not p.exists()]
+        if missing:
+            raise FileNotFoundError(f"Stage {stage.name}: missing inputs {missing}")
+        payload = {
+            'version': CACHE_VERSION,
+            'name': stage.name,
+            'code': stage.code_digest(),
+            'params': stage.params,
+            'inputs': [self.digest(p) for p in stage.inputs],
+            'outputs': [p.name for p in stage.outputs],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _object(self, digest):
+        return self.cache_dir / 'objects' / digest[:2] / digest
+
+    def _manifest(self, stage, key):
+        return self.cache_dir / 'stages' / stage.name / f'{key}.json'
+
+    def _store(self, path):
+        digest = self.digest(path)
+        target = self._object(digest)
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_suffix('.tmp')
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, target)
+        return digest
+
+    def _restore(self, digest, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.restore')
+        shutil.copyfile(self._object(digest), tmp)
+        os.replace(tmp, path)
+
+    # ---- execution ----------------------------------------------------------------
+
+    def dependencies(self):
+        """{stage name: set of upstream stage names} from the declared files."""
+        producers = {}
+        for stage in self.stages.values():
+            for path in stage.outputs:
+                producers[str(path.resolve())] = stage.name
+        return {name: {producers[str(p.resolve())] for p in stage.inputs
+                       if str(p.resolve()) in producers and producers[str(p.resolve())] != name}
+                for name, stage in self.stages.items()}
+
+    def _run_stage(self, stage, force=False):
+        start = time.perf_counter()
+        key = self._key(stage)
+        manifest = self._manifest(stage, key)
+        status = 'ran'
+        if manifest.exists() and not force:
+            with open(manifest) as f:
+                recorded = json.load(f)['outputs']
+            if all(Path(p).exists() and self.digest(p) == d for p, d in recorded.items()):
+                status = 'cached'
+            elif all(self._object(d).exists() for d in recorded.values()):
+                for p, d in recorded.items():
+                    if not Path(p).exists() or self.digest(p) != d:
+                        self._restore(d, Path(p))
+                status = 'restored'
+        if status == 'ran':
+            stage.func(stage.inputs, stage.outputs, **stage.params)
+            missing = [str(p) for p in stage.outputs if not p.exists()]
+            if missing:
+                raise FileNotFoundError(f"Stage {stage.name} did not write {missing}")
+            recorded = {str(p): self._store(p) for p in stage.outputs}
+            manifest.parent.mkdir(parents=True, exist_ok=True)
+            with open(manifest, 'w') as f:
+                json.dump({'outputs': recorded, 'params': stage.params}, f, indent=2, default=str)
+        return {'stage': stage.name, 'status': status, 'seconds': time.perf_counter() - start,
+                'key': key[:12]}
+
+    def run(self, targets=None, n_workers=4, force=()):
+        """Bring the targets (default: all stages) up to date.
+
+        Args:
+            targets: Stage names to build; their upstream stages are included
+            n_workers: Stages run at the same time
+            force: Stage names to rerun even if cached
+
+        Returns:
+            DataFrame with stage, status ('cached', 'restored', 'ran'), seconds and key
+        """
+        deps = self.dependencies()
+        selected = set(targets or self.stages)
+        stack = list(selected)
+        while stack:
+            for upstream in deps[stack.pop()]:
+                if upstream not in selected:
+                    selected.add(upstream)
+                    stack.append(upstream)
+
+        remaining = {name: deps[name] & selected for name in selected}
+        rows, running = [], {}
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            while remaining or running:
+                for name in [n for n, d in remaining.items() if not d]:
+                    del remaining[name]
+                    running[pool.submit(self._run_stage, self.stages[name], name in force)] = name
+                if not running:
+                    raise ValueError(f"Dependency cycle between stages {sorted(remaining)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    rows.append(future.result())
+                    for d in remaining.values():
+                        d.discard(name)
+        self.save_digests()
+        return pd.DataFrame(rows, columns=['stage', 'status', 'seconds', 'key'])
+
+    def save_digests(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            with open(self.cache_dir / 'digests.json', 'w') as f:
+                json.dump(self._digests, f)
+
+    def store_stats(self):
+        """Number of output files tracked vs distinct objects stored (deduplication)."""
+        manifests = list((self.cache_dir / 'stages').glob('*/*.json'))
+        tracked = []
+        for manifest in manifests:
+            with open(manifest) as f:
+                tracked.extend(json.load(f)['outputs'].values())
+        objects = list((self.cache_dir / 'objects').glob('*/*'))
+        return {'manifests': len(manifests), 'tracked_outputs': len(tracked),
+                'objects': len(objects), 'bytes': sum(p.stat().st_size for p in objects)}
+
+
+def merge_feature_tables(inputs, outputs, on=KEYS):
+    """Outer-merge per-admission feature CSVs on the admission key (1.2 create patient profile)."""
+    dfs = [pd.read_csv(path) for path in inputs]
+    profile = reduce(lambda left, right: pd.merge(left, right, on=on, how='outer'), dfs)
+    profile.to_csv(outputs[0], index=False)
+
+
+DATASETS = {
+    "heart_diagnoses_1": "1.1 df1 heart.ipynb",
+    "laboratory_events_codes_2": "1.1 df2 laboratory.ipynb",
+    "microbiology_events_codes_3": "1.1 df3 microbiology.ipynb",
+    "procedure_code_4": "1.1 df4 procedurecodes.ipynb",
+}
+
+
+def profile_pipeline(data_dir, code_dir='.', cache_dir=None):
+    """The 1.1 cleaners and the profile merge as a StageCache.
+
+    The df1, df3 and df4 cleaners only read their raw CSV and run in parallel;
+    the laboratory cleaner also reads their ``_cleaned.csv`` files (subject_id
+    lookup), so it follows them. The merge stage reproduces the outer merge of
+    the four ``_agg_features.csv`` files. Downstream notebooks can be added
+    with ``notebook_stage``.
+    """
+    data_dir, code_dir = Path(data_dir), Path(code_dir)
+    cache = StageCache(cache_dir or data_dir / '.stage_cache')
+    params = {'DATA_DIR': str(data_dir)}
+
+    def files(dataset, *suffixes):
+        return [data_dir / f'{dataset}{suffix}.csv' for suffix in suffixes]
+
+    outputs = ('_cleaned', '_agg_features_large', '_agg_features')
+    for dataset, notebook in DATASETS.items():
+        inputs = files(dataset, '')
+        if dataset == 'laboratory_events_codes_2':
+            inputs += [data_dir / f'{other}_cleaned.csv' for other in DATASETS if other != dataset]
+        cache.add(notebook_stage(f'clean_{dataset}', code_dir / notebook, inputs=inputs,
+                                 outputs=files(dataset, *outputs), params=params))
+
+    cache.add(Stage('merge_profile', merge_feature_tables,
+                    inputs=[data_dir / f'{dataset}_agg_features.csv' for dataset in DATASETS],
+                    outputs=[data_dir / 'patient_profile_large.csv']))
+    return cache
@@ -0,0 +1,213 @@
+"""Typed columnar storage for the tabular artifacts under Data/.
+
+The profile CSVs (``patient_profile_*.csv``, ``2.x_*_clustered_data.csv``) are
+re-parsed by every notebook, with dtypes re-inferred and all columns loaded.
+A table store keeps one raw binary file per column, in the same spirit as the
+preprocessed ECG store, and opens them with ``np.memmap``:
+
+- integer and 0/1 flag columns are downcast to the smallest integer type,
+  floats to float32 unless they hold large integral values (ids);
+- string columns (``icd_code``, ``icd_cat``, ...) are dictionary encoded as
+  int8/int16/int32 codes plus the category list and come back as
+  ``pd.Categorical`` without re-parsing any text;
+- datetime columns are stored as int64 nanoseconds and come back as
+  ``datetime64[ns]`` (NaT preserved); ``load_table`` parses the known date
+  columns (``DATE_COLUMNS``) of a CSV before storing them;
+- reading accepts a column list, and untouched columns are never read.
+
+Cluster labels are stored as small side tables keyed by (subject_id, hadm_id)
+(``write_labels``/``read_labels``) instead of full copies of the profile.
+
+Store layout (one directory):
+    meta.json       version, n_rows and per-column dtype/kind/categories
+    <i>.bin         raw values of column i (codes for categorical columns)
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 2
+META_FILE = 'meta.json'
+KEYS = ['subject_id', 'hadm_id']
+DATE_COLUMNS = ['charttime', 'storetime', 'chartdate', 'dod']
+_FLOAT32_MAX_INT = 2 ** 24  # integers above this are not exact in float32
+_NAT = np.iinfo(np.int64).min
+
+
+def _encode(series, downcast):
+    """(values array, column metadata) for one column."""
+    if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype == object \
+            or pd.api.types.is_string_dtype(series.dtype):
+        codes, categories = pd.factorize(series.astype(object), sort=True)
+        dtype = np.int8 if len(categories) < 2 ** 7 else np.int16 if len(categories) < 2 ** 15 else np.int32
+        return codes.astype(dtype), {'kind': 'categorical', 'dtype': np.dtype(dtype).name,
+                                     'categories': [str(c) for c in categories]}
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        return values, {'kind': 'datetime', 'dtype': 'int64'}
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series.to_numpy(dtype=bool), {'kind': 'numeric', 'dtype': 'bool'}
+
+    values = series.to_numpy()
+    if downcast and values.dtype.kind in 'iu':
+        values = pd.to_numeric(series, downcast='integer').to_numpy()
+    elif downcast and values.dtype.kind == 'f':
+        finite = values[np.isfinite(values)]
+        integral = len(finite) > 0 and np.all(finite == np.round(finite))
+        if integral and not np.isnan(values).any():
+            values = pd.to_numeric(series.astype(np.int64), downcast='integer').to_numpy()
+        elif not (integral and np.abs(finite).max() >= _FLOAT32_MAX_INT):
+            values = values.astype(np.float32)
+    return values, {'kind': 'numeric', 'dtype': values.dtype.name}
+
+
+def write_table(df, path, downcast=True, overwrite=True):
+    """Write a DataFrame as a column store (index is dropped).
+
+    Args:
+        df: Table to store
+        path: Store directory
+        downcast: Downcast integers and floats (see module docstring)
+        overwrite: Replace an existing store
+
+    Returns:
+        Path of the store
+    """
+    path = Path(path)
+    if path.exists():
+        if not overwrite:
+            raise FileExistsError(path)
+        shutil.rmtree(path)
+    tmp = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        values, meta = _encode(df[name], downcast)
+        file = f'{i}.bin'
+        np.ascontiguousarray(values).tofile(tmp / file)
+        columns.append({'name': str(name), 'file': file, **meta})
+    with open(tmp / META_FILE, 'w') as f:
+        json.dump({'version': STORE_VERSION, 'n_rows': len(df), 'columns': columns}, f, indent=1)
+    os.replace(tmp, path)
+    return path
+
+
+def table_info(path):
+    """Column metadata of a store as a DataFrame (name, kind, dtype, n_categories)."""
+    with open(Path(path) / META_FILE) as f:
+        meta = json.load(f)
+    return pd.DataFrame([{'name': c['name'], 'kind': c['kind'], 'dtype': c['dtype'],
+                          'n_categories': len(c.get('categories', []))} for c in meta['columns']])
+
+
+def read_table(path, columns=None, mmap=True):
+    """Read a column store.
+
+    Args:
+        path: Store directory
+        columns: Columns to load (default: all); other files are not opened
+        mmap: Memory-map the column files (copy-on-write: edits to the
+            DataFrame never reach the store)
+
+    Returns:
+        DataFrame
+    """
+    path = Path(path)
+    with open(path / META_FILE) as f:
+        meta = json.load(f)
+    if meta.get('version') != STORE_VERSION:
+        raise ValueError(f"Unsupported table store version: {meta.get('version')}")
+    by_name = {c['name']: c for c in meta['columns']}
+    names = list(by_name) if columns is None else list(columns)
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        raise KeyError(f"Columns not in store: {missing}")
+
+    n = meta['n_rows']
+    data = {}
+    for name in names:
+        col = by_name[name]
+        file = path / col['file']
+        if n == 0:
+            values = np.zeros(0, dtype=col['dtype'])
+        elif mmap:
+            values = np.memmap(file, dtype=col['dtype'], mode='c', shape=(n,))
+        else:
+            values = np.fromfile(file, dtype=col['dtype'], count=n)
+        if col['kind'] == 'categorical':
+            data[name] = pd.Categorical.from_codes(np.asarray(values), categories=col['categories'])
+        elif col['kind'] == 'datetime':
+            values = np.array(values)
+            data[name] = np.where(values == _NAT, np.datetime64('NaT'), values.view('datetime64[ns]'))
+        else:
+            data[name] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def csv_store_path(csv_path):
+    """Store directory used for a CSV file (``name.csv`` -> ``name.cols``)."""
+    csv_path = Path(csv_path)
+    return csv_path.with_suffix('.cols')
+
+
+def _stale(store, csv_path):
+    """Whether the store of a CSV is missing, older than the CSV or of another version."""
+    meta_file = store / META_FILE
+    if not meta_file.exists():
+        return True
+    if csv_path.exists() and csv_path.stat().st_mtime > meta_file.stat().st_mtime:
+        return True
+    with open(meta_file) as f:
+        return json.load(f).get('version') != STORE_VERSION
+
+
+def load_table(csv_path, columns=None, **read_csv_kwargs):
+    """Read a CSV artifact through its column store, converting it on first use.
+
+    The store is rebuilt when the CSV is newer or the store is from an older
+    version, so notebooks can keep writing CSVs and still get typed, projected
+    loads. Columns in ``DATE_COLUMNS`` are parsed as datetimes (unparseable
+    values become NaT) unless ``parse_dates`` is passed explicitly.
+    """
+    csv_path = Path(csv_path)
+    store = csv_store_path(csv_path)
+    if _stale(store, csv_path):
+        df = pd.read_csv(csv_path, **read_csv_kwargs)
+        if 'parse_dates' not in read_csv_kwargs:
+            for name in DATE_COLUMNS:
+                if name in df.columns and not pd.api.types.is_datetime64_any_dtype(df[name].dtype):
+                    df[name] = pd.to_datetime(df[name], errors='coerce')
+        write_table(df, store)
+    return read_table(store, columns)
+
+
+def write_labels(path, name, keys, labels):
+    """Store one labelling (e.g. cluster assignments) as a side table.
+
+    Args:
+        path: Labels directory (one sub-store per labelling)
+        name: Labelling name, e.g. 'kmeans'
+        keys: DataFrame with the KEYS columns, one row per label
+        labels: Label per row
+
+    Returns:
+        Path of the side table
+    """
+    table = keys[KEYS].reset_index(drop=True).copy()
+    table[name] = np.asarray(labels)
+    return write_table(table, Path(path) / name)
+
+
+def read_labels(path, name, keys=None):
+    """Read a labelling; with keys, return the labels aligned to those rows (NaN if absent)."""
+    labels = read_table(Path(path) / name, mmap=False)
+    if keys is None:
+        return labels
+    aligned = keys[KEYS].merge(labels, on=KEYS, how='left')
+    return aligned[name].to_numpy()
@@ -0,0 +1,24 @@
+import numpy as np
+
+from ecg_beats import HRV_DEFAULTS, hrv_features_batch
+
+
+def test_hrv_needs_successive_differences():
+    # series 0: 2 peaks (1 RR), series 1: 3 peaks (2 RR), series 2: 4 peaks (3 RR), series 3: 1 peak
+    peaks = np.array([0, 400, 0, 400, 850, 0, 500, 1000, 1400, 10])
+    peak_offsets = np.array([0, 2, 5, 9, 10])
+    hrv = hrv_features_batch(peaks, peak_offsets, fs=500)
+
+    assert np.isnan(hrv.loc[0, 'rmssd'])
+    assert np.isnan(hrv.loc[0, 'sdsd'])
+    assert hrv.loc[0, 'mean_rr'] == 800.0
+
+    assert hrv.loc[1, 'rmssd'] == 100.0  # RR 800 ms and 900 ms
+    assert np.isnan(hrv.loc[1, 'sdsd'])
+
+    rr = np.array([1000.0, 1000.0, 800.0])
+    assert np.isclose(hrv.loc[2, 'rmssd'], np.sqrt(np.mean(np.diff(rr) ** 2)))
+    assert np.isclose(hrv.loc[2, 'sdsd'], np.std(np.diff(rr)))
+
+    for name, default in HRV_DEFAULTS.items():
+        assert hrv.loc[3, name] == default
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from preprocessed_store import PreprocessedStore
+
+
+def test_append_twice_on_same_instance(tmp_path):
+    store = PreprocessedStore.create(tmp_path / 'store')
+    store.append([1, 2], [np.ones(3), np.arange(4)])
+    store.append([3], [np.full(2, 5.0)])
+
+    assert store.subject_ids.tolist() == [1, 2, 3]
+    reopened = PreprocessedStore(tmp_path / 'store')
+    assert reopened.subject_ids.tolist() == [1, 2, 3]
+    assert reopened.series(2).tolist() == [0, 1, 2, 3]
+    assert reopened.series(3).tolist() == [5, 5]
+
+    with pytest.raises(ValueError):
+        store.append([1], [np.ones(2)])
+    assert len(PreprocessedStore(tmp_path / 'store')) == 3
+
+
+def test_append_rejects_stale_instance(tmp_path):
+    store = PreprocessedStore.create(tmp_path / 'store')
+    stale = PreprocessedStore(tmp_path / 'store')
+    store.append([1], [np.ones(3)])
+    with pytest.raises(RuntimeError):
+        stale.append([2], [np.ones(3)])
+    assert PreprocessedStore(tmp_path / 'store').subject_ids.tolist() == [1]
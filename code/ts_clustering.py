@@ -0,0 +1,274 @@
+"""DTW k-means with DBA barycenters for full-resolution ECG series (notebook 5).
+
+Notebook 5 clusters 100-point resampled series with Euclidean KMeans. Here the
+centers are DTW Barycenter Averages (DBA) of the member series, and the
+expensive parts are reduced as follows:
+
+- assignment reuses the exact nearest-neighbour search of ts_dtw: LB_Kim and
+  LB_Keogh against the k center envelopes, centers visited in bound order, and
+  early abandoning DTW. Most series only need one full DTW per iteration;
+- the DBA update accumulates the aligned values along one banded warping path
+  per member (numba kernel, O(n * window) memory);
+- with ``batch_size`` each iteration uses a random mini-batch, and the centers
+  move towards the batch barycenter with a per-center learning rate as in
+  sklearn's MiniBatchKMeans;
+- restarts (``n_init``) and different k (``dba_kmeans_sweep``) run in parallel.
+
+Labels are always computed on the full data at the end. Cluster profiles for
+``plot_cluster_profiles`` come from ``cluster_profiles``, the PAA of every
+member averaged per cluster, or directly from ``paa(X, n_segments)`` with
+``labels_``.
+"""
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, ClusterMixin
+
+from ts_dtw import NUMBA_AVAILABLE, _query, envelope, njit
+
+
+@njit(cache=True, nogil=True)
+def _dba_accumulate(center, x, window, sums, counts):
+    """Align x to center with banded DTW and add x's values along the path.
+
+    Returns:
+        Squared DTW cost of the alignment
+    """
+    n = center.shape[0]
+    width = 2 * window + 1
+    D = np.full((n, width), np.inf)
+    for i in range(n):
+        for j in range(max(0, i - window), min(n, i + window + 1)):
+            d = center[i] - x[j]
+            c = j - i + window  # band column of (i, j)
+            if i == 0 and j == 0:
+                best = 0.0
+            else:
+                best = np.inf
+                if i > 0 and j > 0 and D[i - 1, c] < best:  # (i-1, j-1)
+                    best = D[i - 1, c]
+                if i > 0 and c + 1 < width and D[i - 1, c + 1] < best:  # (i-1, j)
+                    best = D[i - 1, c + 1]
+                if j > 0 and c > 0 and D[i, c - 1] < best:  # (i, j-1)
+                    best = D[i, c - 1]
+            D[i, c] = d * d + best
+
+    i = n - 1
+    j = n - 1
+    while True:
+        sums[i] += x[j]
+        counts[i] += 1
+        if i == 0 and j == 0:
+            break
+        c = j - i + window
+        best = np.inf
+        step = 0
+        if i > 0 and j > 0 and D[i - 1, c] < best:
+            best = D[i - 1, c]
+            step = 0
+        if i > 0 and c + 1 < width and D[i - 1, c + 1] < best:
+            best = D[i - 1, c + 1]
+            step = 1
+        if j > 0 and c > 0 and D[i, c - 1] < best:
+            best = D[i, c - 1]
+            step = 2
+        if step == 0:
+            i -= 1
+            j -= 1
+        elif step == 1:
+            i -= 1
+        else:
+            j -= 1
+    return D[n - 1, window]
+
+
+def dba_update(center, members, window):
+    """One DBA refinement of center from its member series.
+
+    Returns:
+        (new_center, squared DTW cost of every member to the old center)
+    """
+    center = np.ascontiguousarray(center, dtype=float)
+    sums = np.zeros(len(center))
+    counts = np.zeros(len(center))
+    costs = np.array([_dba_accumulate(center, np.ascontiguousarray(x), window, sums, counts)
+                      for x in members])
+    return sums / np.maximum(counts, 1), costs
+
+
+def _assign(X, centers, window):
+    """Nearest center of every series; returns (labels, sq_costs, n_dtw)."""
+    upper, lower = envelope(centers, window)
+    labels = np.empty(len(X), dtype=np.int64)
+    costs = np.empty(len(X))
+    n_dtw = 0
+    for i, x in enumerate(X):
+        cost, idx, n = _query(x, centers, upper, lower, window, 1)
+        labels[i], costs[i] = idx[0], cost[0]
+        n_dtw += n
+    return labels, costs, n_dtw
+
+
+def _init_centers(X, k, rng):
+    """k-means++ seeding with squared Euclidean distance (an upper bound of DTW)."""
+    centers = [X[rng.integers(len(X))]]
+    d2 = ((X - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        probs = d2 / d2.sum() if d2.sum() > 0 else None
+        centers.append(X[rng.choice(len(X), p=probs)])
+        d2 = np.minimum(d2, ((X - centers[-1]) ** 2).sum(axis=1))
+    return np.array(centers, dtype=float)
+
+
+def _fit_single(X, k, window, batch_size, max_iter, tol, seed):
+    """One k-means run; returns (centers, labels, inertia, n_iter, n_dtw)."""
+    rng = np.random.default_rng(seed)
+    centers = _init_centers(X, k, rng)
+    n_dtw = 0
+    seen = np.zeros(k)
+    previous = np.inf
+    n_iter = 0
+
+    for n_iter in range(1, max_iter + 1):
+        rows = np.arange(len(X)) if batch_size is None or batch_size >= len(X) \
+            else rng.choice(len(X), batch_size, replace=False)
+        labels, costs, n = _assign(X[rows], centers, window)
+        n_dtw += n
+
+        for c in range(k):
+            members = X[rows[labels == c]]
+            if len(members) == 0:
+                if batch_size is None:
+                    # Re-seed an empty cluster with the worst-fitted series
+                    centers[c] = X[rows[np.argmax(costs)]]
+                    costs[np.argmax(costs)] = 0.0
+                continue
+            barycenter, _ = dba_update(centers[c], members, window)
+            if batch_size is None:
+                centers[c] = barycenter
+            else:
+                seen[c] += len(members)
+                eta = len(members) / seen[c]
+                centers[c] = (1 - eta) * centers[c] + eta * barycenter
+
+        inertia = costs.sum() / len(rows)
+        if batch_size is None and np.isfinite(previous) \
+                and abs(previous - inertia) <= tol * max(previous, 1e-12):
+            break
+        previous = inertia
+
+    labels, costs, n = _assign(X, centers, window)
+    return centers, labels, float(costs.sum()), n_iter, n_dtw + n
+
+
+class DBAKMeans(ClusterMixin, BaseEstimator):
+    """k-means with DTW distance and DBA barycenters.
+
+    Args:
+        n_clusters: Number of clusters k
+        window: Sakoe-Chiba band as a fraction of the length (float < 1) or in samples
+        paa_segments: Optionally reduce every series with PAA first (ts_features.paa)
+        batch_size: Mini-batch size (None = full batch)
+        max_iter: Iterations (full passes, or mini-batches when batch_size is set)
+        n_init: Restarts; the run with the lowest inertia is kept
+        tol: Relative inertia change for convergence (full batch only)
+        random_state: Seed
+        n_jobs: Parallel restarts (joblib semantics, -1 = all cores)
+    """
+
+    def __init__(self, n_clusters=5, window=0.05, paa_segments=None, batch_size=None,
+                 max_iter=20, n_init=3, tol=1e-3, random_state=None, n_jobs=-1):
+        self.n_clusters = n_clusters
+        self.window = window
+        self.paa_segments = paa_segments
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.n_init = n_init
+        self.tol = tol
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+
+    def _transform(self, X):
+        X = np.asarray(X, dtype=float)
+        if X.ndim == 3:
+            X = X[:, :, 0]
+        if self.paa_segments is not None:
+            from ts_features import paa
+            X = paa(X, self.paa_segments)
+        return np.ascontiguousarray(X)
+
+    def _window(self, length):
+        return int(round(self.window * length)) if self.window < 1 else int(self.window)
+
+    def _set_result(self, result):
+        centers, labels, inertia, n_iter, n_dtw = result
+        self.cluster_centers_ = centers
+        self.labels_ = labels
+        self.inertia_ = inertia
+        self.n_iter_ = n_iter
+        self.n_dtw_computed_ = n_dtw
+        return self
+
+    def fit(self, X, y=None):
+        X = self._transform(X)
+        self.window_ = self._window(X.shape[1])
+        seeds = np.random.SeedSequence(self.random_state).generate_state(self.n_init)
+        prefer = 'threads' if NUMBA_AVAILABLE else 'processes'
+        results = Parallel(n_jobs=self.n_jobs, prefer=prefer)(
+            delayed(_fit_single)(X, self.n_clusters, self.window_, self.batch_size,
+                                 self.max_iter, self.tol, int(seed)) for seed in seeds
+        )
+        self.restart_inertias_ = np.array([r[2] for r in results])
+        return self._set_result(min(results, key=lambda r: r[2]))
+
+    def predict(self, X):
+        labels, _, _ = _assign(self._transform(X), self.cluster_centers_, self.window_)
+        return labels
+
+    def cluster_profiles(self, X, n_segments):
+        """Cluster-average PAA profiles of the members, shape (n_clusters, n_segments)."""
+        from ts_features import paa
+        X_paa = paa(np.asarray(X, dtype=float), n_segments)
+        return np.array([X_paa[self.labels_ == c].mean(axis=0) if (self.labels_ == c).any()
+                         else np.full(n_segments, np.nan) for c in range(self.n_clusters)])
+
+
+def dba_kmeans_sweep(X, ks, n_init=3, n_jobs=-1, random_state=None, **params):
+    """Fit DBAKMeans for several k with all (k, restart) runs in one parallel pool.
+
+    Args:
+        X: (n_series, n_samples) matrix
+        ks: Iterable of cluster counts
+        n_init: Restarts per k
+        n_jobs: Parallel runs (joblib semantics)
+        random_state: Seed
+        **params: Forwarded to DBAKMeans (window, paa_segments, batch_size, max_iter, tol)
+
+    Returns:
+        (summary DataFrame with k, best inertia and DTW count, dict k -> fitted DBAKMeans)
+    """
+    ks = list(ks)
+    template = DBAKMeans(n_init=n_init, random_state=random_state, n_jobs=n_jobs, **params)
+    Xt = template._transform(X)
+    window = template._window(Xt.shape[1])
+    seeds = np.random.SeedSequence(random_state).generate_state(len(ks) * n_init)
+    runs = [(k, int(seeds[i * n_init + r])) for i, k in enumerate(ks) for r in range(n_init)]
+
+    prefer = 'threads' if NUMBA_AVAILABLE else 'processes'
+    results = Parallel(n_jobs=n_jobs, prefer=prefer)(
+        delayed(_fit_single)(Xt, k, window, template.batch_size, template.max_iter,
+                             template.tol, seed) for k, seed in runs
+    )
+
+    models, rows = {}, []
+    for k in ks:
+        k_results = [res for (run_k, _), res in zip(runs, results) if run_k == k]
+        model = DBAKMeans(n_clusters=k, n_init=n_init, random_state=random_state, n_jobs=n_jobs,
+                          **params)
+        model.window_ = window
+        model.restart_inertias_ = np.array([r[2] for r in k_results])
+        model._set_result(min(k_results, key=lambda r: r[2]))
+        models[k] = model
+        rows.append({'k': k, 'inertia': model.inertia_,
+                     'n_dtw_computed': int(sum(r[4] for r in k_results))})
+    return pd.DataFrame(rows), models
@@ -0,0 +1,178 @@
+"""Batched time series approximations (PAA, SAX, DFT) for the ECG notebooks.
+
+Notebooks 3.1, 5 and 6 import from here instead of keeping their own copies.
+Every function accepts either a single 1-D series, an equal-length matrix of
+shape (n_series, n_samples), or ragged input given as a flat values buffer plus
+an ``offsets`` array of length n_series + 1 (series i is
+``values[offsets[i]:offsets[i + 1]]``).
+"""
+from functools import lru_cache
+
+import numpy as np
+from scipy.fft import rfft
+from scipy.stats import norm
+
+
+def to_flat(series_list):
+    """Concatenate variable-length series into a flat buffer with offsets.
+
+    Args:
+        series_list: Iterable of 1-D arrays (e.g. the object array X_raw)
+
+    Returns:
+        (values, offsets) where offsets has length n_series + 1
+    """
+    series_list = [np.asarray(ts, dtype=float) for ts in series_list]
+    lengths = np.array([len(ts) for ts in series_list], dtype=np.int64)
+    offsets = np.zeros(len(series_list) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate(series_list) if series_list else np.empty(0)
+    return values, offsets
+
+
+def _as_batch(X, offsets):
+    """Normalize input to (values, offsets, is_single, matrix_or_None)."""
+    if offsets is not None:
+        values = np.asarray(X, dtype=float)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if values.ndim != 1 or offsets.ndim != 1 or len(offsets) < 1:
+            raise ValueError("Ragged input needs a 1-D values buffer and 1-D offsets")
+        return values, offsets, False, None
+
+    X = np.asarray(X, dtype=float)
+    is_single = X.ndim == 1
+    if is_single:
+        X = X[np.newaxis, :]
+    if X.ndim != 2:
+        raise ValueError(f"Expected a 1-D series or 2-D matrix, got shape {X.shape}")
+    return None, None, is_single, X
+
+
+def _segment_starts(lengths, n_segments):
+    """Segment start positions (relative to each series) of shape (n, n_segments)."""
+    return (np.arange(n_segments)[np.newaxis, :] * lengths[:, np.newaxis]) // n_segments
+
+
+def paa(X, n_segments, offsets=None):
+    """PAA: average each series over n_segments (near) equal segments.
+
+    Args:
+        X: 1-D series, (n_series, n_samples) matrix, or flat values (with offsets)
+        n_segments: Number of PAA segments
+        offsets: Optional ragged offsets, see module docstring
+
+    Returns:
+        PAA values, shape (n_segments,) for a single series else (n_series, n_segments)
+    """
+    values, offsets, is_single, X = _as_batch(X, offsets)
+
+    if X is not None:
+        n, m = X.shape
+        if n_segments > m:
+            raise ValueError("n_segments must be <= length of series")
+        if m % n_segments == 0:
+            result = X.reshape(n, n_segments, m // n_segments).mean(axis=2)
+        else:
+            starts = _segment_starts(np.array([m]), n_segments)[0]
+            sizes = np.diff(np.append(starts, m))
+            result = np.add.reduceat(X, starts, axis=1) / sizes
+        return result[0] if is_single else result
+
+    lengths = np.diff(offsets)
+    if len(lengths) == 0:
+        return np.empty((0, n_segments))
+    if lengths.min() < n_segments:
+        raise ValueError("n_segments must be <= length of every series")
+    starts = offsets[:-1, np.newaxis] + _segment_starts(lengths, n_segments)
+    ends = np.concatenate([starts[:, 1:], offsets[1:, np.newaxis]], axis=1)
+    sums = np.add.reduceat(values[:offsets[-1]], starts.ravel()).reshape(starts.shape)
+    return sums / (ends - starts)
+
+
+@lru_cache(maxsize=None)
+def sax_breakpoints(alphabet_size):
+    """Gaussian equiprobable breakpoints for a SAX alphabet."""
+    return norm.ppf(np.arange(1, alphabet_size) / alphabet_size)
+
+
+def _row_mean_std(X, values, offsets):
+    if X is not None:
+        return X.mean(axis=1), X.std(axis=1)
+    lengths = np.diff(offsets)
+    data = values[offsets[0]:offsets[-1]]
+    starts = offsets[:-1] - offsets[0]
+    sums = np.add.reduceat(data, starts)
+    sq_sums = np.add.reduceat(data * data, starts)
+    mean = sums / lengths
+    var = np.maximum(sq_sums / lengths - mean ** 2, 0.0)
+    return mean, np.sqrt(var)
+
+
+def sax(X, n_segments, alphabet_size=4, offsets=None):
+    """SAX: z-normalize, PAA, then map segment means to symbols 0..alphabet_size-1.
+
+    PAA is linear, so the z-normalization is applied to the PAA values using the
+    per-series mean/std instead of materializing a normalized copy of the input.
+
+    Args:
+        X: 1-D series, (n_series, n_samples) matrix, or flat values (with offsets)
+        n_segments: Number of PAA segments / SAX symbols
+        alphabet_size: Number of SAX symbols, default 4
+        offsets: Optional ragged offsets, see module docstring
+
+    Returns:
+        Integer SAX words, shape (n_segments,) or (n_series, n_segments)
+    """
+    values, offsets, is_single, X = _as_batch(X, offsets)
+    paa_values = paa(X if X is not None else values, n_segments, offsets=offsets)
+
+    mean, std = _row_mean_std(X, values, offsets)
+    std = np.where(std == 0, 1.0, std)
+    paa_norm = (paa_values - mean[:, np.newaxis]) / std[:, np.newaxis]
+
+    # Symbol = number of breakpoints strictly below the value
+    symbols = np.searchsorted(sax_breakpoints(alphabet_size), paa_norm, side='left')
+    return symbols[0] if is_single else symbols
+
+
+def dft_features(X, n_coefficients=20, offsets=None):
+    """DFT: magnitudes of the first Fourier coefficients, scaled by series length.
+
+    Args:
+        X: 1-D series, (n_series, n_samples) matrix, or flat values (with offsets)
+        n_coefficients: Number of coefficients to keep, default 20
+        offsets: Optional ragged offsets, see module docstring
+
+    Returns:
+        DFT magnitudes, shape (n_coeffs,) or (n_series, n_coefficients).
+        Ragged series too short for n_coefficients (len // 2) are padded with NaN.
+    """
+    values, offsets, is_single, X = _as_batch(X, offsets)
+
+    if X is not None:
+        m = X.shape[1]
+        n_coeffs = min(n_coefficients, m // 2)
+        result = np.abs(rfft(X, axis=1)[:, :n_coeffs]) / m
+        return result[0] if is_single else result
+
+    # Batched rfft per distinct length; ECG extracts have one or a few lengths
+    lengths = np.diff(offsets)
+    result = np.full((len(lengths), n_coefficients), np.nan)
+    for m in np.unique(lengths):
+        rows = np.flatnonzero(lengths == m)
+        block = values[offsets[rows, np.newaxis] + np.arange(m)]
+        n_coeffs = min(n_coefficients, m // 2)
+        result[rows, :n_coeffs] = np.abs(rfft(block, axis=1)[:, :n_coeffs]) / m
+    return result
+
+
+def approximation_features(X, n_paa_segments=30, n_sax_segments=30, alphabet_size=4,
+                           n_dft_coefficients=30, offsets=None):
+    """Stack PAA, SAX and DFT features into one (n_series, n_features) matrix."""
+    if offsets is None and np.asarray(X).ndim == 1:
+        X = np.asarray(X)[np.newaxis, :]
+    return np.hstack([
+        paa(X, n_paa_segments, offsets=offsets),
+        sax(X, n_sax_segments, alphabet_size, offsets=offsets),
+        dft_features(X, n_dft_coefficients, offsets=offsets),
+    ])
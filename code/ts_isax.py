@@ -0,0 +1,294 @@
+"""iSAX index for similarity search over the ECG corpus.
+
+Every series is z-normalized and reduced with PAA (``ts_features.paa``); each
+segment mean gets a SAX symbol at the maximum cardinality 2**max_bits. Because
+the Gaussian breakpoints for 2**b symbols are a subset of those for 2**(b+1),
+the symbol at any lower cardinality is a bit prefix (``symbol >> shift``), so
+nodes can use a different cardinality per segment without recomputing SAX:
+
+- the root has one child per 1-bit SAX word;
+- a node holding more than ``leaf_size`` series is split on the segment whose
+  next bit divides it most evenly (iSAX 2.0), doubling that segment's cardinality.
+  When no next bit divides it, a segment whose deeper bits differ is refined in
+  place until one does, so leaves only exceed ``leaf_size`` when their series
+  have identical words at full cardinality.
+
+Each node covers a box of PAA values. MINDIST, the weighted distance from the
+query's PAA to that box, lower-bounds the Euclidean distance of the query to
+every series below the node. Exact k-NN queries visit nodes best-first by
+MINDIST and stop as soon as the next node cannot beat the current k-th
+neighbour. Approximate queries stop after a few leaves, starting with the leaf
+the query itself falls in. Optionally, the Euclidean candidates are re-ranked
+with DTW (``ts_dtw.dtw``).
+"""
+import heapq
+from itertools import count
+
+import numpy as np
+
+from ts_features import paa, sax_breakpoints
+
+
+class _Node:
+    __slots__ = ('bits', 'word', 'lower', 'upper', 'ids', 'split', 'children')
+
+    def __init__(self, bits, word, lower, upper):
+        self.bits = bits
+        self.word = word
+        self.lower = lower
+        self.upper = upper
+        self.ids = None  # row positions for leaves
+        self.split = None  # segment split by an internal node
+        self.children = ()
+
+
+class ISAXIndex:
+    """Hierarchical iSAX index with approximate and exact k-NN queries.
+
+    Args:
+        n_segments: PAA segments / SAX word length
+        max_bits: Maximum cardinality per segment is 2**max_bits
+        leaf_size: Maximum number of series per leaf (unless their words are identical
+            at full cardinality)
+        normalize: z-normalize series (as in SAX); False indexes raw values
+    """
+
+    def __init__(self, n_segments=16, max_bits=8, leaf_size=64, normalize=True):
+        if not 1 <= max_bits <= 16:
+            raise ValueError("max_bits must be between 1 and 16")
+        self.n_segments = n_segments
+        self.max_bits = max_bits
+        self.leaf_size = leaf_size
+        self.normalize = normalize
+        self.last_query_stats_ = {}
+
+    # ---- construction -------------------------------------------------------------
+
+    def _scale(self, X):
+        X = np.asarray(X, dtype=float)
+        if not self.normalize:
+            return X, np.zeros(len(X)), np.ones(len(X))
+        mean, std = X.mean(axis=1), X.std(axis=1)
+        std = np.where(std > 0, std, 1.0)
+        return X, mean, std
+
+    def _bounds(self, bits, word):
+        """PAA box [lower, upper] of a node from its per-segment bits and symbols."""
+        shift = self.max_bits - bits
+        return self._edges[word << shift], self._edges[(word + 1) << shift]
+
+    def _make_node(self, bits, word):
+        lower, upper = self._bounds(bits, word)
+        return _Node(bits, word, lower, upper)
+
+    def _build(self, node, rows):
+        """Split node until its leaves hold at most leaf_size rows."""
+        stack = [(node, rows)]
+        while stack:
+            node, rows = stack.pop()
+            splittable = node.bits < self.max_bits
+            if len(rows) <= self.leaf_size or not splittable.any():
+                node.ids = rows
+                continue
+            # Next bit of every segment; split on the most balanced one
+            shift = self.max_bits - node.bits - 1
+            next_bit = (self.symbols_[rows] >> np.maximum(shift, 0)) & 1
+            ones = next_bit.sum(axis=0)
+            balance = np.where(splittable, np.minimum(ones, len(rows) - ones), -1)
+            j = int(np.argmax(balance))
+            if balance[j] <= 0:
+                # Every next bit is shared by all rows: refine a segment whose deeper
+                # bits still differ (tighter box, same rows) and try again
+                differs = splittable & (self.symbols_[rows] != self.symbols_[rows[0]]).any(axis=0)
+                if not differs.any():
+                    node.ids = rows  # identical words at full cardinality
+                    continue
+                j = int(np.argmax(differs))
+                node.bits[j] += 1
+                node.word[j] = 2 * node.word[j] + next_bit[0, j]
+                node.lower, node.upper = self._bounds(node.bits, node.word)
+                stack.append((node, rows))
+                continue
+            node.split = j
+            children = []
+            for bit in (0, 1):
+                bits = node.bits.copy()
+                bits[j] += 1
+                word = node.word.copy()
+                word[j] = 2 * word[j] + bit
+                child = self._make_node(bits, word)
+                children.append(child)
+                stack.append((child, rows[next_bit[:, j] == bit]))
+            node.children = tuple(children)
+
+    def fit(self, X, ids=None):
+        """Index an equal-length (n_series, n_samples) matrix.
+
+        Args:
+            X: Series matrix; a np.memmap is kept by reference, not copied
+            ids: Identifier per series (e.g. subject_id), default row positions
+        """
+        self.X_ = X if isinstance(X, np.memmap) else np.asarray(X, dtype=float)
+        n, m = self.X_.shape
+        if self.n_segments > m:
+            raise ValueError("n_segments must be <= length of series")
+        self.ids_ = np.arange(n) if ids is None else np.asarray(ids)
+        _, self.mean_, self.std_ = self._scale(self.X_)
+
+        self.paa_ = (paa(self.X_, self.n_segments) - self.mean_[:, np.newaxis]) / self.std_[:, np.newaxis]
+        starts = (np.arange(self.n_segments) * m) // self.n_segments
+        self.segment_sizes_ = np.diff(np.append(starts, m)).astype(float)
+
+        breakpoints = sax_breakpoints(2 ** self.max_bits)
+        self._edges = np.concatenate([[-np.inf], breakpoints, [np.inf]])
+        dtype = np.uint8 if self.max_bits <= 8 else np.uint16
+        self.symbols_ = np.searchsorted(breakpoints, self.paa_, side='left').astype(dtype)
+
+        # Root children: one per distinct 1-bit word
+        root_words, inverse = np.unique(self.symbols_ >> (self.max_bits - 1), axis=0,
+                                        return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        splits = np.searchsorted(inverse[order], np.arange(1, len(root_words)))
+        self.roots_ = []
+        for word, rows in zip(root_words, np.split(order, splits)):
+            node = self._make_node(np.ones(self.n_segments, dtype=np.int64), word.astype(np.int64))
+            self._build(node, rows)
+            self.roots_.append(node)
+        self._root_lower = np.array([r.lower for r in self.roots_])
+        self._root_upper = np.array([r.upper for r in self.roots_])
+        return self
+
+    # ---- queries ------------------------------------------------------------------
+
+    def _mindist_sq(self, q_paa, lower, upper):
+        """Squared MINDIST of the query PAA to one or many PAA boxes."""
+        gap = np.maximum(lower - q_paa, 0.0) + np.maximum(q_paa - upper, 0.0)
+        return (gap ** 2) @ self.segment_sizes_
+
+    def _rows(self, rows):
+        rows = np.sort(rows)
+        X = np.asarray(self.X_[rows], dtype=float)
+        return rows, (X - self.mean_[rows, np.newaxis]) / self.std_[rows, np.newaxis]
+
+    def leaves(self):
+        """Number of series in every leaf (useful to tune leaf_size)."""
+        sizes, stack = [], list(self.roots_)
+        while stack:
+            node = stack.pop()
+            if node.ids is not None:
+                sizes.append(len(node.ids))
+            stack.extend(node.children)
+        return np.array(sizes)
+
+    def _search(self, q, k, max_leaves, exclude):
+        """Best-first k-NN search; returns (squared distances, row positions)."""
+        q_paa = paa(q, self.n_segments)
+        best_d = np.full(k, np.inf)
+        best_rows = np.full(k, -1)
+        tie = count()
+        heap = [(d, next(tie), node) for d, node in
+                zip(self._mindist_sq(q_paa, self._root_lower, self._root_upper), self.roots_)]
+        heapq.heapify(heap)
+        n_leaves = n_compared = 0
+
+        while heap:
+            d_node, _, node = heapq.heappop(heap)
+            if d_node >= best_d[-1]:
+                break
+            if max_leaves is not None and n_leaves >= max_leaves and np.isfinite(best_d[-1]):
+                break
+            if node.ids is None:
+                for child in node.children:
+                    heapq.heappush(heap, (self._mindist_sq(q_paa, child.lower, child.upper),
+                                          next(tie), child))
+                continue
+
+            n_leaves += 1
+            rows = node.ids
+            if exclude is not None:
+                rows = rows[~np.isin(self.ids_[rows], exclude)]
+            # PAA lower bound per series before touching the raw data
+            lb = ((self.paa_[rows] - q_paa) ** 2) @ self.segment_sizes_
+            rows = rows[lb < best_d[-1]]
+            if len(rows) == 0:
+                continue
+            rows, Z = self._rows(rows)
+            n_compared += len(rows)
+            d = ((Z - q) ** 2).sum(axis=1)
+            all_d = np.concatenate([best_d, d])
+            all_rows = np.concatenate([best_rows, rows])
+            keep = np.argsort(all_d, kind='stable')[:k]
+            best_d, best_rows = all_d[keep], all_rows[keep]
+
+        self.last_query_stats_ = {'leaves_visited': n_leaves, 'series_compared': n_compared,
+                                  'fraction_compared': n_compared / len(self.ids_)}
+        found = best_rows >= 0
+        return best_d[found], best_rows[found]
+
+    def query(self, q, n_neighbors=5, exact=True, max_leaves=1, exclude=None,
+              dtw_window=None, n_dtw_candidates=None):
+        """k nearest indexed series of one query.
+
+        Args:
+            q: Query series with the indexed length
+            n_neighbors: Number of neighbours k
+            exact: Exact search; False visits at most max_leaves leaves
+                (more if fewer than k series were found)
+            max_leaves: Leaf budget of approximate search
+            exclude: Ids to leave out (e.g. the query patient itself)
+            dtw_window: If set, re-rank the Euclidean candidates by DTW with this
+                Sakoe-Chiba window (samples)
+            n_dtw_candidates: Euclidean candidates re-ranked by DTW (default 4 * k)
+
+        Returns:
+            (distances, ids) sorted by distance
+        """
+        q = np.asarray(q, dtype=float)
+        if len(q) != self.X_.shape[1]:
+            raise ValueError(f"Query length {len(q)} != indexed length {self.X_.shape[1]}")
+        if self.normalize:
+            std = q.std()
+            q = (q - q.mean()) / (std if std > 0 else 1.0)
+        if exclude is not None:
+            exclude = np.atleast_1d(exclude)
+
+        k = n_neighbors if dtw_window is None else max(n_neighbors, n_dtw_candidates or 4 * n_neighbors)
+        d_sq, rows = self._search(q, k, None if exact else max_leaves, exclude)
+        distances = np.sqrt(d_sq)
+
+        if dtw_window is not None and len(rows):
+            from ts_dtw import dtw
+            rows, Z = self._rows(rows)
+            distances = np.array([dtw(q, z, window=dtw_window) for z in Z])
+            order = np.argsort(distances, kind='stable')[:n_neighbors]
+            distances, rows = distances[order], rows[order]
+        return distances, self.ids_[rows]
+
+    def kneighbors(self, Q, n_neighbors=5, exclude_self=False, ids=None, **query_params):
+        """Batch query, e.g. to build k-NN features.
+
+        Args:
+            Q: (n_queries, n_samples) matrix
+            n_neighbors: Number of neighbours k
+            exclude_self: Leave each query's own id out (queries taken from the index)
+            ids: Query ids for exclude_self, default the indexed ids
+            **query_params: Forwarded to query (exact, max_leaves, dtw_window, ...)
+
+        Returns:
+            (distances, ids), both (n_queries, n_neighbors); missing entries are NaN / -1
+        """
+        Q = np.asarray(Q, dtype=float)
+        if exclude_self:
+            ids = self.ids_ if ids is None else np.asarray(ids)
+        distances = np.full((len(Q), n_neighbors), np.nan)
+        neighbor_ids = np.full((len(Q), n_neighbors), -1, dtype=self.ids_.dtype)
+        fractions = []
+        for i, q in enumerate(Q):
+            d, nid = self.query(q, n_neighbors, exclude=ids[i] if exclude_self else None,
+                                **query_params)
+            distances[i, :len(d)] = d
+            neighbor_ids[i, :len(nid)] = nid
+            fractions.append(self.last_query_stats_['fraction_compared'])
+        self.last_query_stats_ = {'mean_fraction_compared': float(np.mean(fractions)) if fractions else 0.0}
+        return distances, neighbor_ids
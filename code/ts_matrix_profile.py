@@ -0,0 +1,261 @@
+"""Matrix profile (z-normalized) for the preprocessed ECG signals of notebook 3.1.
+
+The matrix profile of a series holds, for every length-m window, the distance
+to its nearest non-trivial match. Low values are repeated beats (motifs) and
+high values are anomalous windows (discords). Both capture local ST-segment and
+T-wave changes that global PAA/SAX/DFT summaries average away.
+
+Computation follows SCRIMP: the distance matrix is walked one diagonal at a
+time. The sliding dot products along a diagonal are a windowed sum of
+``A[i + t] * B[i + k + t]``, so each diagonal costs one cumulative sum (O(n))
+and the full profile costs O(n^2) with small constants instead of O(n^2 m).
+Diagonals are visited in random order, so stopping after a fraction of them
+gives an anytime approximation: every value is an upper bound of the exact
+profile that tightens as more diagonals are added (SCRIMP++ without the
+PreSCRIMP seeding step).
+
+Cohort profiles are computed per patient on a process pool and cached as raw
+files next to the preprocessed store, with the flat layout used elsewhere
+(values plus offsets).
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+MP_FEATURES = ['mp_motif_dist', 'mp_discord_dist', 'mp_mean', 'mp_median', 'mp_std']
+
+
+def _window_stats(T, m):
+    cumsum = np.concatenate([[0.0], np.cumsum(T)])
+    cumsum_sq = np.concatenate([[0.0], np.cumsum(T * T)])
+    mean = (cumsum[m:] - cumsum[:-m]) / m
+    std = np.sqrt(np.maximum((cumsum_sq[m:] - cumsum_sq[:-m]) / m - mean ** 2, 0.0))
+    # Flat windows get correlation 0 (distance sqrt(2m)) with everything
+    return mean, np.where(std > 1e-8, std, np.inf)
+
+
+def _diagonal_join(A, B, m, diagonals):
+    """Update the A->B and B->A profiles along the given diagonals (j = i + k)."""
+    n_a, n_b = len(A) - m + 1, len(B) - m + 1
+    mean_a, std_a = _window_stats(A, m)
+    mean_b, std_b = _window_stats(B, m)
+    P_a, I_a = np.full(n_a, np.inf), np.full(n_a, -1, dtype=np.int64)
+    P_b, I_b = np.full(n_b, np.inf), np.full(n_b, -1, dtype=np.int64)
+
+    for k in diagonals:
+        i0, j0 = max(0, -k), max(0, k)
+        length = min(n_a - i0, n_b - j0)
+        if length <= 0:
+            continue
+        prod = A[i0:i0 + length + m - 1] * B[j0:j0 + length + m - 1]
+        cs = np.concatenate([[0.0], np.cumsum(prod)])
+        qt = cs[m:] - cs[:-m]
+        i = np.arange(i0, i0 + length)
+        j = i + k
+        corr = (qt - m * mean_a[i] * mean_b[j]) / (m * std_a[i] * std_b[j])
+        d = np.sqrt(np.maximum(2 * m * (1 - np.clip(corr, -1.0, 1.0)), 0.0))
+
+        better = d < P_a[i]
+        P_a[i[better]], I_a[i[better]] = d[better], j[better]
+        better = d < P_b[j]
+        P_b[j[better]], I_b[j[better]] = d[better], i[better]
+    return P_a, I_a, P_b, I_b
+
+
+def _diagonal_order(first, stop, fraction, random_state):
+    diagonals = np.arange(first, stop)
+    if fraction < 1.0:
+        rng = np.random.default_rng(random_state)
+        diagonals = rng.permutation(diagonals)[:max(1, int(np.ceil(fraction * len(diagonals))))]
+    return diagonals
+
+
+def self_join(T, m, fraction=1.0, exclusion=None, random_state=None):
+    """Matrix profile of one series.
+
+    Args:
+        T: 1-D series
+        m: Window length in samples
+        fraction: Fraction of diagonals to evaluate (< 1 = anytime approximation)
+        exclusion: Trivial-match exclusion zone, default ceil(m / 4)
+        random_state: Seed for the diagonal order when fraction < 1
+
+    Returns:
+        (profile, index) arrays of length len(T) - m + 1
+    """
+    T = np.asarray(T, dtype=float)
+    n_sub = len(T) - m + 1
+    if n_sub < 2:
+        raise ValueError("Series must be longer than the window")
+    exclusion = int(np.ceil(m / 4)) if exclusion is None else exclusion
+    diagonals = _diagonal_order(max(1, exclusion), n_sub, fraction, random_state)
+    # Symmetric: the upper triangle updates both the row and the column profile
+    P_a, I_a, P_b, I_b = _diagonal_join(T, T, m, diagonals)
+    better = P_b < P_a
+    return np.where(better, P_b, P_a), np.where(better, I_b, I_a)
+
+
+def ab_join(A, B, m, fraction=1.0, random_state=None):
+    """Matrix profiles between two series (e.g. two patients).
+
+    Returns:
+        (P_ab, I_ab, P_ba, I_ba): nearest window of B for every window of A and
+        nearest window of A for every window of B
+    """
+    A = np.asarray(A, dtype=float)
+    B = np.asarray(B, dtype=float)
+    n_a, n_b = len(A) - m + 1, len(B) - m + 1
+    if n_a < 1 or n_b < 1:
+        raise ValueError("Series must be at least as long as the window")
+    diagonals = _diagonal_order(-(n_a - 1), n_b, fraction, random_state)
+    return _diagonal_join(A, B, m, diagonals)
+
+
+def _top_k(P, k, exclusion, largest):
+    P = np.where(np.isfinite(P), P, -np.inf if largest else np.inf)
+    order = np.argsort(-P if largest else P, kind='stable')
+    chosen = []
+    for idx in order:
+        if not np.isfinite(P[idx]):
+            break
+        if all(abs(idx - c) >= exclusion for c in chosen):
+            chosen.append(idx)
+            if len(chosen) == k:
+                break
+    return np.array(chosen, dtype=np.int64)
+
+
+def motifs(P, nn_index, k=3, exclusion=None, m=None):
+    """Top-k non-overlapping motif pairs as (window, nearest window, distance) rows."""
+    exclusion = exclusion if exclusion is not None else (m or 1)
+    idx = _top_k(P, k, exclusion, largest=False)
+    return pd.DataFrame({'window': idx, 'match': nn_index[idx], 'distance': P[idx]})
+
+
+def discords(P, k=3, exclusion=None, m=None):
+    """Top-k non-overlapping discords as (window, distance) rows."""
+    exclusion = exclusion if exclusion is not None else (m or 1)
+    idx = _top_k(P, k, exclusion, largest=True)
+    return pd.DataFrame({'window': idx, 'distance': P[idx]})
+
+
+def profile_features(profiles, profile_offsets):
+    """Compact motif/discord features per series from flat profiles.
+
+    Returns:
+        DataFrame with MP_FEATURES columns, one row per series
+    """
+    rows = []
+    for start, stop in zip(profile_offsets[:-1], profile_offsets[1:]):
+        P = np.asarray(profiles[start:stop], dtype=float)
+        P = P[np.isfinite(P)]
+        if len(P) == 0:
+            rows.append([np.nan] * len(MP_FEATURES))
+            continue
+        rows.append([P.min(), P.max(), P.mean(), np.median(P), P.std()])
+    return pd.DataFrame(rows, columns=MP_FEATURES)
+
+
+def _self_join_task(args):
+    T, m, fraction, random_state = args
+    if len(T) - m + 1 < 2:
+        n_sub = max(len(T) - m + 1, 0)
+        return np.full(n_sub, np.inf), np.full(n_sub, -1, dtype=np.int64)
+    return self_join(T, m, fraction=fraction, random_state=random_state)
+
+
+def _ab_join_task(args):
+    A, B, m, fraction, random_state = args
+    if min(len(A), len(B)) < m:
+        return np.nan, np.nan, np.nan
+    P_ab, _, P_ba, _ = ab_join(A, B, m, fraction=fraction, random_state=random_state)
+    return P_ab.min(), np.median(P_ab), np.median(P_ba)
+
+
+def _cache_dir(cache_root, m, fraction):
+    name = f'matrix_profile_m{m}' if fraction >= 1 else f'matrix_profile_m{m}_f{fraction:g}'
+    return Path(cache_root) / name
+
+
+def cohort_self_join(values, offsets, m, fraction=1.0, n_workers=None, cache_root=None,
+                     source_stamp=None, random_state=0):
+    """Self-join matrix profiles for every series, in parallel and cached.
+
+    Args:
+        values, offsets: Flat series layout (e.g. PreprocessedStore.select())
+        m: Window length in samples (e.g. 200 = 0.4 s at 500 Hz, about one beat)
+        fraction: Fraction of diagonals per series (< 1 = anytime approximation)
+        n_workers: Worker processes (default: os.cpu_count())
+        cache_root: Directory for the cache (e.g. the preprocessed store directory)
+        source_stamp: Value identifying the source data (e.g. the store's
+            'updated' timestamp); a cache with another stamp is recomputed
+        random_state: Seed for the diagonal order
+
+    Returns:
+        (profiles, indices, profile_offsets) in the flat layout
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_series = len(offsets) - 1
+    meta = {'version': CACHE_VERSION, 'm': m, 'fraction': fraction,
+            'n_series': n_series, 'source_stamp': source_stamp}
+
+    path = _cache_dir(cache_root, m, fraction) if cache_root is not None else None
+    if path is not None and (path / 'meta.json').exists():
+        with open(path / 'meta.json') as f:
+            cached = json.load(f)
+        if {k: cached.get(k) for k in meta} == meta:
+            n_values = cached['n_values']
+            return (np.fromfile(path / 'profile.f32', dtype=np.float32, count=n_values),
+                    np.fromfile(path / 'index.i64', dtype=np.int64, count=n_values),
+                    np.fromfile(path / 'offsets.i64', dtype=np.int64, count=n_series + 1))
+
+    tasks = ((np.asarray(values[offsets[i]:offsets[i + 1]], dtype=float), m, fraction, random_state)
+             for i in range(n_series))
+    with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count()) as pool:
+        results = list(pool.map(_self_join_task, tasks, chunksize=8))
+
+    lengths = [len(P) for P, _ in results]
+    profile_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    profiles = np.concatenate([P for P, _ in results]).astype(np.float32) if results \
+        else np.empty(0, dtype=np.float32)
+    indices = np.concatenate([nn_index for _, nn_index in results]) if results else np.empty(0, dtype=np.int64)
+
+    if path is not None:
+        path.mkdir(parents=True, exist_ok=True)
+        profiles.tofile(path / 'profile.f32')
+        indices.astype(np.int64).tofile(path / 'index.i64')
+        profile_offsets.tofile(path / 'offsets.i64')
+        with open(path / 'meta.json', 'w') as f:
+            json.dump({**meta, 'n_values': int(profile_offsets[-1])}, f, indent=2)
+    return profiles, indices, profile_offsets
+
+
+def cohort_ab_join(values, offsets, pairs, m, fraction=1.0, n_workers=None, random_state=0):
+    """AB-join summaries for pairs of series (e.g. a case against reference patients).
+
+    Args:
+        values, offsets: Flat series layout
+        pairs: (n_pairs, 2) row positions
+        m: Window length in samples
+
+    Returns:
+        DataFrame with a, b, min_dist (closest windows), median_ab and median_ba
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+    def series(i):
+        return np.asarray(values[offsets[i]:offsets[i + 1]], dtype=float)
+
+    tasks = ((series(a), series(b), m, fraction, random_state) for a, b in pairs)
+    with ProcessPoolExecutor(max_workers=n_workers or os.cpu_count()) as pool:
+        results = list(pool.map(_ab_join_task, tasks, chunksize=8))
+    result = pd.DataFrame(results, columns=['min_dist', 'median_ab', 'median_ba'])
+    result.insert(0, 'b', pairs[:, 1])
+    result.insert(0, 'a', pairs[:, 0])
+    return result
@@ -0,0 +1,202 @@
+"""Shapelet discovery and shapelet transform for the ECG classifiers (notebook 6).
+
+The distance between a shapelet q (length m) and a series T is the minimum over
+all length-m windows of T. All windows are handled at once with MASS-style FFT
+convolution: the sliding dot products q . T[i:i+m] come from one inverse FFT,
+and the per-window means/stds come from cumulative sums. The FFTs and rolling
+statistics of the training series are computed once and reused for every
+candidate, so each candidate costs O(n log n) per series instead of O(n * m).
+
+Discovery samples thousands of candidate subsequences from the training series,
+ranks them by the information gain of their best distance threshold, and drops
+self-similar candidates (overlapping windows of the same series) while picking
+the top shapelets.
+"""
+import numpy as np
+import pandas as pd
+from scipy import fft as sp_fft
+from sklearn.base import BaseEstimator, TransformerMixin
+
+
+class SlidingDistance:
+    """Precomputed FFTs and rolling statistics of a (n_series, length) matrix.
+
+    Args:
+        X: Equal-length series matrix
+        max_length: Longest query length that will be used
+        workers: Threads for scipy.fft (-1 = all cores)
+    """
+
+    def __init__(self, X, max_length, workers=-1):
+        self.X = np.ascontiguousarray(X, dtype=float)
+        self.length = self.X.shape[1]
+        if max_length > self.length:
+            raise ValueError("Shapelet length exceeds series length")
+        self.workers = workers
+        self.nfft = sp_fft.next_fast_len(self.length + max_length - 1, real=True)
+        self.X_fft = sp_fft.rfft(self.X, n=self.nfft, axis=1, workers=workers)
+        zeros = np.zeros((self.X.shape[0], 1))
+        self._cumsum = np.hstack([zeros, np.cumsum(self.X, axis=1)])
+        self._cumsum_sq = np.hstack([zeros, np.cumsum(self.X ** 2, axis=1)])
+        self._stats = {}
+
+    def window_stats(self, m):
+        """Window sums, means and stds for window length m (cached per m)."""
+        if m not in self._stats:
+            sums = self._cumsum[:, m:] - self._cumsum[:, :-m]
+            sq_sums = self._cumsum_sq[:, m:] - self._cumsum_sq[:, :-m]
+            mean = sums / m
+            std = np.sqrt(np.maximum(sq_sums / m - mean ** 2, 0.0))
+            self._stats[m] = (sq_sums, mean, std)
+        return self._stats[m]
+
+    def sliding_dot(self, q, rows=None):
+        """Dot products of q with every length-m window of every (selected) series."""
+        m = len(q)
+        q_fft = sp_fft.rfft(q[::-1], n=self.nfft)
+        X_fft = self.X_fft if rows is None else self.X_fft[rows]
+        prod = sp_fft.irfft(X_fft * q_fft, n=self.nfft, axis=1, workers=self.workers)
+        return prod[:, m - 1:self.length]
+
+    def min_distances(self, q, normalize=True, rows=None):
+        """Minimum Euclidean distance of q to each series (z-normalized windows by default).
+
+        Returns:
+            (distances, best window start per series)
+        """
+        q = np.asarray(q, dtype=float)
+        m = len(q)
+        qt = self.sliding_dot(q, rows)
+        sq_sums, mean, std = self.window_stats(m)
+        if rows is not None:
+            sq_sums, mean, std = sq_sums[rows], mean[rows], std[rows]
+
+        if normalize:
+            q_std = q.std()
+            if q_std == 0:
+                # A flat shapelet is equally far from every non-flat window
+                d2 = np.where(std > 0, float(m), 0.0)
+            else:
+                corr = (qt - m * q.mean() * mean) / (m * q_std * np.where(std > 0, std, np.inf))
+                d2 = 2 * m * (1 - np.clip(corr, -1.0, 1.0))
+                d2 = np.where(std > 0, d2, float(m))
+        else:
+            d2 = (q @ q) + sq_sums - 2 * qt
+
+        best = np.argmin(d2, axis=1)
+        d2_min = np.maximum(d2[np.arange(len(d2)), best], 0.0)
+        return np.sqrt(d2_min), best
+
+
+def information_gain(D, y):
+    """Best-split information gain of every row of D as a feature for labels y.
+
+    Args:
+        D: (n_candidates, n_series) distances
+        y: Class labels of the series
+
+    Returns:
+        (gain, threshold) arrays of length n_candidates
+    """
+    D = np.atleast_2d(D)
+    classes, y_codes = np.unique(y, return_inverse=True)
+    n = len(y_codes)
+    onehot = np.eye(len(classes))[y_codes]
+
+    def entropy(counts, totals):
+        p = counts / np.maximum(totals, 1)[..., np.newaxis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return -np.nansum(np.where(p > 0, p * np.log2(p), 0.0), axis=-1)
+
+    order = np.argsort(D, axis=1, kind='stable')
+    D_sorted = np.take_along_axis(D, order, axis=1)
+    left = np.cumsum(onehot[order], axis=1)[:, :-1]  # split after position i
+    total = onehot.sum(axis=0)
+    n_left = np.arange(1, n)
+    n_right = n - n_left
+    h_split = (n_left * entropy(left, n_left) + n_right * entropy(total - left, n_right)) / n
+    gains = entropy(total, np.array(n)) - h_split
+
+    # Splits between equal distances are not realizable thresholds
+    gains = np.where(D_sorted[:, 1:] > D_sorted[:, :-1], gains, -np.inf)
+    best = np.argmax(gains, axis=1)
+    rows = np.arange(len(D))
+    threshold = (D_sorted[rows, best] + D_sorted[rows, best + 1]) / 2
+    return np.maximum(gains[rows, best], 0.0), threshold
+
+
+class ShapeletTransform(TransformerMixin, BaseEstimator):
+    """Discover discriminative shapelets and map series to shapelet distances.
+
+    Args:
+        n_shapelets: Number of shapelets kept
+        lengths: Candidate shapelet lengths in samples
+        n_candidates: Total candidate subsequences sampled from the training set
+        normalize: Use z-normalized window distances (MASS); False = raw Euclidean
+        max_eval_series: Rank candidates on a stratified subsample of at most this
+            many training series (None = all)
+        random_state: Seed for candidate sampling
+        n_jobs: Threads for the FFTs (-1 = all cores)
+    """
+
+    def __init__(self, n_shapelets=10, lengths=(15, 30, 50, 100), n_candidates=2000,
+                 normalize=True, max_eval_series=None, random_state=None, n_jobs=-1):
+        self.n_shapelets = n_shapelets
+        self.lengths = lengths
+        self.n_candidates = n_candidates
+        self.normalize = normalize
+        self.max_eval_series = max_eval_series
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+
+    def _sample_candidates(self, n_series, length, rng):
+        lengths = rng.choice(np.asarray(self.lengths), size=self.n_candidates)
+        series = rng.integers(0, n_series, size=self.n_candidates)
+        starts = (rng.random(self.n_candidates) * (length - lengths + 1)).astype(int)
+        candidates = pd.DataFrame({'series': series, 'start': starts, 'length': lengths})
+        return candidates.drop_duplicates().sort_values('length', ignore_index=True)
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y)
+        rng = np.random.default_rng(self.random_state)
+
+        eval_rows = np.arange(len(X))
+        if self.max_eval_series is not None and self.max_eval_series < len(X):
+            # Stratified subsample keeps the class ratio for the gain estimates
+            per_class = [rng.permutation(np.flatnonzero(y == c)) for c in np.unique(y)]
+            frac = self.max_eval_series / len(X)
+            eval_rows = np.sort(np.concatenate([rows[:max(1, int(round(frac * len(rows))))]
+                                                for rows in per_class]))
+
+        sliding = SlidingDistance(X[eval_rows], max(self.lengths), workers=self.n_jobs)
+        candidates = self._sample_candidates(len(X), X.shape[1], rng)
+
+        D = np.empty((len(candidates), len(eval_rows)))
+        for i, cand in enumerate(candidates.itertuples()):
+            q = X[cand.series, cand.start:cand.start + cand.length]
+            D[i], _ = sliding.min_distances(q, normalize=self.normalize)
+        candidates['gain'], candidates['threshold'] = information_gain(D, y[eval_rows])
+
+        # Greedy top-k by gain, skipping windows overlapping an already chosen one
+        chosen = []
+        for cand in candidates.sort_values('gain', ascending=False, kind='stable').itertuples():
+            overlaps = any(c.series == cand.series
+                           and c.start < cand.start + cand.length
+                           and cand.start < c.start + c.length for c in chosen)
+            if not overlaps:
+                chosen.append(cand)
+            if len(chosen) == self.n_shapelets:
+                break
+
+        self.shapelet_info_ = pd.DataFrame(chosen).drop(columns='Index').reset_index(drop=True)
+        self.shapelets_ = [X[c.series, c.start:c.start + c.length].copy() for c in chosen]
+        self.n_candidates_evaluated_ = len(candidates)
+        return self
+
+    def transform(self, X):
+        """Distances of every series to every shapelet, shape (n_series, n_shapelets)."""
+        X = np.asarray(X, dtype=float)
+        sliding = SlidingDistance(X, max(len(s) for s in self.shapelets_), workers=self.n_jobs)
+        return np.column_stack([sliding.min_distances(s, normalize=self.normalize)[0]
+                                for s in self.shapelets_])